@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from acoount.search import UserSearchIndex
+
+
+class Command(BaseCommand):
+    """Rebuild the recipient autocomplete index from scratch"""
+    help = 'بازسازی ایندکس جستجوی کاربران'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Users loaded per database round trip')
+    
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = UserSearchIndex.rebuild(batch_size=options['batch_size'])
+        
+        self.stdout.write(self.style.SUCCESS(f'{count} users indexed'))
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.7 on 2026-10-17 17:56
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_search_terms(apps, schema_editor):
+    """Index the email, username and profile name prefixes of existing users"""
+    User = apps.get_model('acoount', 'User')
+    UserSearchTerm = apps.get_model('acoount', 'UserSearchTerm')
+    
+    def normalize(text):
+        return ' '.join((text or '').lower().split())
+    
+    terms = []
+    users = User.objects.exclude(email__isnull=True).exclude(email='').values_list('id', 'email', 'username', 'profile__name')
+    for user_id, email, username, name in users.iterator(chunk_size=1000):
+        name = normalize(name)
+        user_terms = {term[:250] for term in (normalize(email), normalize(username), name, *name.split()) if term}
+        terms += [UserSearchTerm(user_id=user_id, term=term) for term in user_terms]
+        if len(terms) >= 1000:
+            UserSearchTerm.objects.bulk_create(terms)
+            terms = []
+    UserSearchTerm.objects.bulk_create(terms)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('acoount', '0004_auto_20260208_2317'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserSearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=250, verbose_name='عبارت')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='search_terms', to=settings.AUTH_USER_MODEL, verbose_name='کاربر')),
+            ],
+            options={
+                'verbose_name': 'عبارت جستجوی کاربر',
+                'verbose_name_plural': 'عبارت\u200cهای جستجوی کاربر',
+                'indexes': [models.Index(fields=['term'], name='acoount_search_term_like', opclasses=['varchar_pattern_ops'])],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='usersearchterm',
+            constraint=models.UniqueConstraint(fields=('term', 'user'), name='unique_user_search_term'),
+        ),
+        migrations.RunPython(create_search_terms, migrations.RunPython.noop),
+    ]
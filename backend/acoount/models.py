@@ -68,3 +68,28 @@ class Profile(models.Model):
         if self.name:
             return self.name
         return self.user.username
+
+
+class UserSearchTerm(models.Model):
+    """
+    Normalized prefix-search terms of a user (recipient autocomplete)
+    
+    One row per lowercased email, username, profile name and name word;
+    prefix lookups are range scans over the term index (see search.py).
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='search_terms', verbose_name='کاربر')
+    term = models.CharField(max_length=250, verbose_name='عبارت')
+    
+    class Meta:
+        verbose_name = 'عبارت جستجوی کاربر'
+        verbose_name_plural = 'عبارت‌های جستجوی کاربر'
+        constraints = [
+            models.UniqueConstraint(fields=['term', 'user'], name='unique_user_search_term'),
+        ]
+        indexes = [
+            # LIKE 'prefix%' on PostgreSQL with a non-C collation
+            models.Index(fields=['term'], name='acoount_search_term_like', opclasses=['varchar_pattern_ops']),
+        ]
+    
+    def __str__(self):
+        return f"{self.user_id} - {self.term}"
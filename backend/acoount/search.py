@@ -0,0 +1,146 @@
+from django.db import transaction
+from django.db.models import Q
+from .models import User, UserSearchTerm
+
+
+class UserSearchIndex:
+    """
+    Prefix-search index of users for recipient autocomplete
+
+    Every user with an email gets one UserSearchTerm row per normalized
+    (lowercased) email, username, profile name and profile name word. A
+    prefix lookup is a range scan `prefix <= term < prefix + U+10FFFF` over
+    the term index, so its cost does not grow with the number of users.
+    Rows are refreshed by the User/Profile signals (see signals.py).
+    """
+
+    # Highest code point: every string starting with a prefix sorts below prefix + TERM_END
+    TERM_END = '\U0010ffff'
+
+    TERM_LENGTH = UserSearchTerm._meta.get_field('term').max_length
+
+    @staticmethod
+    def normalize(text):
+        return ' '.join((text or '').lower().split())
+
+    @staticmethod
+    def get_terms(email, username, name=None):
+        """
+        Build the search terms of a user
+
+        Returns:
+            Set of normalized terms
+        """
+        terms = {UserSearchIndex.normalize(email), UserSearchIndex.normalize(username)}
+        name = UserSearchIndex.normalize(name)
+        if name:
+            terms.add(name)
+            terms.update(name.split())
+        return {term[:UserSearchIndex.TERM_LENGTH] for term in terms if term}
+
+    @staticmethod
+    def index_users(users):
+        """
+        Replace the search terms of users
+
+        Args:
+            users: Iterable of User objects (profile loaded or loadable)
+        """
+        users = list(users)
+        if not users:
+            return
+        terms = []
+        for user in users:
+            if not user.email:
+                # Users without an email cannot be recipients
+                continue
+            profile = getattr(user, 'profile', None)
+            for term in UserSearchIndex.get_terms(user.email, user.username, profile.name if profile else None):
+                terms.append(UserSearchTerm(user=user, term=term))
+        with transaction.atomic():
+            UserSearchTerm.objects.filter(user__in=users).delete()
+            UserSearchTerm.objects.bulk_create(terms)
+
+    @staticmethod
+    def index_user(user):
+        """Replace the search terms of one user"""
+        UserSearchIndex.index_users([user])
+
+    @staticmethod
+    def rebuild(batch_size=1000):
+        """
+        Rebuild the search terms of every user
+
+        Returns:
+            Number of indexed users
+        """
+        UserSearchTerm.objects.all().delete()
+        count = 0
+        last_id = 0
+        while True:
+            users = list(
+                User.objects.filter(id__gt=last_id).select_related('profile').order_by('id')[:batch_size]
+            )
+            if not users:
+                break
+            last_id = users[-1].id
+            UserSearchIndex.index_users(users)
+            count += len(users)
+        return count
+
+    @staticmethod
+    def prefix_filter(query, prefix='term'):
+        """
+        Filter kwargs matching terms that start with a query
+
+        Args:
+            query: Raw query string
+            prefix: Lookup path of the term field (e.g. 'peer__search_terms__term')
+
+        Returns:
+            dict of filter kwargs, empty if the query normalizes to nothing
+        """
+        query = UserSearchIndex.normalize(query)[:UserSearchIndex.TERM_LENGTH]
+        if not query:
+            return {}
+        # The range uses the term index on every backend, startswith keeps the match exact
+        return {
+            f'{prefix}__gte': query,
+            f'{prefix}__lt': query + UserSearchIndex.TERM_END,
+            f'{prefix}__startswith': query,
+        }
+
+    @staticmethod
+    def search(query, limit, exclude_ids=()):
+        """
+        Find users with a term starting with a query
+
+        Args:
+            query: Raw query string
+            limit: Maximum number of users
+            exclude_ids: User ids left out of the result
+
+        Returns:
+            List of user ids, by matching term
+        """
+        lookup = UserSearchIndex.prefix_filter(query)
+        if not lookup or limit <= 0:
+            return []
+
+        exclude_ids = set(exclude_ids)
+        user_ids = []
+        last = None
+        # Read the (term, user) index in windows until enough distinct users are found
+        while len(user_ids) < limit:
+            terms = UserSearchTerm.objects.filter(**lookup)
+            if last is not None:
+                terms = terms.filter(Q(term__gt=last[0]) | Q(term=last[0], user_id__gt=last[1]))
+            window = list(terms.order_by('term', 'user_id').values_list('term', 'user_id')[:limit * 4])
+            for term, user_id in window:
+                if user_id not in exclude_ids:
+                    exclude_ids.add(user_id)
+                    user_ids.append(user_id)
+            if len(window) < limit * 4:
+                break
+            last = window[-1]
+        return user_ids[:limit]
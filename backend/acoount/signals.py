@@ -1,6 +1,7 @@
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from .models import User, Profile
+from .search import UserSearchIndex
 
 
 @receiver(post_save, sender=User)
@@ -9,3 +10,18 @@ def create_user_profile(sender, instance, created, **kwargs):
     if created:
         Profile.objects.create(user=instance)
 
+
+@receiver(post_save, sender=User)
+def index_user_search_terms(sender, instance, update_fields=None, **kwargs):
+    """Refresh the autocomplete terms when the email or username changes"""
+    if update_fields and not {'email', 'username'} & set(update_fields):
+        return
+    UserSearchIndex.index_user(instance)
+
+
+@receiver(post_save, sender=Profile)
+def index_profile_search_terms(sender, instance, created, update_fields=None, **kwargs):
+    """Refresh the autocomplete terms when the profile name changes"""
+    if (created and not instance.name) or (update_fields and 'name' not in update_fields):
+        return
+    UserSearchIndex.index_user(instance.user)
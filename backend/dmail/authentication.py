@@ -0,0 +1,22 @@
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+
+class QueryTokenJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that also accepts the access token as `?token=`
+
+    For URLs loaded by the browser itself (<audio src>, EventSource), which
+    cannot send an Authorization header. The header wins when both are given.
+    Works on DRF requests and on plain Django requests (async views).
+    """
+
+    QUERY_PARAM = 'token'
+
+    def authenticate(self, request):
+        if self.get_header(request) is not None:
+            return super().authenticate(request)
+        raw_token = getattr(request, 'query_params', request.GET).get(self.QUERY_PARAM)
+        if not raw_token:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return self.get_user(validated_token), validated_token
@@ -0,0 +1,152 @@
+import mimetypes
+import re
+from urllib.parse import quote
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, quote_etag
+
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class FileDownload:
+    """
+    Serve a stored file with conditional requests, byte ranges and web server offload
+
+    - If-None-Match / If-Modified-Since answer 304 without opening the file
+    - A single `Range: bytes=...` is answered with 206 (multiple ranges get the whole file)
+    - settings.SENDFILE_BACKEND 'nginx' (X-Accel-Redirect) or 'apache' (X-Sendfile)
+      hands the transfer, ranges included, to the web server
+    - otherwise FileResponse streams the file, using the server's
+      wsgi.file_wrapper (sendfile) when it has one
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    CACHE_CONTROL = 'private, max-age=0, must-revalidate'
+
+    def __init__(self, file, size, etag, last_modified=None, filename=None, content_type=None, as_attachment=True,
+                 cache_control=None):
+        """
+        Args:
+            file: FieldFile / File to serve
+            size: File size in bytes
+            etag: Strong validator of the content (unquoted)
+            last_modified: datetime the content last changed
+            filename: Download file name
+            content_type: MIME type (guessed from filename if omitted)
+            as_attachment: Content-Disposition attachment (True) or inline
+            cache_control: Cache-Control header (default CACHE_CONTROL)
+        """
+        self.file = file
+        self.size = size
+        self.etag = quote_etag(etag)
+        self.last_modified = last_modified
+        self.filename = filename
+        self.content_type = content_type or mimetypes.guess_type(filename or '')[0] or 'application/octet-stream'
+        self.as_attachment = as_attachment
+        self.cache_control = cache_control or self.CACHE_CONTROL
+
+    def response(self, request):
+        """Build the response for a GET/HEAD request"""
+        last_modified = int(self.last_modified.timestamp()) if self.last_modified else None
+        conditional = get_conditional_response(request, etag=self.etag, last_modified=last_modified)
+        if conditional is not None:
+            return self.add_headers(conditional)
+
+        response = self.offload_response()
+        if response is not None:
+            return self.add_headers(response)
+
+        byte_range = self.parse_range(request)
+        if byte_range == 'unsatisfiable':
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{self.size}'
+            return self.add_headers(response)
+
+        if byte_range:
+            start, end = byte_range
+            response = StreamingHttpResponse(self.read_range(start, end), status=206, content_type=self.content_type)
+            response['Content-Range'] = f'bytes {start}-{end}/{self.size}'
+            response['Content-Length'] = str(end - start + 1)
+        else:
+            response = FileResponse(self.file.open('rb'), content_type=self.content_type)
+            response['Content-Length'] = str(self.size)
+
+        return self.add_headers(response)
+
+    def add_headers(self, response):
+        response['ETag'] = self.etag
+        response['Accept-Ranges'] = 'bytes'
+        response['Cache-Control'] = self.cache_control
+        if self.last_modified:
+            response['Last-Modified'] = http_date(self.last_modified.timestamp())
+        if response.status_code in (200, 206) and self.filename:
+            response['Content-Disposition'] = content_disposition_header(self.as_attachment, self.filename)
+        return response
+
+    def offload_response(self):
+        """X-Accel-Redirect / X-Sendfile response, or None to serve from Django"""
+        backend = getattr(settings, 'SENDFILE_BACKEND', None)
+        if backend == 'nginx':
+            response = HttpResponse(content_type=self.content_type)
+            response['X-Accel-Redirect'] = quote(getattr(settings, 'SENDFILE_URL', '/protected/') + self.file.name)
+            return response
+        if backend == 'apache':
+            try:
+                path = self.file.path
+            except NotImplementedError:
+                # Remote storage: no local path to hand over
+                return None
+            response = HttpResponse(content_type=self.content_type)
+            response['X-Sendfile'] = path
+            return response
+        return None
+
+    def parse_range(self, request):
+        """
+        Parse a single byte range of the request
+
+        Returns:
+            (start, end) inclusive, None to send the whole file, or 'unsatisfiable'
+        """
+        header = request.META.get('HTTP_RANGE', '').strip()
+        if not header or self.size == 0:
+            return None
+
+        # A stale If-Range validator means the client wants the whole new content
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if if_range and if_range.strip() != self.etag:
+            return None
+
+        match = RANGE_PATTERN.match(header)
+        if not match or match.group(1) == match.group(2) == '':
+            return None
+
+        first, last = match.groups()
+        if first == '':
+            # Suffix range: the last N bytes
+            if int(last) == 0:
+                return 'unsatisfiable'
+            return max(self.size - int(last), 0), self.size - 1
+
+        start = int(first)
+        if start >= self.size:
+            return 'unsatisfiable'
+        if last and int(last) < start:
+            return None
+        end = min(int(last), self.size - 1) if last else self.size - 1
+        return start, end
+
+    def read_range(self, start, end):
+        """Yield bytes start..end (inclusive) of the file in chunks"""
+        remaining = end - start + 1
+        with self.file.open('rb') as source:
+            source.seek(start)
+            while remaining > 0:
+                chunk = source.read(min(self.CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
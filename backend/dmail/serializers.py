@@ -0,0 +1,46 @@
+from rest_framework import serializers
+
+
+class SparseFieldsetMixin:
+    """
+    Render only the fields a client asks for with `?fields=a,b,c`
+
+    Applies to the top-level serializer of a response (or the child of a
+    top-level many=True list); nested serializers render in full. Fields
+    left out are never computed, so skipped method fields cost nothing.
+    Unknown names are ignored; when none of the names match, or the
+    parameter is absent, every field is rendered. A `fields` keyword
+    argument takes precedence over the query parameter.
+    """
+
+    FIELDS_PARAM = 'fields'
+
+    def __init__(self, *args, **kwargs):
+        self.requested_fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        requested = self.get_requested_fields()
+        if not requested:
+            return fields
+        sparse = {name: field for name, field in fields.items() if name in requested}
+        return sparse or fields
+
+    def get_requested_fields(self):
+        """Names of the requested fields, or None to render all of them"""
+        if self.requested_fields is not None:
+            return set(self.requested_fields)
+
+        parent = self.parent
+        if isinstance(parent, serializers.ListSerializer):
+            parent = parent.parent
+        if parent is not None:
+            return None
+
+        request = self.context.get('request')
+        params = getattr(request, 'query_params', None) or getattr(request, 'GET', None)
+        value = params.get(self.FIELDS_PARAM) if params else None
+        if not value:
+            return None
+        return {name.strip() for name in value.split(',') if name.strip()}
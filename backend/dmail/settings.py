@@ -132,6 +132,12 @@ STATICFILES_DIRS = [
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Protected file downloads (message attachments)
+# None serves files from Django; 'nginx' sends X-Accel-Redirect to an internal
+# location at SENDFILE_URL aliased to MEDIA_ROOT; 'apache' sends X-Sendfile
+SENDFILE_BACKEND = None
+SENDFILE_URL = '/protected/'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -140,6 +146,32 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Custom User Model
 AUTH_USER_MODEL = 'acoount.User'
 
+# Cache
+# LocMemCache evicts least recently used keys past MAX_ENTRIES; point
+# BACKEND at Redis/Memcached to share cached data between workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'dmail',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
+# Message bodies larger than this many bytes are stored zlib-compressed
+# (None disables compression; see message/fields.py)
+MESSAGE_BODY_COMPRESSION_THRESHOLD = 4096
+
+# Threads extracting the metadata of uploaded songs in the background
+# (0 extracts inline during the upload request; see music/ingest.py)
+MUSIC_INGEST_WORKERS = 2
+
+# Real-time mailbox events (GET /api/message/events/, served through ASGI)
+# The in-process broker only reaches streams of the same worker; use
+# 'message.events.RedisBroker' (MESSAGE_EVENTS_REDIS_URL) for several workers
+MESSAGE_EVENTS_BROKER = 'message.events.InProcessBroker'
+
 # REST Framework Settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
@@ -0,0 +1,147 @@
+import hashlib
+import mimetypes
+import os
+from datetime import timedelta
+from django.core.files.storage import default_storage
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
+from .models import AttachmentBlob, Message, attachment_blob_path
+
+
+class AttachmentStore:
+    """
+    Content-addressed, deduplicated attachment storage
+
+    Uploads are hashed (SHA-256) while their chunks are read and stored once
+    under attachments/ab/cd/<sha256>. Messages reference the AttachmentBlob
+    row and its ref_count tracks how many do; blobs whose count dropped to
+    zero are removed by collect_garbage (see the collect_attachment_blobs
+    command).
+    """
+
+    # Unreferenced blobs younger than this are kept, an upload may be about to reference them
+    GC_GRACE_PERIOD = timedelta(hours=1)
+
+    @staticmethod
+    def hash_file(file):
+        """
+        Hash a file by reading its chunks
+
+        Returns:
+            (sha256 hex digest, size in bytes)
+        """
+        digest = hashlib.sha256()
+        size = 0
+        if hasattr(file, 'seek'):
+            file.seek(0)
+        chunks = file.chunks() if hasattr(file, 'chunks') else iter(lambda: file.read(64 * 1024), b'')
+        for chunk in chunks:
+            digest.update(chunk)
+            size += len(chunk)
+        if hasattr(file, 'seek'):
+            file.seek(0)
+        return digest.hexdigest(), size
+
+    @staticmethod
+    def guess_mime(name, content_type=None):
+        """MIME type of an attachment from its file name, then the client-sent content type"""
+        return mimetypes.guess_type(name or '')[0] or content_type or 'application/octet-stream'
+
+    @staticmethod
+    def store(file):
+        """
+        Store a file (or link an identical stored one) and take a reference on it
+
+        Must run in the transaction that creates the referencing message, so
+        the reference is rolled back with it.
+
+        Args:
+            file: Uploaded file or Django File
+
+        Returns:
+            AttachmentBlob object
+        """
+        sha256, size = AttachmentStore.hash_file(file)
+
+        updated = AttachmentBlob.objects.filter(sha256=sha256).update(ref_count=models.F('ref_count') + 1)
+        if updated:
+            return AttachmentBlob.objects.get(sha256=sha256)
+
+        path = attachment_blob_path(sha256)
+        if not default_storage.exists(path):
+            path = default_storage.save(path, file)
+
+        try:
+            with transaction.atomic():
+                return AttachmentBlob.objects.create(sha256=sha256, file=path, size=size, ref_count=1)
+        except IntegrityError:
+            # Stored concurrently by another upload
+            AttachmentBlob.objects.filter(sha256=sha256).update(ref_count=models.F('ref_count') + 1)
+            return AttachmentBlob.objects.get(sha256=sha256)
+
+    @staticmethod
+    def release(blob_id):
+        """Drop one reference on a blob (the file is removed later by collect_garbage)"""
+        AttachmentBlob.objects.filter(id=blob_id, ref_count__gt=0).update(ref_count=models.F('ref_count') - 1)
+
+    @staticmethod
+    def adopt(message):
+        """
+        Move a legacy attachment (stored per message) into the blob store
+
+        Returns:
+            True if the message now references a blob
+        """
+        if message.attachment_blob_id or not message.attachment:
+            return False
+
+        legacy_name = message.attachment.name
+        try:
+            source = message.attachment.open('rb')
+        except (OSError, ValueError):
+            return False
+
+        with source, transaction.atomic():
+            blob = AttachmentStore.store(source)
+            name = message.attachment_name or os.path.basename(legacy_name)
+            Message.objects.filter(id=message.id).update(
+                attachment=blob.file.name,
+                attachment_blob=blob,
+                attachment_name=name,
+                attachment_size=blob.size,
+                attachment_mime=message.attachment_mime or AttachmentStore.guess_mime(name)
+            )
+            if legacy_name != blob.file.name:
+                transaction.on_commit(lambda: default_storage.delete(legacy_name))
+        return True
+
+    @staticmethod
+    def collect_garbage(dry_run=False):
+        """
+        Delete blobs no message references anymore
+
+        Returns:
+            (number of blobs, number of bytes) removed
+        """
+        referenced = Message.objects.filter(attachment_blob=models.OuterRef('pk'))
+        candidates = AttachmentBlob.objects.filter(
+            ref_count=0,
+            created_at__lt=timezone.now() - AttachmentStore.GC_GRACE_PERIOD
+        ).exclude(models.Exists(referenced))
+
+        count = 0
+        size = 0
+        for blob_id in candidates.values_list('id', flat=True).iterator():
+            with transaction.atomic():
+                # Re-check under lock: an upload may have linked the blob meanwhile
+                blob = AttachmentBlob.objects.select_for_update().filter(id=blob_id, ref_count=0).first()
+                if blob is None or Message.objects.filter(attachment_blob=blob).exists():
+                    continue
+                count += 1
+                size += blob.size
+                if dry_run:
+                    continue
+                name = blob.file.name
+                blob.delete()
+                transaction.on_commit(lambda name=name: default_storage.delete(name))
+        return count, size
@@ -0,0 +1,66 @@
+from django.core.cache import cache
+from .models import Block
+
+
+class BlockGraph:
+    """
+    Cached per-user block list
+
+    Each user's outgoing Block rows are stored under one cache key as a
+    {blocked_id: is_spam} dict, loaded lazily and expired after
+    CACHE_TIMEOUT. The cache backend bounds the number of users kept
+    (LocMemCache evicts the least recently used past MAX_ENTRIES).
+    MessageService invalidates a user's entry whenever it writes their blocks.
+    """
+
+    CACHE_KEY = 'message:block_graph:{user_id}'
+    CACHE_TIMEOUT = 600
+
+    @staticmethod
+    def cache_key(user_id):
+        return BlockGraph.CACHE_KEY.format(user_id=user_id)
+
+    @staticmethod
+    def get_many(user_ids):
+        """
+        Get the block lists of several users
+
+        Missing users are loaded with a single Block query.
+
+        Args:
+            user_ids: Iterable of blocker user ids
+
+        Returns:
+            dict mapping user id to a {blocked_id: is_spam} dict
+        """
+        user_ids = set(user_ids)
+        if not user_ids:
+            return {}
+
+        keys = {BlockGraph.cache_key(user_id): user_id for user_id in user_ids}
+        cached = cache.get_many(keys.keys())
+        graphs = {keys[key]: value for key, value in cached.items()}
+
+        missing = user_ids - graphs.keys()
+        if missing:
+            loaded = {user_id: {} for user_id in missing}
+            blocks = Block.objects.filter(blocker_id__in=missing).values_list('blocker_id', 'blocked_id', 'is_spam')
+            for blocker_id, blocked_id, is_spam in blocks:
+                loaded[blocker_id][blocked_id] = is_spam
+            cache.set_many(
+                {BlockGraph.cache_key(user_id): graph for user_id, graph in loaded.items()},
+                BlockGraph.CACHE_TIMEOUT
+            )
+            graphs.update(loaded)
+
+        return graphs
+
+    @staticmethod
+    def get(user_id):
+        """Get the {blocked_id: is_spam} dict of a user"""
+        return BlockGraph.get_many([user_id])[user_id]
+
+    @staticmethod
+    def invalidate(user_id):
+        """Drop the cached block list of a user"""
+        cache.delete(BlockGraph.cache_key(user_id))
@@ -0,0 +1,175 @@
+import asyncio
+import itertools
+import json
+import threading
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+
+class InProcessBroker:
+    """
+    Deliver mailbox events to subscribers of the same process
+
+    Each subscriber gets a bounded asyncio queue; publishing is thread-safe
+    (services run in sync threads under ASGI) and never blocks: a full
+    queue drops the event, the client resyncs from the REST API.
+    """
+
+    QUEUE_SIZE = 100
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}
+
+    def publish(self, user_id, event):
+        """Send an event to every open stream of a user"""
+        with self.lock:
+            queues = list(self.subscribers.get(user_id, ()))
+        for loop, queue in queues:
+            loop.call_soon_threadsafe(self.offer, queue, event)
+
+    @staticmethod
+    def offer(queue, event):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+    async def subscribe(self, user_id, timeout=None):
+        """
+        Async iterator over the events of a user, until the consumer stops
+
+        Yields None when no event arrived for `timeout` seconds.
+        """
+        queue = asyncio.Queue(maxsize=self.QUEUE_SIZE)
+        subscriber = (asyncio.get_running_loop(), queue)
+        with self.lock:
+            self.subscribers.setdefault(user_id, set()).add(subscriber)
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            with self.lock:
+                subscribers = self.subscribers.get(user_id, set())
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    self.subscribers.pop(user_id, None)
+
+
+class RedisBroker:
+    """
+    Deliver mailbox events across workers through Redis pub/sub
+
+    Requires the `redis` package (redis>=4.2 for redis.asyncio) and
+    settings.MESSAGE_EVENTS_REDIS_URL.
+    """
+
+    CHANNEL = 'message:events:{user_id}'
+
+    def __init__(self):
+        try:
+            import redis
+            import redis.asyncio
+        except ImportError:
+            raise ImproperlyConfigured('RedisBroker requires the redis package')
+        url = getattr(settings, 'MESSAGE_EVENTS_REDIS_URL', 'redis://localhost:6379/0')
+        self.client = redis.Redis.from_url(url)
+        self.async_client = redis.asyncio.Redis.from_url(url)
+
+    def publish(self, user_id, event):
+        self.client.publish(self.CHANNEL.format(user_id=user_id), json.dumps(event))
+
+    async def subscribe(self, user_id, timeout=None):
+        pubsub = self.async_client.pubsub(ignore_subscribe_messages=True)
+        await pubsub.subscribe(self.CHANNEL.format(user_id=user_id))
+        try:
+            while True:
+                message = await pubsub.get_message(timeout=timeout)
+                yield json.loads(message['data']) if message else None
+        finally:
+            await pubsub.unsubscribe()
+            await pubsub.close()
+
+
+class MessageEvents:
+    """
+    Publish compact mailbox events ("new message", "message changed") to users
+
+    The broker class is settings.MESSAGE_EVENTS_BROKER (default: the
+    in-process broker, enough for a single ASGI worker). Events are sent
+    after the surrounding transaction commits.
+    """
+
+    DEFAULT_BROKER = 'message.events.InProcessBroker'
+
+    broker = None
+    sequence = itertools.count(1)
+
+    @classmethod
+    def get_broker(cls):
+        if cls.broker is None:
+            cls.broker = import_string(getattr(settings, 'MESSAGE_EVENTS_BROKER', cls.DEFAULT_BROKER))()
+        return cls.broker
+
+    @classmethod
+    def publish(cls, user_ids, event):
+        """
+        Publish an event to users once the current transaction commits
+
+        Args:
+            user_ids: Iterable of user ids
+            event: JSON-serializable dict with a 'type' key
+        """
+        user_ids = set(user_ids)
+        if not user_ids:
+            return
+
+        def send():
+            broker = cls.get_broker()
+            for user_id in user_ids:
+                broker.publish(user_id, {**event, 'seq': next(cls.sequence)})
+
+        transaction.on_commit(send)
+
+    @classmethod
+    def message_created(cls, messages):
+        """Notify the participants of new messages"""
+        for message in messages:
+            cls.publish({message.sender_id, message.receiver_id} - {None}, {
+                'type': 'message.new',
+                'id': message.id,
+                'subject': message.subject,
+                'sender': message.sender.email,
+                'receiver': message.receiver.email if message.receiver_id else None,
+                'created_at': message.created_at.isoformat(),
+            })
+
+    @classmethod
+    def message_updated(cls, rows, changes):
+        """
+        Notify users of changed mailbox state
+
+        Args:
+            rows: Iterable of (user_id, message_id)
+            changes: dict of changed fields, e.g. {'is_starred': True}
+        """
+        by_user = {}
+        for user_id, message_id in rows:
+            by_user.setdefault(user_id, []).append(message_id)
+        for user_id, message_ids in by_user.items():
+            cls.publish([user_id], {'type': 'message.updated', 'ids': message_ids, 'changes': changes})
+
+    @classmethod
+    def message_removed(cls, user_id, message_ids):
+        """Notify a user that messages left their mailbox"""
+        cls.publish([user_id], {'type': 'message.removed', 'ids': list(message_ids)})
+
+    @staticmethod
+    def format_sse(event):
+        """Render an event as a Server-Sent Events frame"""
+        return f"id: {event.get('seq', '')}\nevent: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
@@ -0,0 +1,175 @@
+import json
+import os
+import re
+import zipfile
+from email.message import EmailMessage
+from email.utils import format_datetime
+from .services import MessageService
+
+
+# mboxrd quoting: any line starting with ">*From " gets one more '>'
+MBOX_FROM_LINE = re.compile(rb'^(>*From )', re.MULTILINE)
+
+# Line breaks inside a header value would start a new header
+HEADER_LINE_BREAKS = re.compile(r'\s*[\r\n\v\f\x1c-\x1e\x85\u2028\u2029]+\s*')
+
+
+class StreamBuffer:
+    """Write-only file object whose contents are drained after every write"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+class MailboxExporter:
+    """
+    Stream a user's mailbox as JSON Lines or mbox, optionally zipped with attachments
+
+    Messages are read with QuerySet.iterator() and every record is yielded
+    as soon as it is rendered, so memory use does not grow with the size of
+    the mailbox. The zip archive is written without seeking (data
+    descriptors), attachments are copied in CHUNK_SIZE blocks.
+    """
+
+    FORMATS = {
+        'jsonl': ('application/x-ndjson', 'jsonl'),
+        'mbox': ('application/mbox', 'mbox'),
+    }
+
+    # Messages loaded per database round trip
+    BATCH_SIZE = 500
+
+    # Attachment bytes copied per read
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, user, export_format='jsonl', message_type='mailbox', batch_size=None):
+        if export_format not in self.FORMATS:
+            raise ValueError(f'Unsupported export format: {export_format}')
+        self.user = user
+        self.export_format = export_format
+        self.message_type = message_type
+        self.batch_size = batch_size or self.BATCH_SIZE
+
+    @property
+    def content_type(self):
+        return self.FORMATS[self.export_format][0]
+
+    @property
+    def filename(self):
+        return f'mailbox-{self.user.username}.{self.FORMATS[self.export_format][1]}'
+
+    def iter_messages(self):
+        """Iterate the exported messages in chunks"""
+        messages = MessageService.get_user_messages(self.user, message_type=self.message_type)
+        return messages.iterator(chunk_size=self.batch_size)
+
+    @staticmethod
+    def to_record(message):
+        """Build the JSON record of a message"""
+        return {
+            'id': message.id,
+            'subject': message.subject,
+            'body': message.body,
+            'sender': message.sender.email,
+            'receiver': message.receiver.email if message.receiver_id else None,
+            'is_private': message.is_private,
+            'status': message.status,
+            'folder': message.mailbox_folder,
+            'is_starred': bool(message.mailbox_is_starred),
+            'is_read': bool(message.mailbox_is_read),
+            'is_archived': bool(message.mailbox_is_archived),
+            'is_spam': bool(message.mailbox_is_spam),
+            'created_at': message.created_at.isoformat(),
+            'sent_at': message.sent_at.isoformat() if message.sent_at else None,
+            'read_at': message.read_at.isoformat() if message.read_at else None,
+            'attachment': MailboxExporter.attachment_path(message),
+            'public_link': str(message.public_link),
+        }
+
+    @staticmethod
+    def to_jsonl(message):
+        """Render a message as one JSON Lines record"""
+        return (json.dumps(MailboxExporter.to_record(message), ensure_ascii=False) + '\n').encode('utf-8')
+
+    @staticmethod
+    def header_value(value):
+        """Fold a user-provided header value onto one line"""
+        return HEADER_LINE_BREAKS.sub(' ', value or '').strip()
+
+    @staticmethod
+    def to_mbox(message):
+        """Render a message as one mboxrd entry"""
+        header = MailboxExporter.header_value
+        sender = header(message.sender.email)
+        email = EmailMessage()
+        email['From'] = sender
+        if message.receiver_id:
+            email['To'] = header(message.receiver.email)
+        email['Subject'] = header(message.subject)
+        email['Date'] = format_datetime(message.sent_at or message.created_at)
+        email['Message-ID'] = f'<{message.public_link}@dmail>'
+        if message.mailbox_folder:
+            email['X-Dmail-Folder'] = header(message.mailbox_folder)
+        if message.attachment:
+            email['X-Dmail-Attachment'] = header(MailboxExporter.attachment_path(message))
+        email.set_content(message.body or '', cte='8bit')
+
+        envelope = f'From {sender} {(message.sent_at or message.created_at).strftime("%a %b %d %H:%M:%S %Y")}\n'
+        body = MBOX_FROM_LINE.sub(rb'>\1', email.as_bytes())
+        return envelope.encode('utf-8') + body.rstrip(b'\n') + b'\n\n'
+
+    @staticmethod
+    def attachment_path(message):
+        """Path of a message's attachment inside the export archive"""
+        if not message.attachment:
+            return None
+        return f'attachments/{message.id}/{message.attachment_name or os.path.basename(message.attachment.name)}'
+
+    def render(self, message):
+        if self.export_format == 'mbox':
+            return self.to_mbox(message)
+        return self.to_jsonl(message)
+
+    def stream(self):
+        """Yield the export file in chunks"""
+        for message in self.iter_messages():
+            yield self.render(message)
+
+    def stream_zip(self):
+        """
+        Yield a zip archive with the export file and every attachment
+
+        The messages are read twice: once for the export file, then for the
+        attachments, so no list of messages is kept in memory.
+        """
+        buffer = StreamBuffer()
+        with zipfile.ZipFile(buffer, mode='w', compression=zipfile.ZIP_DEFLATED) as archive:
+            with archive.open(self.filename, mode='w', force_zip64=True) as entry:
+                for message in self.iter_messages():
+                    entry.write(self.render(message))
+                    yield buffer.drain()
+
+            for message in self.iter_messages():
+                if not message.attachment:
+                    continue
+                try:
+                    source = message.attachment.open('rb')
+                except (OSError, ValueError):
+                    continue
+                with source, archive.open(self.attachment_path(message), mode='w', force_zip64=True) as entry:
+                    for chunk in iter(lambda: source.read(self.CHUNK_SIZE), b''):
+                        entry.write(chunk)
+                        yield buffer.drain()
+        yield buffer.drain()
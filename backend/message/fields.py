@@ -0,0 +1,94 @@
+import base64
+import zlib
+from django.conf import settings
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+
+class CompressedText(str):
+    """Stored (compressed) form of a text value that has not been decoded yet"""
+
+
+class CompressedTextDescriptor(DeferredAttribute):
+    """Decode a compressed value on first attribute access and keep the result"""
+
+    def __get__(self, instance, cls=None):
+        value = super().__get__(instance, cls)
+        if isinstance(value, CompressedText):
+            value = self.field.decompress(value)
+            instance.__dict__[self.field.attname] = value
+        return value
+
+    def __set__(self, instance, value):
+        # Being a data descriptor keeps __get__ in front of the instance __dict__
+        instance.__dict__[self.field.attname] = value
+
+
+class CompressedTextField(models.TextField):
+    """
+    TextField that stores large values zlib-compressed in the same column
+
+    Values longer than settings.MESSAGE_BODY_COMPRESSION_THRESHOLD bytes are
+    stored as PREFIX + version + base64(zlib(value)) when that is shorter.
+    Rows are read in their stored form and only decompressed when the
+    attribute is accessed, so querysets that never touch the field (or
+    defer it) never pay for decompression. Plain values that happen to
+    start with PREFIX are always stored compressed, so a stored value
+    starting with PREFIX is always one written by this field.
+
+    Database lookups (icontains, values()) see the stored form.
+    """
+
+    descriptor_class = CompressedTextDescriptor
+
+    PREFIX = '\x01'
+
+    # Version byte of the encoding, room for other codecs (e.g. zstd) later
+    ZLIB = '1'
+
+    DEFAULT_THRESHOLD = 4096
+    COMPRESSION_LEVEL = 6
+
+    def from_db_value(self, value, expression, connection):
+        if value and value.startswith(self.PREFIX):
+            return CompressedText(value)
+        return value
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        if value is None or isinstance(value, CompressedText):
+            return value
+        return self.compress(value)
+
+    @staticmethod
+    def get_threshold():
+        return getattr(settings, 'MESSAGE_BODY_COMPRESSION_THRESHOLD', CompressedTextField.DEFAULT_THRESHOLD)
+
+    def compress(self, value):
+        """
+        Stored form of a text value
+
+        Returns:
+            CompressedText, or the value itself when it is small or does not shrink
+        """
+        if isinstance(value, CompressedText):
+            return value
+        data = value.encode('utf-8')
+        must_encode = value.startswith(self.PREFIX)
+        threshold = self.get_threshold()
+        if not must_encode and (threshold is None or len(data) < threshold):
+            return value
+        encoded = self.PREFIX + self.ZLIB + base64.b64encode(zlib.compress(data, self.COMPRESSION_LEVEL)).decode('ascii')
+        # The encoded form is ASCII: compare byte lengths, as stored in UTF-8
+        if not must_encode and len(encoded) >= len(data):
+            return value
+        return CompressedText(encoded)
+
+    def decompress(self, value):
+        """Decode a stored value written by compress()"""
+        if not value.startswith(self.PREFIX):
+            return str(value)
+        version, payload = value[1:2], value[2:]
+        if version == self.ZLIB:
+            return zlib.decompress(base64.b64decode(payload)).decode('utf-8')
+        raise ValueError(f'Unknown compressed text version: {version!r}')
@@ -0,0 +1,48 @@
+import os
+from django.core.management.base import BaseCommand
+from django.db import models
+from message.attachments import AttachmentStore
+from message.models import Message
+
+
+class Command(BaseCommand):
+    """Fill attachment_size/name/mime of messages stored before those columns existed"""
+    help = 'تکمیل اطلاعات فایل‌های ضمیمه پیام‌های قدیمی'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Messages updated per bulk query')
+    
+    def handle(self, *args, **options):
+        # Only incomplete rows are read, so an interrupted run can be resumed
+        messages = Message.objects.exclude(attachment='').exclude(attachment__isnull=True).filter(
+            models.Q(attachment_size=0) | models.Q(attachment_name='') | models.Q(attachment_mime='')
+        ).select_related('attachment_blob').only(
+            'id', 'attachment', 'attachment_blob__size', 'attachment_name', 'attachment_size', 'attachment_mime'
+        )
+        
+        count = 0
+        missing = 0
+        batch = []
+        for message in messages.order_by('id').iterator(chunk_size=options['batch_size']):
+            message.attachment_name = message.attachment_name or os.path.basename(message.attachment.name)
+            message.attachment_mime = message.attachment_mime or AttachmentStore.guess_mime(message.attachment_name)
+            if not message.attachment_size:
+                if message.attachment_blob:
+                    message.attachment_size = message.attachment_blob.size
+                else:
+                    try:
+                        message.attachment_size = message.attachment.size
+                    except OSError:
+                        missing += 1
+            batch.append(message)
+            
+            if len(batch) >= options['batch_size']:
+                Message.objects.bulk_update(batch, ['attachment_name', 'attachment_size', 'attachment_mime'])
+                count += len(batch)
+                batch = []
+        
+        if batch:
+            Message.objects.bulk_update(batch, ['attachment_name', 'attachment_size', 'attachment_mime'])
+            count += len(batch)
+        
+        self.stdout.write(self.style.SUCCESS(f'{count} messages updated ({missing} attachment files missing)'))
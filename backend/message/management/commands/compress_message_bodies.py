@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db.models.functions import Length
+from message.fields import CompressedText, CompressedTextField
+from message.models import Message
+
+
+class Command(BaseCommand):
+    """Compress the stored bodies of existing large messages"""
+    help = 'فشرده‌سازی متن پیام‌های بزرگ موجود'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Messages read and updated per batch')
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be compressed')
+    
+    def handle(self, *args, **options):
+        field = Message._meta.get_field('body')
+        threshold = field.get_threshold()
+        if threshold is None:
+            self.stdout.write(self.style.WARNING('Body compression is disabled (MESSAGE_BODY_COMPRESSION_THRESHOLD is None)'))
+            return
+        
+        # A UTF-8 character is at most 4 bytes: shorter bodies are below the threshold
+        candidates = Message.objects.annotate(body_length=Length('body')).filter(
+            body_length__gte=threshold // 4
+        ).exclude(body__startswith=CompressedTextField.PREFIX).only('id', 'body')
+        
+        count = 0
+        saved = 0
+        last_id = 0
+        while True:
+            # Keyset batches: an interrupted run resumes on the remaining plain rows
+            batch = list(candidates.filter(id__gt=last_id).order_by('id')[:options['batch_size']])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            
+            compressed = []
+            for message in batch:
+                body = message.body
+                stored = field.compress(body)
+                if isinstance(stored, CompressedText):
+                    saved += len(body.encode('utf-8')) - len(stored)
+                    message.body = stored
+                    compressed.append(message)
+            
+            if compressed and not options['dry_run']:
+                Message.objects.bulk_update(compressed, ['body'])
+            count += len(compressed)
+        
+        verb = 'would be compressed' if options['dry_run'] else 'compressed'
+        self.stdout.write(self.style.SUCCESS(f'{count} messages {verb} ({saved} bytes saved)'))
@@ -0,0 +1,46 @@
+import sys
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from message.export import MailboxExporter
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    """Stream a user's mailbox to a file as JSON Lines, mbox or zip"""
+    help = 'خروجی گرفتن از صندوق پیام یک کاربر'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('email', help='Email of the mailbox owner')
+        parser.add_argument('--format', choices=list(MailboxExporter.FORMATS), default='jsonl', dest='export_format')
+        parser.add_argument('--type', default='mailbox', dest='message_type', help='Folder to export (default: every message of the user)')
+        parser.add_argument('--attachments', action='store_true', help='Write a zip archive with the attachments')
+        parser.add_argument('--output', help='Output file path (default: stdout)')
+        parser.add_argument('--batch-size', type=int, default=MailboxExporter.BATCH_SIZE, help='Messages loaded per database round trip')
+    
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(email=options['email'])
+        except User.DoesNotExist:
+            raise CommandError('کاربر با این ایمیل یافت نشد')
+        
+        exporter = MailboxExporter(
+            user=user,
+            export_format=options['export_format'],
+            message_type=options['message_type'],
+            batch_size=options['batch_size']
+        )
+        chunks = exporter.stream_zip() if options['attachments'] else exporter.stream()
+        
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            size = 0
+            for chunk in chunks:
+                output.write(chunk)
+                size += len(chunk)
+        finally:
+            if options['output']:
+                output.close()
+        
+        if options['output']:
+            self.stdout.write(self.style.SUCCESS(f'{size} bytes written to {options["output"]}'))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from message.attachments import AttachmentStore
+from message.models import Message
+
+
+class Command(BaseCommand):
+    """Move attachments stored per message into the content-addressed blob store"""
+    help = 'انتقال فایل‌های ضمیمه قدیمی به مخزن فایل‌های یکتا'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Messages loaded per database round trip')
+    
+    def handle(self, *args, **options):
+        # Only messages not yet moved are read, so an interrupted run can be resumed
+        messages = Message.objects.filter(attachment_blob__isnull=True).exclude(attachment='').exclude(attachment__isnull=True)
+        
+        count = 0
+        for message in messages.order_by('id').iterator(chunk_size=options['batch_size']):
+            if AttachmentStore.adopt(message):
+                count += 1
+        
+        self.stdout.write(self.style.SUCCESS(f'{count} attachments moved to the blob store'))
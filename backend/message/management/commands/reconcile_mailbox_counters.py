@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from message.services import MessageService
+
+
+class Command(BaseCommand):
+    """Recompute mailbox counters from the mailbox entries"""
+    help = 'بازسازی شمارنده‌های صندوق پیام کاربران'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', type=int, action='append', dest='user_ids', help='Only reconcile this user (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Users recomputed per aggregate query')
+    
+    def handle(self, *args, **options):
+        count = MessageService.reconcile_mailbox_counters(
+            user_ids=options['user_ids'],
+            batch_size=options['batch_size']
+        )
+        
+        self.stdout.write(self.style.SUCCESS(f'{count} users reconciled'))
@@ -0,0 +1,26 @@
+# Generated manually
+
+from django.db import migrations
+
+
+def create_search_table(apps, schema_editor):
+    """Create the full-text search table for the current database backend"""
+    from message.search import MessageSearchIndex
+    MessageSearchIndex.create_table(schema_editor)
+
+
+def drop_search_table(apps, schema_editor):
+    """Drop the full-text search table"""
+    from message.search import MessageSearchIndex
+    MessageSearchIndex.drop_table(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message', '0004_block'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 4.2.7 on 2026-10-17 17:32
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_mailbox_entries(apps, schema_editor):
+    """Create sender/receiver mailbox entries for existing messages"""
+    Message = apps.get_model('message', 'Message')
+    MailboxEntry = apps.get_model('message', 'MailboxEntry')
+    
+    entries = []
+    for message in Message.objects.exclude(status='deleted').iterator(chunk_size=1000):
+        is_archived = message.status == 'archived'
+        if message.receiver_id != message.sender_id:
+            entries.append(MailboxEntry(
+                user_id=message.sender_id,
+                message_id=message.id,
+                role='sender',
+                folder='archived' if is_archived else 'sent',
+                is_starred=message.is_starred,
+                is_read=True,
+                is_archived=is_archived,
+                created_at=message.created_at,
+            ))
+        if message.receiver_id:
+            entries.append(MailboxEntry(
+                user_id=message.receiver_id,
+                message_id=message.id,
+                role='receiver',
+                folder='spam' if message.is_spam else ('archived' if is_archived else 'inbox'),
+                is_starred=message.is_starred,
+                is_read=message.read_at is not None,
+                is_archived=is_archived,
+                is_spam=message.is_spam,
+                created_at=message.created_at,
+            ))
+        if len(entries) >= 1000:
+            MailboxEntry.objects.bulk_create(entries)
+            entries = []
+    
+    MailboxEntry.objects.bulk_create(entries)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('message', '0005_message_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailboxEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('role', models.CharField(choices=[('sender', 'فرستنده'), ('receiver', 'گیرنده')], max_length=10, verbose_name='نقش')),
+                ('folder', models.CharField(choices=[('inbox', 'صندوق ورودی'), ('sent', 'ارسال شده'), ('archived', 'آرشیو شده'), ('spam', 'اسپم')], max_length=10, verbose_name='پوشه')),
+                ('is_starred', models.BooleanField(default=False, verbose_name='ستاره\u200cدار')),
+                ('is_read', models.BooleanField(default=False, verbose_name='خوانده شده')),
+                ('is_archived', models.BooleanField(default=False, verbose_name='آرشیو شده')),
+                ('is_spam', models.BooleanField(default=False, verbose_name='اسپم')),
+                ('created_at', models.DateTimeField(verbose_name='زمان ایجاد پیام')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='زمان به\u200cروزرسانی')),
+                ('message', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mailbox_entries', to='message.message', verbose_name='پیام')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mailbox_entries', to=settings.AUTH_USER_MODEL, verbose_name='کاربر')),
+            ],
+            options={
+                'verbose_name': 'صندوق پیام',
+                'verbose_name_plural': 'صندوق\u200cهای پیام',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['user', 'folder', '-created_at'], name='message_mai_user_id_2848cd_idx'), models.Index(fields=['user', 'is_starred', '-created_at'], name='message_mai_user_id_1436bc_idx'), models.Index(fields=['user', '-created_at'], name='message_mai_user_id_95fb43_idx')],
+                'unique_together': {('user', 'message')},
+            },
+        ),
+        migrations.RunPython(create_mailbox_entries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 4.2.7 on 2026-10-17 17:34
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_conversations(apps, schema_editor):
+    """Build conversation summaries from existing messages and mailbox entries"""
+    Message = apps.get_model('message', 'Message')
+    MailboxEntry = apps.get_model('message', 'MailboxEntry')
+    Conversation = apps.get_model('message', 'Conversation')
+    
+    conversations = {}
+    messages = Message.objects.filter(receiver__isnull=False).exclude(status='deleted').order_by('created_at', 'id')
+    for message in messages.iterator(chunk_size=1000):
+        if message.sender_id == message.receiver_id:
+            continue
+        for user_id, peer_id in ((message.sender_id, message.receiver_id), (message.receiver_id, message.sender_id)):
+            conversations[(user_id, peer_id)] = Conversation(
+                user_id=user_id,
+                peer_id=peer_id,
+                last_message_id=message.id,
+                last_message_subject=message.subject[:255],
+                last_message_snippet=(message.body or '')[:100],
+                last_message_at=message.created_at,
+                is_last_sent_by_user=message.sender_id == user_id,
+            )
+    
+    unread = MailboxEntry.objects.filter(role='receiver', is_read=False, is_archived=False)
+    for entry in unread.values('user_id', 'message__sender_id').annotate(count=models.Count('id')):
+        conversation = conversations.get((entry['user_id'], entry['message__sender_id']))
+        if conversation:
+            conversation.unread_count = entry['count']
+    
+    Conversation.objects.bulk_create(conversations.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('message', '0006_mailboxentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_message_subject', models.CharField(blank=True, default='', max_length=255, verbose_name='موضوع آخرین پیام')),
+                ('last_message_snippet', models.CharField(blank=True, default='', max_length=100, verbose_name='خلاصه آخرین پیام')),
+                ('last_message_at', models.DateTimeField(verbose_name='زمان آخرین پیام')),
+                ('is_last_sent_by_user', models.BooleanField(default=False, verbose_name='آخرین پیام ارسالی کاربر')),
+                ('unread_count', models.PositiveIntegerField(default=0, verbose_name='تعداد خوانده نشده')),
+                ('last_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='message.message', verbose_name='آخرین پیام')),
+                ('peer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='peer_conversations', to=settings.AUTH_USER_MODEL, verbose_name='مخاطب')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to=settings.AUTH_USER_MODEL, verbose_name='کاربر')),
+            ],
+            options={
+                'verbose_name': 'مکالمه',
+                'verbose_name_plural': 'مکالمه\u200cها',
+                'ordering': ['-last_message_at'],
+                'indexes': [models.Index(fields=['user', '-last_message_at'], name='message_con_user_id_040af0_idx')],
+                'unique_together': {('user', 'peer')},
+            },
+        ),
+        migrations.RunPython(create_conversations, migrations.RunPython.noop),
+    ]
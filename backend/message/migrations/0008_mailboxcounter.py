@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-17 17:35
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('message', '0007_conversation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailboxCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unread_count', models.PositiveIntegerField(default=0, verbose_name='خوانده نشده')),
+                ('starred_count', models.PositiveIntegerField(default=0, verbose_name='ستاره\u200cدار')),
+                ('spam_count', models.PositiveIntegerField(default=0, verbose_name='اسپم')),
+                ('archived_count', models.PositiveIntegerField(default=0, verbose_name='آرشیو شده')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='زمان به\u200cروزرسانی')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='mailbox_counter', to=settings.AUTH_USER_MODEL, verbose_name='کاربر')),
+            ],
+            options={
+                'verbose_name': 'شمارنده صندوق',
+                'verbose_name_plural': 'شمارنده\u200cهای صندوق',
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-17 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message', '0008_mailboxcounter'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['is_private', '-created_at'], name='message_mes_is_priv_8fd275_idx'),
+        ),
+    ]
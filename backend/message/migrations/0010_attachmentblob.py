@@ -0,0 +1,41 @@
+# Generated by Django 4.2.7 on 2026-10-17 17:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+import message.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message', '0009_message_public_timeline_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='attachment_name',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='نام فایل ضمیمه'),
+        ),
+        migrations.CreateModel(
+            name='AttachmentBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True, verbose_name='هش SHA-256')),
+                ('file', models.FileField(max_length=255, upload_to=message.models.attachment_blob_upload_path, verbose_name='فایل')),
+                ('size', models.BigIntegerField(verbose_name='حجم (بایت)')),
+                ('ref_count', models.PositiveIntegerField(default=0, verbose_name='تعداد ارجاع')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='زمان ایجاد')),
+            ],
+            options={
+                'verbose_name': 'فایل ضمیمه',
+                'verbose_name_plural': 'فایل\u200cهای ضمیمه',
+                'indexes': [models.Index(fields=['ref_count'], name='message_att_ref_cou_648d35_idx')],
+            },
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='attachment_blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='messages', to='message.attachmentblob', verbose_name='فایل ذخیره شده ضمیمه'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-17 17:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message', '0010_attachmentblob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='attachment_mime',
+            field=models.CharField(blank=True, default='', max_length=100, verbose_name='نوع فایل ضمیمه'),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='attachment_size',
+            field=models.BigIntegerField(default=0, verbose_name='حجم فایل ضمیمه (بایت)'),
+        ),
+    ]
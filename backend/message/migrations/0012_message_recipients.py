@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-17 17:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message', '0011_message_attachment_metadata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='batch_id',
+            field=models.UUIDField(blank=True, db_index=True, null=True, verbose_name='شناسه ارسال گروهی'),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='recipient_kind',
+            field=models.CharField(choices=[('to', 'گیرنده'), ('cc', 'رونوشت'), ('bcc', 'رونوشت مخفی')], default='to', max_length=3, verbose_name='نوع گیرنده'),
+        ),
+    ]
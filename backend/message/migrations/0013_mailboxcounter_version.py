@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 17:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message', '0012_message_recipients'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mailboxcounter',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0, verbose_name='نسخه صندوق'),
+        ),
+    ]
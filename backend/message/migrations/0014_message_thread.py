@@ -0,0 +1,50 @@
+# Generated by Django 4.2.7 on 2026-10-17 17:58
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+def assign_threads(apps, schema_editor):
+    """Start one thread per existing message"""
+    Message = apps.get_model('message', 'Message')
+    
+    last_id = 0
+    while True:
+        batch = list(Message.objects.filter(id__gt=last_id).order_by('id').only('id')[:1000])
+        if not batch:
+            break
+        last_id = batch[-1].id
+        for message in batch:
+            message.thread_id = uuid.uuid4()
+        Message.objects.bulk_update(batch, ['thread_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message', '0013_mailboxcounter_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='in_reply_to',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='replies', to='message.message', verbose_name='پاسخ به'),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='thread_id',
+            field=models.UUIDField(null=True, editable=False, verbose_name='شناسه گفتگو'),
+        ),
+        migrations.RunPython(assign_threads, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='message',
+            name='thread_id',
+            field=models.UUIDField(default=uuid.uuid4, editable=False, verbose_name='شناسه گفتگو'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['thread_id', 'created_at'], name='message_mes_thread__f17198_idx'),
+        ),
+    ]
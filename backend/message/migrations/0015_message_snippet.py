@@ -0,0 +1,35 @@
+# Generated by Django 4.2.7 on 2026-10-17 18:00
+
+from django.db import migrations, models
+from django.utils.text import Truncator
+
+
+def fill_snippets(apps, schema_editor):
+    """Compute the snippet of existing messages"""
+    Message = apps.get_model('message', 'Message')
+    
+    last_id = 0
+    while True:
+        batch = list(Message.objects.filter(id__gt=last_id).order_by('id').only('id', 'body')[:1000])
+        if not batch:
+            break
+        last_id = batch[-1].id
+        for message in batch:
+            message.snippet = Truncator(' '.join((message.body or '').split())).chars(100)
+        Message.objects.bulk_update(batch, ['snippet'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message', '0014_message_thread'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='snippet',
+            field=models.CharField(blank=True, default='', max_length=100, verbose_name='خلاصه متن'),
+        ),
+        migrations.RunPython(fill_snippets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.7 on 2026-10-17 18:03
+
+from django.db import migrations
+import message.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message', '0015_message_snippet'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='body',
+            field=message.fields.CompressedTextField(verbose_name='متن پیام'),
+        ),
+    ]
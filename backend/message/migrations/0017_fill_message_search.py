@@ -0,0 +1,20 @@
+# Generated manually
+
+from django.db import migrations
+
+
+def fill_search_index(apps, schema_editor):
+    """Index the messages that existed before the search table"""
+    from message.search import MessageSearchIndex
+    MessageSearchIndex.rebuild(model=apps.get_model('message', 'Message'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message', '0016_message_body_compressed'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_search_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-17 18:43
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('message', '0017_fill_message_search'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='message',
+            name='is_spam',
+        ),
+        migrations.RemoveField(
+            model_name='message',
+            name='is_starred',
+        ),
+    ]
@@ -2,8 +2,10 @@ from django.db import models
 from django.conf import settings
 from django.core.validators import FileExtensionValidator
 from django.utils import timezone
+from django.utils.text import Truncator
 import os
 import uuid
+from .fields import CompressedText, CompressedTextField
 
 
 def message_file_upload_path(instance, filename):
@@ -11,6 +13,16 @@ def message_file_upload_path(instance, filename):
     return f'messages/{instance.id}/{filename}'
 
 
+def attachment_blob_path(sha256):
+    """Sharded storage path of an attachment blob: attachments/ab/cd/<sha256>"""
+    return f'attachments/{sha256[:2]}/{sha256[2:4]}/{sha256}'
+
+
+def attachment_blob_upload_path(instance, filename):
+    """Generate upload path for attachment blobs from their content hash"""
+    return attachment_blob_path(instance.sha256)
+
+
 class Message(models.Model):
     """Message/Email model"""
     
@@ -23,10 +35,20 @@ class Message(models.Model):
         ('deleted', 'حذف شده'),
     ]
     
+    RECIPIENT_KIND_CHOICES = [
+        ('to', 'گیرنده'),
+        ('cc', 'رونوشت'),
+        ('bcc', 'رونوشت مخفی'),
+    ]
+    
+    SNIPPET_LENGTH = 100
+    
     sender = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='sent_messages', verbose_name='فرستنده')
     receiver = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='received_messages', null=True, blank=True, verbose_name='گیرنده')
     subject = models.CharField(max_length=255, verbose_name='موضوع')
-    body = models.TextField(verbose_name='متن پیام')
+    # Large bodies are stored compressed and decoded on first access (see fields.py)
+    body = CompressedTextField(verbose_name='متن پیام')
+    snippet = models.CharField(max_length=SNIPPET_LENGTH, blank=True, default='', verbose_name='خلاصه متن')
     is_private = models.BooleanField(default=True, verbose_name='خصوصی')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='sent', verbose_name='وضعیت')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='زمان ایجاد')
@@ -35,10 +57,17 @@ class Message(models.Model):
     read_at = models.DateTimeField(null=True, blank=True, verbose_name='زمان خواندن')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='زمان به‌روزرسانی')
     attachment = models.FileField(upload_to=message_file_upload_path, null=True, blank=True, validators=[FileExtensionValidator(allowed_extensions=['pdf', 'doc', 'docx', 'txt', 'jpg', 'jpeg', 'png', 'gif', 'zip', 'rar'])], verbose_name='فایل ضمیمه', help_text='حداکثر حجم فایل: 10 مگابایت')
-    is_starred = models.BooleanField(default=False, verbose_name='ستاره‌دار')
     is_important = models.BooleanField(default=False, verbose_name='مهم')
-    is_spam = models.BooleanField(default=False, verbose_name='اسپم')
+    attachment_blob = models.ForeignKey('AttachmentBlob', on_delete=models.PROTECT, null=True, blank=True, related_name='messages', verbose_name='فایل ذخیره شده ضمیمه')
+    attachment_name = models.CharField(max_length=255, blank=True, default='', verbose_name='نام فایل ضمیمه')
+    attachment_size = models.BigIntegerField(default=0, verbose_name='حجم فایل ضمیمه (بایت)')
+    attachment_mime = models.CharField(max_length=100, blank=True, default='', verbose_name='نوع فایل ضمیمه')
     public_link = models.UUIDField(default=uuid.uuid4, unique=True, editable=False, verbose_name='لینک عمومی')
+    recipient_kind = models.CharField(max_length=3, choices=RECIPIENT_KIND_CHOICES, default='to', verbose_name='نوع گیرنده')
+    batch_id = models.UUIDField(null=True, blank=True, db_index=True, verbose_name='شناسه ارسال گروهی')
+    in_reply_to = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='replies', verbose_name='پاسخ به')
+    # Shared by a message and every reply down its reply chain
+    thread_id = models.UUIDField(default=uuid.uuid4, editable=False, verbose_name='شناسه گفتگو')
     
     class Meta:
         ordering = ['-created_at']
@@ -48,17 +77,31 @@ class Message(models.Model):
             models.Index(fields=['sender', '-created_at']),
             models.Index(fields=['receiver', '-created_at']),
             models.Index(fields=['status', '-created_at']),
+            models.Index(fields=['is_private', '-created_at']),
+            models.Index(fields=['thread_id', 'created_at']),
         ]
     
     def __str__(self):
         return f"{self.subject} - {self.sender.email}"
     
     def save(self, *args, **kwargs):
-        """Override save to set sent_at on first save"""
+        """Override save to set sent_at on first save and refresh the snippet"""
         if not self.pk and not self.sent_at:
             self.sent_at = timezone.now()
+        # An unread (still compressed) or deferred body has not changed
+        body = self.__dict__.get('body')
+        if body is not None and not isinstance(body, CompressedText):
+            self.snippet = self.build_snippet(body)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'body' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'snippet'}
         super().save(*args, **kwargs)
     
+    @staticmethod
+    def build_snippet(body):
+        """Single-line plain-text preview of a body, at most SNIPPET_LENGTH characters"""
+        return Truncator(' '.join((body or '').split())).chars(Message.SNIPPET_LENGTH)
+    
     def mark_as_read(self):
         """Mark message as read"""
         if not self.read_at:
@@ -67,16 +110,32 @@ class Message(models.Model):
             self.save()
     
     def get_attachment_size(self):
-        """Get attachment file size in MB"""
+        """Get attachment file size in MB (from the stored column, storage is not touched)"""
         if self.attachment:
-            try:
-                size = self.attachment.size
-                return round(size / (1024 * 1024), 2)
-            except:
-                return 0
+            return round(self.attachment_size / (1024 * 1024), 2)
         return 0
 
 
+class AttachmentBlob(models.Model):
+    """Content-addressed attachment file, stored once and shared by every message that references it"""
+    
+    sha256 = models.CharField(max_length=64, unique=True, verbose_name='هش SHA-256')
+    file = models.FileField(upload_to=attachment_blob_upload_path, max_length=255, verbose_name='فایل')
+    size = models.BigIntegerField(verbose_name='حجم (بایت)')
+    ref_count = models.PositiveIntegerField(default=0, verbose_name='تعداد ارجاع')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='زمان ایجاد')
+    
+    class Meta:
+        verbose_name = 'فایل ضمیمه'
+        verbose_name_plural = 'فایل‌های ضمیمه'
+        indexes = [
+            models.Index(fields=['ref_count']),
+        ]
+    
+    def __str__(self):
+        return f"{self.sha256} ({self.ref_count})"
+
+
 class Block(models.Model):
     """Model for blocking users"""
     blocker = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='blocked_users', verbose_name='بلاک کننده')
@@ -94,3 +153,138 @@ class Block(models.Model):
     
     def __str__(self):
         return f"{self.blocker.username} blocked {self.blocked.username}"
+
+
+class MailboxEntry(models.Model):
+    """Per-participant mailbox state of a message (folder, star, read, archive, spam)"""
+    
+    ROLE_CHOICES = [
+        ('sender', 'فرستنده'),
+        ('receiver', 'گیرنده'),
+    ]
+    
+    FOLDER_CHOICES = [
+        ('inbox', 'صندوق ورودی'),
+        ('sent', 'ارسال شده'),
+        ('archived', 'آرشیو شده'),
+        ('spam', 'اسپم'),
+    ]
+    
+    # Fields rendered as the user's view of a message
+    STATE_FIELDS = ('folder', 'is_starred', 'is_read', 'is_archived', 'is_spam')
+    
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='mailbox_entries', verbose_name='کاربر')
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='mailbox_entries', verbose_name='پیام')
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES, verbose_name='نقش')
+    folder = models.CharField(max_length=10, choices=FOLDER_CHOICES, verbose_name='پوشه')
+    is_starred = models.BooleanField(default=False, verbose_name='ستاره‌دار')
+    is_read = models.BooleanField(default=False, verbose_name='خوانده شده')
+    is_archived = models.BooleanField(default=False, verbose_name='آرشیو شده')
+    is_spam = models.BooleanField(default=False, verbose_name='اسپم')
+    created_at = models.DateTimeField(verbose_name='زمان ایجاد پیام')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='زمان به‌روزرسانی')
+    
+    class Meta:
+        ordering = ['-created_at']
+        unique_together = ('user', 'message')
+        verbose_name = 'صندوق پیام'
+        verbose_name_plural = 'صندوق‌های پیام'
+        indexes = [
+            models.Index(fields=['user', 'folder', '-created_at']),
+            models.Index(fields=['user', 'is_starred', '-created_at']),
+            models.Index(fields=['user', '-created_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.message_id} - {self.folder}"
+    
+    @staticmethod
+    def folder_expression():
+        """SQL expression resolving the folder from the entry flags (spam > archived > role)"""
+        return models.Case(
+            models.When(is_spam=True, then=models.Value('spam')),
+            models.When(is_archived=True, then=models.Value('archived')),
+            models.When(role='sender', then=models.Value('sent')),
+            default=models.Value('inbox'),
+            output_field=models.CharField(),
+        )
+    
+    def resolve_folder(self):
+        """Resolve the folder from the entry flags (spam > archived > role)"""
+        if self.is_spam:
+            return 'spam'
+        if self.is_archived:
+            return 'archived'
+        return 'sent' if self.role == 'sender' else 'inbox'
+
+
+class Conversation(models.Model):
+    """Materialized summary of a user's conversation with one peer (contact list row)"""
+    
+    SNIPPET_LENGTH = 100
+    
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='conversations', verbose_name='کاربر')
+    peer = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='peer_conversations', verbose_name='مخاطب')
+    last_message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', verbose_name='آخرین پیام')
+    last_message_subject = models.CharField(max_length=255, blank=True, default='', verbose_name='موضوع آخرین پیام')
+    last_message_snippet = models.CharField(max_length=SNIPPET_LENGTH, blank=True, default='', verbose_name='خلاصه آخرین پیام')
+    last_message_at = models.DateTimeField(verbose_name='زمان آخرین پیام')
+    is_last_sent_by_user = models.BooleanField(default=False, verbose_name='آخرین پیام ارسالی کاربر')
+    unread_count = models.PositiveIntegerField(default=0, verbose_name='تعداد خوانده نشده')
+    
+    class Meta:
+        ordering = ['-last_message_at']
+        unique_together = ('user', 'peer')
+        verbose_name = 'مکالمه'
+        verbose_name_plural = 'مکالمه‌ها'
+        indexes = [
+            models.Index(fields=['user', '-last_message_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.peer.username}"
+
+
+class MailboxCounter(models.Model):
+    """Incrementally maintained per-user folder counters (badge counts)"""
+    
+    # Counter name -> MailboxEntry filter it counts
+    COUNTER_FILTERS = {
+        'unread_count': models.Q(role='receiver', folder='inbox', is_read=False),
+        'starred_count': models.Q(is_starred=True),
+        'spam_count': models.Q(folder='spam'),
+        'archived_count': models.Q(folder='archived'),
+    }
+    
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='mailbox_counter', verbose_name='کاربر')
+    unread_count = models.PositiveIntegerField(default=0, verbose_name='خوانده نشده')
+    starred_count = models.PositiveIntegerField(default=0, verbose_name='ستاره‌دار')
+    spam_count = models.PositiveIntegerField(default=0, verbose_name='اسپم')
+    archived_count = models.PositiveIntegerField(default=0, verbose_name='آرشیو شده')
+    # Bumped on every write to the user's mailbox, validator of conditional GETs
+    version = models.PositiveBigIntegerField(default=0, verbose_name='نسخه صندوق')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='زمان به‌روزرسانی')
+    
+    class Meta:
+        verbose_name = 'شمارنده صندوق'
+        verbose_name_plural = 'شمارنده‌های صندوق'
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.unread_count} unread"
+    
+    @staticmethod
+    def count_entries(entries):
+        """
+        Count entries per user for every counter in one aggregate query
+        
+        Returns:
+            dict mapping user_id to {counter_name: count}
+        """
+        rows = entries.order_by().values('user_id').annotate(**{
+            name: models.Count('id', filter=condition)
+            for name, condition in MailboxCounter.COUNTER_FILTERS.items()
+        })
+        return {
+            row['user_id']: {name: row[name] for name in MailboxCounter.COUNTER_FILTERS}
+            for row in rows
+        }
@@ -0,0 +1,226 @@
+import base64
+import heapq
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.utils import timezone
+
+
+class QuerySetStream:
+    """
+    A message queryset read one keyset window at a time
+
+    Rows are ordered by (ordering_field, id); `ordering_field` may name an
+    annotation, e.g. `mailbox_created_at` added by MessageService.
+    """
+
+    def __init__(self, queryset):
+        self.queryset = queryset
+
+    def fetch(self, field, boundary, direction, limit):
+        """
+        Fetch up to `limit` rows after boundary
+
+        Args:
+            field: Ordering field name
+            boundary: (ordering value, id) of the cursor row, or None for the first page
+            direction: 'n' for older rows (descending), 'p' for newer rows (ascending)
+            limit: Max number of rows
+
+        Returns:
+            List of Message objects in fetch order
+        """
+        return self.fetch_from(self.queryset, field, boundary, direction, limit)
+
+    @staticmethod
+    def fetch_from(queryset, field, boundary, direction, limit):
+        """Run one keyset window query over queryset"""
+        if boundary:
+            value, pk = boundary
+            if direction == 'n':
+                queryset = queryset.filter(
+                    models.Q(**{f'{field}__lt': value}) |
+                    models.Q(**{field: value, 'id__lt': pk})
+                )
+            else:
+                queryset = queryset.filter(
+                    models.Q(**{f'{field}__gt': value}) |
+                    models.Q(**{field: value, 'id__gt': pk})
+                )
+
+        if direction == 'n':
+            return list(queryset.order_by(f'-{field}', '-id')[:limit])
+        return list(queryset.order_by(field, 'id')[:limit])
+
+
+class MessageCursorPagination:
+    """
+    Keyset (cursor) pagination for message querysets on (-created_at, -id)
+
+    Each page is one indexed range scan of `page_size + 1` rows, so the cost
+    of a request does not depend on how many messages the mailbox holds.
+    Cursors are opaque base64 strings encoding the boundary row and direction.
+    `ordering_field` may name an annotation, e.g. the mailbox entry's
+    `mailbox_created_at` added by MessageService.get_user_messages, or the
+    integer `search_rank` of search results (`ordering_type=int`).
+
+    Several streams (e.g. the user's mailbox and the public timeline) can be
+    paginated together: each one is read for `page_size + 1` rows after the
+    cursor and the results are k-way merged.
+    """
+
+    page_size = settings.REST_FRAMEWORK.get('PAGE_SIZE', 20)
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    count_query_param = 'with_count'
+    count_limit = 1000
+    ordering_field = 'created_at'
+    ordering_type = datetime
+
+    def __init__(self, ordering_field=None, ordering_type=None):
+        if ordering_field:
+            self.ordering_field = ordering_field
+        if ordering_type:
+            self.ordering_type = ordering_type
+        self.has_next = False
+        self.has_previous = False
+        self.first_item = None
+        self.last_item = None
+
+    @staticmethod
+    def encode_cursor(value, pk, direction):
+        """Encode a boundary row (ordering value, id) and direction ('n' or 'p')"""
+        value = value.isoformat() if isinstance(value, datetime) else int(value)
+        raw = f'{direction}|{value}|{pk}'
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def decode_cursor(cursor, ordering_type=datetime):
+        """Decode a cursor into (direction, ordering value, id)"""
+        try:
+            raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+            direction, value, pk = raw.split('|')
+            if direction not in ('n', 'p'):
+                raise ValueError(direction)
+            if ordering_type is datetime:
+                value = datetime.fromisoformat(value)
+                # Boundaries are compared with aware datetimes
+                if not timezone.is_aware(value):
+                    raise ValueError(value)
+            else:
+                value = int(value)
+            return direction, value, int(pk)
+        except (ValueError, UnicodeError, TypeError):
+            raise ValidationError('cursor نامعتبر است')
+
+    def get_page_size(self, request):
+        """Get page size from query params, clamped to max_page_size"""
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request):
+        """
+        Return one page of messages from queryset
+
+        Args:
+            queryset: Message QuerySet (any ordering, it is replaced)
+            request: DRF request carrying cursor/page_size params
+
+        Returns:
+            List of Message objects ordered by (-created_at, -id)
+        """
+        return self.paginate_streams([QuerySetStream(queryset)], request)
+
+    def paginate_streams(self, streams, request):
+        """
+        Return one page of messages merged from several streams
+
+        Args:
+            streams: List of QuerySetStream-like objects with disjoint rows
+            request: DRF request carrying cursor/page_size params
+
+        Returns:
+            List of Message objects ordered by (-created_at, -id)
+        """
+        page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        direction = 'n'
+        boundary = None
+        field = self.ordering_field
+
+        if cursor:
+            direction, value, pk = self.decode_cursor(cursor, self.ordering_type)
+            boundary = (value, pk)
+
+        windows = [stream.fetch(field, boundary, direction, page_size + 1) for stream in streams]
+        merged = heapq.merge(
+            *windows,
+            key=lambda message: (getattr(message, field), message.id),
+            reverse=(direction == 'n')
+        )
+
+        rows = []
+        seen = set()
+        for message in merged:
+            if message.id in seen:
+                continue
+            seen.add(message.id)
+            rows.append(message)
+            if len(rows) > page_size:
+                break
+
+        has_more = len(rows) > page_size
+        rows = rows[:page_size]
+        if direction == 'n':
+            self.has_next = has_more
+            self.has_previous = bool(cursor)
+        else:
+            rows.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+
+        if rows:
+            self.first_item = rows[0]
+            self.last_item = rows[-1]
+
+        return rows
+
+    def get_next_cursor(self):
+        """Cursor for the page of older messages"""
+        if not self.has_next or self.last_item is None:
+            return None
+        return self.encode_cursor(getattr(self.last_item, self.ordering_field), self.last_item.id, 'n')
+
+    def get_previous_cursor(self):
+        """Cursor for the page of newer messages"""
+        if not self.has_previous or self.first_item is None:
+            return None
+        return self.encode_cursor(getattr(self.first_item, self.ordering_field), self.first_item.id, 'p')
+
+    def get_count(self, queryset, request):
+        """
+        Get an optional, bounded count of the queryset
+
+        Only computed when `with_count=true` is passed. Counting stops at
+        count_limit rows so the cost stays bounded for huge mailboxes.
+
+        Args:
+            queryset: Message QuerySet or list of QuerySetStream objects
+
+        Returns:
+            (count, is_exact) or (None, None) if not requested
+        """
+        if request.query_params.get(self.count_query_param, '').lower() not in ('1', 'true'):
+            return None, None
+
+        querysets = [s.queryset for s in queryset] if isinstance(queryset, list) else [queryset]
+        count = sum(qs.order_by()[:self.count_limit + 1].count() for qs in querysets)
+        if count > self.count_limit:
+            return self.count_limit, False
+        return count, True
@@ -0,0 +1,232 @@
+import re
+from django.db import connection
+from .models import Message
+
+
+# Arabic code points that have a Persian equivalent, digits and ZWNJ
+PERSIAN_TRANSLATION = str.maketrans({
+    '\u064a': '\u06cc',  # Arabic yeh -> Persian yeh
+    '\u0649': '\u06cc',  # Alef maksura -> Persian yeh
+    '\u0643': '\u06a9',  # Arabic kaf -> Persian kaf
+    '\u0629': '\u0647',  # Teh marbuta -> heh
+    '\u06c0': '\u0647',  # Heh with yeh -> heh
+    '\u0623': '\u0627',  # Alef with hamza above -> alef
+    '\u0625': '\u0627',  # Alef with hamza below -> alef
+    '\u0671': '\u0627',  # Alef wasla -> alef
+    '\u200c': ' ',       # ZWNJ splits compound words into tokens
+    **{chr(0x06F0 + i): str(i) for i in range(10)},
+    **{chr(0x0660 + i): str(i) for i in range(10)},
+})
+
+# Harakat, superscript alef and tatweel
+PERSIAN_DIACRITICS = re.compile('[\u064b-\u065f\u0670\u0640]')
+
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def normalize_text(text):
+    """Normalize text for indexing/searching (case, Persian letters, diacritics)"""
+    if not text:
+        return ''
+    text = text.lower().translate(PERSIAN_TRANSLATION)
+    return PERSIAN_DIACRITICS.sub('', text)
+
+
+def tokenize(text):
+    """Split normalized text into search tokens"""
+    return TOKEN_PATTERN.findall(normalize_text(text))
+
+
+class MessageSearchIndex:
+    """
+    Inverted index over message subject, body and participants
+
+    SQLite uses an FTS5 virtual table and PostgreSQL a tsvector table with a
+    GIN index, both named `message_search` and created in migration 0005.
+    Each row also stores the ids of the users allowed to see the message
+    ('public' for public messages) so a search only touches the rows of the
+    searching user.
+    """
+
+    # Upper bound on ranked matches returned for a single query
+    RESULT_LIMIT = 500
+
+    # Column weights: subject, body, people
+    SQLITE_WEIGHTS = (10.0, 1.0, 3.0, 0.0)
+
+    @staticmethod
+    def is_supported(conn=None):
+        """Check if the database backend has a search index"""
+        return (conn or connection).vendor in ('sqlite', 'postgresql')
+
+    @staticmethod
+    def create_table(schema_editor):
+        """Create the search table for the current backend (used by migrations)"""
+        vendor = schema_editor.connection.vendor
+        if vendor == 'sqlite':
+            schema_editor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS message_search USING fts5("
+                "subject, body, people, participants, "
+                "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+        elif vendor == 'postgresql':
+            schema_editor.execute(
+                "CREATE TABLE IF NOT EXISTS message_search ("
+                "message_id bigint PRIMARY KEY REFERENCES message_message(id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+                "participants bigint[] NOT NULL, "
+                "document tsvector NOT NULL)"
+            )
+            schema_editor.execute(
+                "CREATE INDEX IF NOT EXISTS message_search_document_idx ON message_search USING GIN (document)"
+            )
+            schema_editor.execute(
+                "CREATE INDEX IF NOT EXISTS message_search_participants_idx ON message_search USING GIN (participants)"
+            )
+
+    @staticmethod
+    def drop_table(schema_editor):
+        """Drop the search table (used by migrations)"""
+        if MessageSearchIndex.is_supported(schema_editor.connection):
+            schema_editor.execute('DROP TABLE IF EXISTS message_search')
+
+    @staticmethod
+    def build_document(message):
+        """
+        Build the indexed fields of a message
+
+        Returns:
+            dict with normalized subject, body, people and participant ids
+        """
+        people = [message.sender.email, message.sender.username]
+        participants = [message.sender_id]
+        if message.receiver_id:
+            people += [message.receiver.email, message.receiver.username]
+            participants.append(message.receiver_id)
+
+        return {
+            'subject': normalize_text(message.subject),
+            'body': normalize_text(message.body),
+            'people': normalize_text(' '.join(p for p in people if p)),
+            'participants': participants,
+            'is_private': message.is_private,
+        }
+
+    @staticmethod
+    def index_message(message):
+        """Add or replace a message in the search index"""
+        MessageSearchIndex.index_messages([message])
+
+    @staticmethod
+    def index_messages(messages):
+        """Add or replace many messages in the search index (one batched statement each)"""
+        if not MessageSearchIndex.is_supported() or not messages:
+            return
+
+        docs = [(message.id, MessageSearchIndex.build_document(message)) for message in messages]
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                rows = []
+                for message_id, doc in docs:
+                    participants = ' '.join(f'u{pk}' for pk in doc['participants'])
+                    if not doc['is_private']:
+                        participants += ' public'
+                    rows.append([message_id, doc['subject'], doc['body'], doc['people'], participants])
+                cursor.executemany('DELETE FROM message_search WHERE rowid = %s', [[row[0]] for row in rows])
+                cursor.executemany(
+                    'INSERT INTO message_search (rowid, subject, body, people, participants) '
+                    'VALUES (%s, %s, %s, %s, %s)',
+                    rows
+                )
+            else:
+                cursor.executemany(
+                    "INSERT INTO message_search (message_id, participants, document) VALUES (%s, %s, "
+                    "setweight(to_tsvector('simple', %s), 'A') || "
+                    "setweight(to_tsvector('simple', %s), 'B') || "
+                    "setweight(to_tsvector('simple', %s), 'C')) "
+                    "ON CONFLICT (message_id) DO UPDATE SET "
+                    "participants = EXCLUDED.participants, document = EXCLUDED.document",
+                    [
+                        [message_id, doc['participants'] + ([] if doc['is_private'] else [0]), doc['subject'], doc['people'], doc['body']]
+                        for message_id, doc in docs
+                    ]
+                )
+
+    @staticmethod
+    def remove_message(message_id):
+        """Remove a message from the search index"""
+        if not MessageSearchIndex.is_supported():
+            return
+
+        column = 'rowid' if connection.vendor == 'sqlite' else 'message_id'
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM message_search WHERE {column} = %s', [message_id])
+
+    @staticmethod
+    def rebuild(batch_size=1000, model=None):
+        """
+        Rebuild the whole search index from the messages table
+
+        Args:
+            batch_size: Messages indexed per batch
+            model: Message model to read (a migration passes its historical model)
+
+        Returns:
+            Number of indexed messages
+        """
+        if not MessageSearchIndex.is_supported():
+            return 0
+
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM message_search')
+
+        count = 0
+        last_id = 0
+        messages = (model or Message).objects.select_related('sender', 'receiver').order_by('id')
+        while True:
+            batch = list(messages.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            MessageSearchIndex.index_messages(batch)
+            count += len(batch)
+        return count
+
+    @staticmethod
+    def search(user, query, limit=None):
+        """
+        Search messages visible to a user
+
+        Every token is matched as a prefix and all tokens must match.
+
+        Args:
+            user: User object
+            query: Raw search query string
+            limit: Max number of results (default: RESULT_LIMIT)
+
+        Returns:
+            List of message ids, best match first
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        limit = limit or MessageSearchIndex.RESULT_LIMIT
+
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                terms = ' '.join(f'"{token}"*' for token in tokens)
+                match = f'participants : ("u{user.id}" OR "public") AND {{subject body people}} : ({terms})'
+                weights = ', '.join(str(w) for w in MessageSearchIndex.SQLITE_WEIGHTS)
+                cursor.execute(
+                    f'SELECT rowid FROM message_search WHERE message_search MATCH %s '
+                    f'ORDER BY bm25(message_search, {weights}) LIMIT %s',
+                    [match, limit]
+                )
+            else:
+                terms = ' & '.join(f'{token}:*' for token in tokens)
+                cursor.execute(
+                    "SELECT message_id FROM message_search "
+                    "WHERE document @@ to_tsquery('simple', %s) AND participants && %s::bigint[] "
+                    "ORDER BY ts_rank(document, to_tsquery('simple', %s)) DESC LIMIT %s",
+                    [terms, [user.id, 0], terms, limit]
+                )
+            return [row[0] for row in cursor.fetchall()]
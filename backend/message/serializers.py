@@ -1,18 +1,28 @@
 from rest_framework import serializers
-from .models import Message
+from .models import Message, MailboxEntry, MailboxCounter
+from .services import MessageService
 from django.core.files.uploadedfile import InMemoryUploadedFile
 from django.db import models
+from django.urls import reverse
+from dmail.serializers import SparseFieldsetMixin
 import os
 
 
 class MessageCreateSerializer(serializers.ModelSerializer):
     """Serializer for creating a new message"""
+    
+    # Max number of recipients of one message (to + cc + bcc)
+    MAX_RECIPIENTS = 100
+    
     receiver_email = serializers.EmailField(
         write_only=True,
         required=False,
         allow_null=True,
         label='ایمیل گیرنده'
     )
+    to = serializers.ListField(child=serializers.EmailField(), required=False, label='گیرندگان')
+    cc = serializers.ListField(child=serializers.EmailField(), required=False, label='رونوشت')
+    bcc = serializers.ListField(child=serializers.EmailField(), required=False, label='رونوشت مخفی')
     attachment = serializers.FileField(
         required=False,
         allow_null=True,
@@ -26,6 +36,9 @@ class MessageCreateSerializer(serializers.ModelSerializer):
             'body',
             'is_private',
             'receiver_email',
+            'to',
+            'cc',
+            'bcc',
             'attachment'
         )
         extra_kwargs = {
@@ -47,66 +60,111 @@ class MessageCreateSerializer(serializers.ModelSerializer):
         """Validate message data"""
         is_private = attrs.get('is_private', True)
         receiver_email = attrs.get('receiver_email')
+        recipients = [email for kind in ('to', 'cc', 'bcc') for email in attrs.get(kind) or []]
         
-        if is_private and not receiver_email:
+        if is_private and not receiver_email and not recipients:
             raise serializers.ValidationError({
                 'receiver_email': 'برای پیام خصوصی، گیرنده الزامی است'
             })
         
-        if not is_private and receiver_email:
+        if not is_private and (receiver_email or recipients):
             raise serializers.ValidationError({
                 'receiver_email': 'برای پیام عمومی، گیرنده نباید مشخص شود'
             })
         
+        if len(recipients) + bool(receiver_email) > self.MAX_RECIPIENTS:
+            raise serializers.ValidationError({
+                'to': f'حداکثر {self.MAX_RECIPIENTS} گیرنده مجاز است'
+            })
+        
         return attrs
 
 
-class ContactSerializer(serializers.Serializer):
-    """Serializer for contact list"""
-    id = serializers.IntegerField(read_only=True)
-    email = serializers.EmailField(read_only=True)
-    username = serializers.CharField(read_only=True)
+class ContactSerializer(SparseFieldsetMixin, serializers.Serializer):
+    """Serializer for contact list (Conversation summaries)"""
+    id = serializers.IntegerField(source='peer.id', read_only=True)
+    email = serializers.EmailField(source='peer.email', read_only=True)
+    username = serializers.CharField(source='peer.username', read_only=True)
     name = serializers.SerializerMethodField()
     profile_image = serializers.SerializerMethodField()
+    unread_count = serializers.IntegerField(read_only=True)
     last_message = serializers.SerializerMethodField()
     
     def get_name(self, obj):
         """Get contact's name"""
-        if hasattr(obj, 'profile'):
-            return obj.profile.get_full_name()
-        return obj.username
+        if hasattr(obj.peer, 'profile'):
+            return obj.peer.profile.get_full_name()
+        return obj.peer.username
     
     def get_profile_image(self, obj):
         """Get contact's profile image URL"""
-        if hasattr(obj, 'profile') and obj.profile.profile_image:
+        if hasattr(obj.peer, 'profile') and obj.peer.profile.profile_image:
             request = self.context.get('request')
             if request:
-                return request.build_absolute_uri(obj.profile.profile_image.url)
+                return request.build_absolute_uri(obj.peer.profile.profile_image.url)
         return None
     
     def get_last_message(self, obj):
-        """Get last message with this contact"""
-        user = self.context.get('user')
-        if not user:
+        """Get last message with this contact from the conversation summary"""
+        if not obj.last_message_id:
             return None
         
-        last_message = Message.objects.filter(
-            models.Q(sender=user, receiver=obj) | models.Q(sender=obj, receiver=user)
-        ).exclude(status='deleted').order_by('-created_at').first()
-        
-        if last_message:
+        return {
+            'id': obj.last_message_id,
+            'subject': obj.last_message_subject,
+            'body': obj.last_message_snippet or None,
+            'created_at': obj.last_message_at,
+            'is_sent_by_me': obj.is_last_sent_by_user,
+        }
+
+
+class MailboxStateMixin:
+    """
+    Render per-user mailbox state (folder, star, spam, archive) of a message
+    
+    Uses the mailbox_<field> annotations added by MessageService.get_user_messages
+    and falls back to loading the requesting user's MailboxEntry.
+    """
+    
+    def get_mailbox_state(self, obj):
+        """Get the requesting user's mailbox state of a message as a dict"""
+        if hasattr(obj, 'mailbox_folder'):
             return {
-                'id': last_message.id,
-                'subject': last_message.subject,
-                'body': last_message.body[:100] if last_message.body else None,
-                'created_at': last_message.created_at,
-                'is_sent_by_me': last_message.sender == user,
+                field: getattr(obj, f'mailbox_{field}')
+                for field in MailboxEntry.STATE_FIELDS
             }
-        return None
+        
+        if not hasattr(obj, '_mailbox_state'):
+            obj._mailbox_state = {}
+            request = self.context.get('request')
+            if request and request.user and request.user.is_authenticated:
+                obj._mailbox_state = MailboxEntry.objects.filter(
+                    message=obj,
+                    user=request.user
+                ).values(*MailboxEntry.STATE_FIELDS).first() or {}
+        return obj._mailbox_state
+    
+    def get_folder(self, obj):
+        """Get folder of the message in the user's mailbox"""
+        return self.get_mailbox_state(obj).get('folder')
+    
+    def get_is_starred(self, obj):
+        """Check if message is starred by the user"""
+        return bool(self.get_mailbox_state(obj).get('is_starred'))
+    
+    def get_is_spam(self, obj):
+        """Check if message is in the user's spam folder"""
+        return bool(self.get_mailbox_state(obj).get('is_spam'))
+    
+    def get_status(self, obj):
+        """Get message status ('archived' if the user archived it)"""
+        if self.get_mailbox_state(obj).get('is_archived'):
+            return 'archived'
+        return obj.status
 
 
-class MessageListSerializer(serializers.ModelSerializer):
-    """Serializer for listing messages"""
+class MessageListSerializer(SparseFieldsetMixin, MailboxStateMixin, serializers.ModelSerializer):
+    """Serializer for listing messages (body preview as `snippet`, full body in the detail)"""
     sender_email = serializers.EmailField(source='sender.email', read_only=True)
     sender_username = serializers.CharField(source='sender.username', read_only=True)
     sender_name = serializers.SerializerMethodField()
@@ -119,13 +177,18 @@ class MessageListSerializer(serializers.ModelSerializer):
     attachment_name = serializers.SerializerMethodField()
     has_attachment = serializers.SerializerMethodField()
     public_link_url = serializers.SerializerMethodField()
+    status = serializers.SerializerMethodField()
+    folder = serializers.SerializerMethodField()
+    is_starred = serializers.SerializerMethodField()
+    is_spam = serializers.SerializerMethodField()
+    thread_count = serializers.SerializerMethodField()
     
     class Meta:
         model = Message
         fields = (
             'id',
             'subject',
-            'body',
+            'snippet',
             'sender_email',
             'sender_username',
             'sender_name',
@@ -136,6 +199,7 @@ class MessageListSerializer(serializers.ModelSerializer):
             'receiver_profile_image',
             'is_private',
             'status',
+            'folder',
             'created_at',
             'sent_at',
             'delivered_at',
@@ -147,11 +211,19 @@ class MessageListSerializer(serializers.ModelSerializer):
             'has_attachment',
             'attachment_size',
             'attachment_name',
+            'attachment_mime',
             'public_link',
             'public_link_url',
+            'thread_id',
+            'in_reply_to',
+            'thread_count',
         )
         read_only_fields = fields
     
+    def get_thread_count(self, obj):
+        """Get the number of messages of the thread (thread-grouped listings only)"""
+        return getattr(obj, 'thread_count', None)
+    
     def get_attachment_size(self, obj):
         """Get attachment size in MB"""
         return obj.get_attachment_size()
@@ -159,7 +231,7 @@ class MessageListSerializer(serializers.ModelSerializer):
     def get_attachment_name(self, obj):
         """Get attachment file name"""
         if obj.attachment:
-            return os.path.basename(obj.attachment.name)
+            return obj.attachment_name or os.path.basename(obj.attachment.name)
         return None
     
     def get_has_attachment(self, obj):
@@ -202,7 +274,15 @@ class MessageListSerializer(serializers.ModelSerializer):
         return None
 
 
-class MessageDetailSerializer(serializers.ModelSerializer):
+class MessageThreadSerializer(MessageListSerializer):
+    """Serializer for the messages of a thread (with their full body)"""
+    
+    class Meta(MessageListSerializer.Meta):
+        fields = MessageListSerializer.Meta.fields + ('body',)
+        read_only_fields = fields
+
+
+class MessageDetailSerializer(SparseFieldsetMixin, MailboxStateMixin, serializers.ModelSerializer):
     """Serializer for detailed message view"""
     sender_email = serializers.EmailField(source='sender.email', read_only=True)
     sender_username = serializers.CharField(source='sender.username', read_only=True)
@@ -217,6 +297,10 @@ class MessageDetailSerializer(serializers.ModelSerializer):
     attachment_url = serializers.SerializerMethodField()
     has_attachment = serializers.SerializerMethodField()
     public_link_url = serializers.SerializerMethodField()
+    status = serializers.SerializerMethodField()
+    folder = serializers.SerializerMethodField()
+    is_starred = serializers.SerializerMethodField()
+    is_spam = serializers.SerializerMethodField()
     
     class Meta:
         model = Message
@@ -234,6 +318,7 @@ class MessageDetailSerializer(serializers.ModelSerializer):
             'receiver_profile_image',
             'is_private',
             'status',
+            'folder',
             'created_at',
             'sent_at',
             'delivered_at',
@@ -244,12 +329,17 @@ class MessageDetailSerializer(serializers.ModelSerializer):
             'is_spam',
             'is_sender_spam',
             'is_sender_blocked',
+            'recipient_kind',
+            'recipients',
             'has_attachment',
             'attachment_size',
             'attachment_name',
+            'attachment_mime',
             'attachment_url',
             'public_link',
             'public_link_url',
+            'thread_id',
+            'in_reply_to',
         )
         read_only_fields = fields
     
@@ -260,7 +350,7 @@ class MessageDetailSerializer(serializers.ModelSerializer):
     def get_attachment_name(self, obj):
         """Get attachment file name"""
         if obj.attachment:
-            return os.path.basename(obj.attachment.name)
+            return obj.attachment_name or os.path.basename(obj.attachment.name)
         return None
     
     def get_attachment_url(self, obj):
@@ -268,7 +358,7 @@ class MessageDetailSerializer(serializers.ModelSerializer):
         if obj.attachment:
             request = self.context.get('request')
             if request:
-                return request.build_absolute_uri(obj.attachment.url)
+                return request.build_absolute_uri(reverse('message:attachment', args=[obj.id]))
         return None
     
     def get_has_attachment(self, obj):
@@ -312,20 +402,94 @@ class MessageDetailSerializer(serializers.ModelSerializer):
     
     is_sender_spam = serializers.SerializerMethodField()
     is_sender_blocked = serializers.SerializerMethodField()
+    recipients = serializers.SerializerMethodField()
+    
+    def get_recipients(self, obj):
+        """
+        Get the to/cc/bcc addresses of a multi-recipient message
+        
+        The sender sees every address; a recipient sees to/cc and, if
+        bcc'd, only their own bcc address.
+        """
+        if not obj.batch_id:
+            return None
+        
+        request = self.context.get('request')
+        user_id = request.user.id if request and request.user.is_authenticated else None
+        recipients = {kind: [] for kind, _ in Message.RECIPIENT_KIND_CHOICES}
+        copies = Message.objects.filter(batch_id=obj.batch_id).values_list('receiver_id', 'receiver__email', 'recipient_kind')
+        for receiver_id, email, kind in copies.order_by('id'):
+            if kind != 'bcc' or user_id in (obj.sender_id, receiver_id):
+                recipients[kind].append(email)
+        return recipients
+    
+    def get_block_state(self, obj):
+        """
+        Get the receiver -> sender block of a message as (is_blocked, is_spam)
+        
+        Reads the 'blocks' map the view loaded for the serialized messages
+        (see MessageService.get_block_map); views that pass none get it
+        loaded for obj.
+        """
+        if not obj.receiver_id:
+            return False, False
+        
+        blocks = self.context.get('blocks')
+        if blocks is None:
+            if not hasattr(obj, '_block_map'):
+                from .services import MessageService
+                obj._block_map = MessageService.get_block_map([obj])
+            blocks = obj._block_map
+        
+        key = (obj.receiver_id, obj.sender_id)
+        return key in blocks, blocks.get(key, False)
     
     def get_is_sender_spam(self, obj):
         """Check if sender is marked as spam by receiver"""
-        if obj.receiver:
-            from .services import MessageService
-            return MessageService.is_spam_sender(blocker=obj.receiver, blocked=obj.sender)
-        return False
+        return self.get_block_state(obj)[1]
     
     def get_is_sender_blocked(self, obj):
         """Check if sender is blocked by receiver"""
-        if obj.receiver:
-            from .services import MessageService
-            return MessageService.is_blocked(blocker=obj.receiver, blocked=obj.sender)
-        return False
+        return self.get_block_state(obj)[0]
+
+
+class MailboxCounterSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """Serializer for mailbox folder counters"""
+    
+    class Meta:
+        model = MailboxCounter
+        fields = (
+            'unread_count',
+            'starred_count',
+            'spam_count',
+            'archived_count',
+            'updated_at',
+        )
+        read_only_fields = fields
+
+
+class MessageReplySerializer(serializers.Serializer):
+    """Serializer for replying to a message"""
+    subject = serializers.CharField(max_length=255, required=False, allow_blank=True, label='موضوع')
+    body = serializers.CharField(label='متن پیام')
+    attachment = serializers.FileField(required=False, allow_null=True, label='فایل ضمیمه')
+    
+    validate_attachment = MessageCreateSerializer.validate_attachment
+
+
+class BulkActionSerializer(serializers.Serializer):
+    """Serializer for applying one action to many messages"""
+    
+    # Max number of messages per bulk request
+    MAX_IDS = 500
+    
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_IDS,
+        label='شناسه پیام‌ها'
+    )
+    action = serializers.ChoiceField(choices=list(MessageService.BULK_ACTIONS), label='عملیات')
 
 
 class BlockUserSerializer(serializers.Serializer):
@@ -334,7 +498,7 @@ class BlockUserSerializer(serializers.Serializer):
     is_spam = serializers.BooleanField(default=False, required=False, label='اسپم')
 
 
-class BlockedUserSerializer(serializers.Serializer):
+class BlockedUserSerializer(SparseFieldsetMixin, serializers.Serializer):
     """Serializer for blocked users list"""
     id = serializers.IntegerField(read_only=True)
     email = serializers.EmailField(read_only=True)
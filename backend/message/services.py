@@ -1,8 +1,19 @@
+import os
+import uuid
+from datetime import datetime, timezone as dt_timezone
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 from django.contrib.auth import get_user_model
-from django.db import models
-from .models import Message, Block
+from django.db import models, transaction
+from django.db.models.functions import Coalesce, Greatest
+from .models import Message, Block, MailboxEntry, Conversation, MailboxCounter, AttachmentBlob
+from .search import MessageSearchIndex
+from .pagination import QuerySetStream
+from .timeline import PublicTimeline, PublicTimelineStream
+from .blocks import BlockGraph
+from .attachments import AttachmentStore
+from .events import MessageEvents
+from acoount.search import UserSearchIndex
 
 User = get_user_model()
 
@@ -10,8 +21,37 @@ User = get_user_model()
 class MessageService:
     """Service class for message operations"""
     
+    # Relations rendered by the message serializers, loaded with the message rows
+    MESSAGE_RELATED = ('sender', 'sender__profile', 'receiver', 'receiver__profile')
+    
+    # Mailbox entry filters of the folders served straight from the mailbox index
+    MAILBOX_FOLDER_FILTERS = {
+        'mailbox': {},
+        'sent': {'folder': 'sent'},
+        'received': {'role': 'receiver'},
+        'starred': {'is_starred': True},
+        'spam': {'folder': 'spam'},
+        'archived': {'folder': 'archived'},
+    }
+    
+    # Mailbox entry flags set by each bulk action ('delete' removes the entries)
+    BULK_ACTIONS = {
+        'read': {'is_read': True},
+        'unread': {'is_read': False},
+        'star': {'is_starred': True},
+        'unstar': {'is_starred': False},
+        'archive': {'is_archived': True},
+        'unarchive': {'is_archived': False},
+        'spam': {'is_spam': True},
+        'not_spam': {'is_spam': False},
+        'delete': None,
+    }
+    
+    # Bulk actions only the receiver of a message may apply
+    RECEIVER_ONLY_ACTIONS = ('read', 'unread', 'spam', 'not_spam')
+    
     @staticmethod
-    def create_message(sender, subject, body, is_private=True, receiver_email=None, attachment=None):
+    def create_message(sender, subject, body, is_private=True, receiver_email=None, attachment=None, in_reply_to=None):
         """
         Create a new message
         
@@ -22,6 +62,7 @@ class MessageService:
             is_private: Boolean - is message private
             receiver_email: Email of receiver (required if private)
             attachment: File object (max 10MB)
+            in_reply_to: Message object the new message answers (joins its thread)
         
         Returns:
             Message object
@@ -46,85 +87,737 @@ class MessageService:
         if receiver:
             is_spam = MessageService.is_spam_sender(blocker=receiver, blocked=sender)
         
-        # Create message
-        message = Message.objects.create(
+        # Create message and the participants' mailbox entries
+        with transaction.atomic():
+            # Identical attachments are stored once and shared by reference
+            blob = AttachmentStore.store(attachment) if attachment else None
+            message = Message.objects.create(
+                sender=sender,
+                receiver=receiver,
+                subject=subject,
+                body=body,
+                is_private=is_private,
+                attachment=blob.file.name if blob else None,
+                attachment_blob=blob,
+                attachment_name=os.path.basename(attachment.name) if attachment else '',
+                attachment_size=blob.size if blob else 0,
+                attachment_mime=AttachmentStore.guess_mime(attachment.name, getattr(attachment, 'content_type', None)) if attachment else '',
+                status='sent',
+                sent_at=timezone.now(),
+                in_reply_to=in_reply_to,
+                **({'thread_id': in_reply_to.thread_id} if in_reply_to else {})
+            )
+            MessageService.create_mailbox_entries(message, is_spam=is_spam)
+            MessageService.update_conversations(message)
+            MessageService.apply_counter_deltas(
+                {},
+                MailboxCounter.count_entries(MailboxEntry.objects.filter(message=message))
+            )
+            MessageService.bump_mailbox_versions([message.sender_id, message.receiver_id])
+            MessageEvents.message_created([message])
+        
+        return message
+    
+    @staticmethod
+    def create_messages(sender, subject, body, recipients, attachment=None):
+        """
+        Send a private message to many recipients (to/cc/bcc)
+        
+        One copy of the message is created per recipient. Recipients are
+        resolved with one query, their block lists come from the block graph
+        (one query for uncached users), the copies, mailbox entries and
+        conversation summaries are written in bulk and the attachment is
+        stored once. Unknown and blocking recipients are skipped.
+        
+        Args:
+            sender: User object (sender)
+            subject: Message subject
+            body: Message body
+            recipients: dict with 'to', 'cc' and 'bcc' lists of emails
+            attachment: File object (max 10MB)
+        
+        Returns:
+            List of dicts {email, kind, status ('sent', 'not_found' or 'blocked'), message_id}
+        """
+        # An address listed twice keeps its most visible kind (to > cc > bcc)
+        kinds = {}
+        for kind, _ in Message.RECIPIENT_KIND_CHOICES:
+            for email in recipients.get(kind) or []:
+                kinds.setdefault(email, kind)
+        if not kinds:
+            raise ValidationError('برای پیام خصوصی، گیرنده الزامی است')
+        
+        users = {user.email: user for user in User.objects.filter(email__in=list(kinds))}
+        graphs = BlockGraph.get_many(user.id for user in users.values())
+        
+        results = []
+        messages = []
+        spam_flags = []
+        snippet = Message.build_snippet(body)
+        # Compress a large body once for every copy
+        stored_body = Message._meta.get_field('body').compress(body)
+        batch_id = uuid.uuid4()
+        sent_at = timezone.now()
+        for email, kind in kinds.items():
+            receiver = users.get(email)
+            result = {'email': email, 'kind': kind, 'status': 'sent', 'message_id': None}
+            results.append(result)
+            if receiver is None:
+                result['status'] = 'not_found'
+                continue
+            if sender.id in graphs[receiver.id]:
+                result['status'] = 'blocked'
+                continue
+            spam_flags.append(graphs[receiver.id].get(sender.id, False))
+            messages.append(Message(
+                sender=sender,
+                receiver=receiver,
+                subject=subject,
+                body=stored_body,
+                is_private=True,
+                snippet=snippet,
+                recipient_kind=kind,
+                batch_id=batch_id,
+                status='sent',
+                sent_at=sent_at
+            ))
+        
+        if not messages:
+            return results
+        
+        with transaction.atomic():
+            # Identical attachments are stored once and shared by reference
+            if attachment:
+                blob = AttachmentStore.store(attachment)
+                if len(messages) > 1:
+                    AttachmentBlob.objects.filter(id=blob.id).update(ref_count=models.F('ref_count') + len(messages) - 1)
+                for message in messages:
+                    message.attachment = blob.file.name
+                    message.attachment_blob = blob
+                    message.attachment_name = os.path.basename(attachment.name)
+                    message.attachment_size = blob.size
+                    message.attachment_mime = AttachmentStore.guess_mime(attachment.name, getattr(attachment, 'content_type', None))
+            
+            Message.objects.bulk_create(messages)
+            
+            # The sender files one copy of the batch in their sent folder
+            sender_copy = next((m for m in messages if m.receiver_id != sender.id), None)
+            entries = []
+            for message, is_spam in zip(messages, spam_flags):
+                entries += MessageService.build_mailbox_entries(message, is_spam=is_spam, include_sender=message is sender_copy)
+            MailboxEntry.objects.bulk_create(entries)
+            
+            MessageService.update_conversations_many(messages)
+            MessageService.apply_counter_deltas(
+                {},
+                MailboxCounter.count_entries(MailboxEntry.objects.filter(message__in=messages))
+            )
+            MessageService.bump_mailbox_versions([sender.id] + [message.receiver_id for message in messages])
+            
+            # bulk_create sends no post_save, index the copies here
+            MessageSearchIndex.index_messages(messages)
+            MessageEvents.message_created(messages)
+        
+        message_ids = {message.receiver.email: message.id for message in messages}
+        for result in results:
+            result['message_id'] = message_ids.get(result['email']) if result['status'] == 'sent' else None
+        return results
+    
+    @staticmethod
+    def reply_to_message(sender, message, body, subject=None, attachment=None):
+        """
+        Reply to a message in its thread
+        
+        The reply is private and goes to the other participant of the
+        message (its sender, or its receiver when the user wrote it).
+        
+        Args:
+            sender: User object (replying user, must have access to the message)
+            message: Message object being answered
+            body: Reply body
+            subject: Reply subject (default: 'Re: ' + the message's subject)
+            attachment: File object (max 10MB)
+        
+        Returns:
+            Message object
+        """
+        peer = message.receiver if message.sender_id == sender.id else message.sender
+        if peer is None or not peer.email:
+            raise ValidationError('این پیام گیرنده‌ای برای پاسخ ندارد')
+        
+        if not subject:
+            subject = message.subject if message.subject.startswith('Re: ') else f'Re: {message.subject}'
+        
+        return MessageService.create_message(
             sender=sender,
-            receiver=receiver,
-            subject=subject,
+            subject=subject[:Message._meta.get_field('subject').max_length],
             body=body,
-            is_private=is_private,
+            is_private=True,
+            receiver_email=peer.email,
             attachment=attachment,
-            status='sent',
-            sent_at=timezone.now(),
-            is_spam=is_spam
+            in_reply_to=message
         )
+    
+    @staticmethod
+    def get_thread_messages(user, thread_id):
+        """
+        Get the messages of a thread visible to a user, oldest first
         
-        return message
+        One query over the (thread_id, created_at) index: participants are
+        joined in and the user's mailbox state is annotated per message.
+        
+        Args:
+            user: User object
+            thread_id: UUID of the thread
+        
+        Returns:
+            List of Message objects annotated like get_user_messages
+        """
+        entries = MailboxEntry.objects.filter(user=user, message=models.OuterRef('pk'))
+        messages = Message.objects.filter(thread_id=thread_id).filter(
+            models.Q(sender=user) | models.Q(receiver=user) | models.Q(is_private=False)
+        ).exclude(status='deleted').select_related(*MessageService.MESSAGE_RELATED)
+        messages = messages.annotate(
+            mailbox_created_at=models.F('created_at'),
+            **{
+                f'mailbox_{field}': models.Subquery(entries.values(field)[:1])
+                for field in MailboxEntry.STATE_FIELDS
+            }
+        )
+        return list(messages.order_by('created_at', 'id'))
+    
+    @staticmethod
+    def filter_thread_heads(messages, user, entry_filter):
+        """
+        Keep only the latest message of each thread within a listing
+        
+        A message is dropped when a newer message of its thread is in the
+        same listing (the user's mailbox entries matching entry_filter); the
+        lookup reads the (thread_id, created_at) index. Each kept message is
+        annotated with thread_count, the thread's size in the user's mailbox.
+        
+        Args:
+            messages: QuerySet of Message objects
+            user: User object
+            entry_filter: Q over mailbox_entries__ lookups of the listing
+        
+        Returns:
+            QuerySet
+        """
+        thread = Message.objects.filter(thread_id=models.OuterRef('thread_id')).exclude(status='deleted')
+        newer = thread.filter(
+            models.Q(created_at__gt=models.OuterRef('created_at')) |
+            models.Q(created_at=models.OuterRef('created_at'), id__gt=models.OuterRef('id'))
+        ).filter(models.Q(mailbox_entries__user=user) & entry_filter)
+        thread_count = thread.filter(mailbox_entries__user=user).order_by().values('thread_id').annotate(
+            count=models.Count('id')
+        ).values('count')
+        return messages.filter(~models.Exists(newer)).annotate(
+            thread_count=Coalesce(models.Subquery(thread_count), 1)
+        )
+    
+    @staticmethod
+    def create_mailbox_entries(message, is_spam=False):
+        """
+        Create the per-participant mailbox entries of a new message
+        
+        Args:
+            message: Message object
+            is_spam: Boolean - sender is marked as spam by receiver
+        
+        Returns:
+            List of MailboxEntry objects
+        """
+        return MailboxEntry.objects.bulk_create(MessageService.build_mailbox_entries(message, is_spam=is_spam))
+    
+    @staticmethod
+    def build_mailbox_entries(message, is_spam=False, include_sender=True):
+        """
+        Build (unsaved) the per-participant mailbox entries of a new message
+        
+        Args:
+            message: Message object
+            is_spam: Boolean - sender is marked as spam by receiver
+            include_sender: Boolean - add the sender's 'sent' entry
+        
+        Returns:
+            List of MailboxEntry objects
+        """
+        entries = []
+        if include_sender and message.receiver_id != message.sender_id:
+            entries.append(MailboxEntry(
+                user_id=message.sender_id,
+                message=message,
+                role='sender',
+                folder='sent',
+                is_read=True,
+                created_at=message.created_at
+            ))
+        if message.receiver_id:
+            entries.append(MailboxEntry(
+                user_id=message.receiver_id,
+                message=message,
+                role='receiver',
+                folder='spam' if is_spam else 'inbox',
+                is_spam=is_spam,
+                created_at=message.created_at
+            ))
+        return entries
+    
+    @staticmethod
+    def update_conversations(message):
+        """
+        Move a new private message to the top of both participants' conversation summaries
+        
+        Args:
+            message: Message object
+        """
+        MessageService.update_conversations_many([message])
+    
+    @staticmethod
+    def update_conversations_many(messages):
+        """
+        Move new private messages to the top of their participants' conversation summaries
+        
+        Existing summaries are loaded with one query and written with one
+        bulk update, missing ones with one bulk insert.
+        
+        Args:
+            messages: List of saved Message objects
+        """
+        summaries = {}
+        for message in sorted(messages, key=lambda m: m.created_at):
+            if not message.receiver_id or message.receiver_id == message.sender_id:
+                continue
+            summaries[(message.sender_id, message.receiver_id)] = (message, True)
+            summaries[(message.receiver_id, message.sender_id)] = (message, False)
+        if not summaries:
+            return
+        
+        existing = {
+            (conversation.user_id, conversation.peer_id): conversation
+            for conversation in Conversation.objects.filter(
+                user_id__in={user_id for user_id, _ in summaries},
+                peer_id__in={peer_id for _, peer_id in summaries}
+            )
+        }
+        
+        updated = []
+        created = []
+        received = []
+        for (user_id, peer_id), (message, is_sent) in summaries.items():
+            conversation = existing.get((user_id, peer_id))
+            if conversation is None:
+                conversation = Conversation(user_id=user_id, peer_id=peer_id, unread_count=0 if is_sent else 1)
+                created.append(conversation)
+            else:
+                updated.append(conversation)
+                if not is_sent:
+                    received.append(conversation.id)
+            conversation.last_message = message
+            conversation.last_message_subject = message.subject
+            conversation.last_message_snippet = message.snippet[:Conversation.SNIPPET_LENGTH]
+            conversation.last_message_at = message.created_at
+            conversation.is_last_sent_by_user = is_sent
+        
+        if updated:
+            Conversation.objects.bulk_update(updated, [
+                'last_message',
+                'last_message_subject',
+                'last_message_snippet',
+                'last_message_at',
+                'is_last_sent_by_user',
+            ])
+        if created:
+            Conversation.objects.bulk_create(created)
+        if received:
+            Conversation.objects.filter(id__in=received).update(unread_count=models.F('unread_count') + 1)
+    
+    @staticmethod
+    def refresh_conversation_unread(user, peer):
+        """Recount unread, non-archived messages from peer in user's conversation summary"""
+        MessageService.refresh_conversations_unread(user, [peer.id])
+    
+    @staticmethod
+    def refresh_conversations_unread(user, peer_ids):
+        """Recount unread, non-archived messages from several peers with one count and one update"""
+        counts = dict(
+            MailboxEntry.objects.filter(
+                user=user,
+                role='receiver',
+                is_read=False,
+                is_archived=False,
+                message__sender_id__in=peer_ids
+            ).values_list('message__sender_id').annotate(models.Count('id')).order_by()
+        )
+        Conversation.objects.filter(user=user, peer_id__in=peer_ids).update(
+            unread_count=models.Case(
+                *[models.When(peer_id=peer_id, then=models.Value(count)) for peer_id, count in counts.items()],
+                default=models.Value(0)
+            )
+        )
+    
+    @staticmethod
+    def get_mailbox_entry(message, user):
+        """
+        Get the mailbox entry of a message for one of its participants
+        
+        Raises:
+            ValidationError: If user is not sender or receiver of the message
+        """
+        try:
+            return MailboxEntry.objects.get(message=message, user=user)
+        except MailboxEntry.DoesNotExist:
+            raise ValidationError('شما دسترسی به این پیام ندارید')
+    
+    @staticmethod
+    def update_mailbox_entries(entries, **flags):
+        """
+        Update flags of mailbox entries, move them to the matching folder
+        and adjust the owners' mailbox counters
+        
+        Args:
+            entries: QuerySet of MailboxEntry objects (must not filter on the updated flags)
+            **flags: is_starred/is_read/is_archived/is_spam values
+        
+        Returns:
+            Number of updated entries
+        """
+        with transaction.atomic():
+            before = MailboxCounter.count_entries(entries)
+            rows = list(entries.values_list('user_id', 'message_id'))
+            updated = entries.update(**flags)
+            if updated and ('is_archived' in flags or 'is_spam' in flags):
+                entries.update(folder=MailboxEntry.folder_expression())
+            if updated:
+                MessageService.apply_counter_deltas(before, MailboxCounter.count_entries(entries))
+                MessageService.bump_mailbox_versions(user_id for user_id, _ in rows)
+                MessageEvents.message_updated(rows, flags)
+        return updated
+    
+    @staticmethod
+    def apply_counter_deltas(before, after):
+        """
+        Apply the difference of two MailboxCounter.count_entries results to the users' counters
+        
+        Users without a counter row are skipped, their row is computed from
+        scratch on first read (see get_mailbox_counters).
+        """
+        # Users with the same deltas (e.g. every recipient of a message) share one update
+        users_by_deltas = {}
+        for user_id in set(before) | set(after):
+            deltas = tuple(
+                (name, after.get(user_id, {}).get(name, 0) - before.get(user_id, {}).get(name, 0))
+                for name in MailboxCounter.COUNTER_FILTERS
+            )
+            if any(delta for _, delta in deltas):
+                users_by_deltas.setdefault(deltas, []).append(user_id)
+        
+        for deltas, user_ids in users_by_deltas.items():
+            MailboxCounter.objects.filter(user_id__in=user_ids).update(**{
+                name: Greatest(models.F(name) + delta, 0)
+                for name, delta in deltas
+                if delta
+            })
+    
+    @staticmethod
+    def bump_mailbox_versions(user_ids):
+        """
+        Move the mailbox version of users whose listed messages changed
+        
+        Runs in the caller's transaction; users without a counter row get
+        one (version 0) on first read.
+        
+        Args:
+            user_ids: Iterable of user ids (None values are ignored)
+        """
+        user_ids = set(user_ids) - {None}
+        if user_ids:
+            MailboxCounter.objects.filter(user_id__in=user_ids).update(
+                version=models.F('version') + 1,
+                updated_at=timezone.now()
+            )
+    
+    @staticmethod
+    def get_mailbox_counters(user):
+        """
+        Get unread/starred/spam/archived counters of a user
+        
+        Returns:
+            MailboxCounter object
+        """
+        try:
+            return MailboxCounter.objects.get(user=user)
+        except MailboxCounter.DoesNotExist:
+            MessageService.reconcile_mailbox_counters(user_ids=[user.id])
+            return MailboxCounter.objects.get(user=user)
+    
+    @staticmethod
+    def get_mailbox_validators(user, message_type='mailbox'):
+        """
+        Get cheap validators of what a user's mailbox listing shows
+        
+        One counter row lookup; folders merged with the public timeline also
+        depend on the cached timeline version.
+        
+        Args:
+            user: User object
+            message_type: Folder of the listing ('mailbox' for the mailbox alone)
+        
+        Returns:
+            (tuple of validator values, last modified datetime)
+        """
+        counters = MessageService.get_mailbox_counters(user)
+        validators = (counters.id, counters.version)
+        last_modified = counters.updated_at
+        if message_type not in MessageService.MAILBOX_FOLDER_FILTERS:
+            public_version = PublicTimeline.get_version()
+            validators += (public_version,)
+            last_modified = max(last_modified, datetime.fromtimestamp(public_version / 1e9, tz=dt_timezone.utc))
+        return validators, last_modified
+    
+    @staticmethod
+    def reconcile_mailbox_counters(user_ids=None, batch_size=1000):
+        """
+        Recompute mailbox counters from the mailbox entries
+        
+        Args:
+            user_ids: Optional list of user ids (default: all users)
+            batch_size: Users recomputed per aggregate query
+        
+        Returns:
+            Number of reconciled users
+        """
+        users = User.objects.order_by('id')
+        if user_ids is not None:
+            users = users.filter(id__in=user_ids)
+        
+        zeros = {name: 0 for name in MailboxCounter.COUNTER_FILTERS}
+        reconciled = 0
+        last_id = 0
+        while True:
+            batch = list(users.filter(id__gt=last_id).values_list('id', flat=True)[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1]
+            reconciled += len(batch)
+            with transaction.atomic():
+                counts = MailboxCounter.count_entries(MailboxEntry.objects.filter(user_id__in=batch))
+                for user_id in batch:
+                    MailboxCounter.objects.update_or_create(
+                        user_id=user_id,
+                        defaults=counts.get(user_id, zeros)
+                    )
+        return reconciled
     
     @staticmethod
     def get_user_messages(user, message_type='all', search_query=None):
         """
         Get all messages for a user (sent and received)
         
+        Returns a single queryset, for consumers that iterate the whole
+        mailbox. Paginated listings use get_user_message_streams instead.
+        
         Args:
             user: User object
-            message_type: 'all', 'sent', 'received', 'inbox'
+            message_type: 'all', 'mailbox', 'sent', 'received', 'inbox', 'starred', 'spam', 'archived'
             search_query: Optional search query string
         
         Returns:
-            QuerySet of Message objects
-        """
-        if message_type == 'sent':
-            # Only sent messages
-            messages = Message.objects.filter(sender=user)
-        elif message_type == 'received':
-            # Only received messages
-            messages = Message.objects.filter(receiver=user)
-        elif message_type == 'inbox':
-            # Inbox: received private messages + public messages (excluding spam and archived)
-            messages = Message.objects.filter(
-                models.Q(receiver=user) | models.Q(is_private=False)
-            ).exclude(is_spam=True).exclude(status='archived')
-        elif message_type == 'starred':
-            # Only starred messages
-            messages = Message.objects.filter(
-                models.Q(sender=user) | models.Q(receiver=user) | models.Q(is_private=False),
-                is_starred=True
+            QuerySet of Message objects annotated with the user's mailbox state
+            (mailbox_created_at, mailbox_folder, mailbox_is_starred, ...)
+        """
+        if message_type in ('inbox', 'all') or message_type not in MessageService.MAILBOX_FOLDER_FILTERS:
+            # Private mail comes from the user's mailbox entries, public messages are visible to everyone
+            entries = MailboxEntry.objects.filter(user=user, message=models.OuterRef('pk'))
+            # The user's own public messages are listed through their mailbox entries
+            public = models.Q(is_private=False) & ~models.Exists(entries) & ~models.Q(sender=user)
+            if message_type == 'inbox':
+                in_mailbox = models.Exists(entries.filter(
+                    models.Q(folder='inbox') | models.Q(folder='sent', message__is_private=False)
+                ))
+            else:
+                in_mailbox = models.Exists(entries)
+            messages = Message.objects.filter(in_mailbox | public)
+            messages = messages.annotate(
+                mailbox_created_at=models.F('created_at'),
+                **{
+                    f'mailbox_{field}': models.Subquery(entries.values(field)[:1])
+                    for field in MailboxEntry.STATE_FIELDS
+                }
             )
-        elif message_type == 'spam':
-            # Only spam messages
-            messages = Message.objects.filter(
-                models.Q(sender=user) | models.Q(receiver=user) | models.Q(is_private=False),
-                is_spam=True
+        else:
+            messages = MessageService.get_mailbox_messages(
+                user,
+                MessageService.MAILBOX_FOLDER_FILTERS[message_type]
             )
-        elif message_type == 'archived':
-            # Only archived messages
-            messages = Message.objects.filter(
-                models.Q(sender=user) | models.Q(receiver=user) | models.Q(is_private=False),
-                status='archived'
+        
+        return MessageService.filter_listed_messages(messages, user, search_query)
+    
+    @staticmethod
+    def get_user_message_streams(user, message_type='inbox', search_query=None, group_by_thread=False, search_ids=None):
+        """
+        Get the disjoint message streams of a user's folder
+        
+        `inbox` and `all` are the user's mailbox entries merged with the public
+        timeline; every other folder is served from the mailbox index alone.
+        Each stream is read for one page at a time, so a page costs the same
+        however many public messages exist.
+        
+        Args:
+            user: User object
+            message_type: 'all', 'mailbox', 'sent', 'received', 'inbox', 'starred', 'spam', 'archived'
+            search_query: Optional search query string
+            group_by_thread: List each thread once, by its latest message in the folder
+            search_ids: Ranked ids from search_message_ids (streams are then ordered by search_rank)
+        
+        Returns:
+            List of streams for MessageCursorPagination.paginate_streams
+        """
+        # One index lookup shared by both streams
+        if search_ids is None and search_query and search_query.strip():
+            search_ids, _ = MessageService.search_message_ids(user, search_query)
+        
+        if message_type in MessageService.MAILBOX_FOLDER_FILTERS:
+            entry_filter = models.Q(**{
+                f'mailbox_entries__{key}': value
+                for key, value in MessageService.MAILBOX_FOLDER_FILTERS[message_type].items()
+            })
+        elif message_type == 'inbox':
+            # The user's own public messages stay in the inbox unless archived or marked as spam
+            entry_filter = (
+                models.Q(mailbox_entries__folder='inbox') |
+                models.Q(mailbox_entries__folder='sent', is_private=False)
             )
         else:
-            # All messages (sent and received)
-            messages = Message.objects.filter(
-                models.Q(sender=user) | models.Q(receiver=user) | models.Q(is_private=False)
-            )
+            entry_filter = models.Q()
+        
+        mailbox = MessageService.get_mailbox_messages(user, entry_filter)
+        if group_by_thread:
+            mailbox = MessageService.filter_thread_heads(mailbox, user, entry_filter)
+        
+        # Listings render the snippet, the full body is only loaded by the detail view
+        mailbox = mailbox.defer('body')
+        if message_type in MessageService.MAILBOX_FOLDER_FILTERS:
+            return [QuerySetStream(MessageService.filter_listed_messages(mailbox, user, search_query, search_ids))]
+        
+        # Public messages the user has no mailbox entry for; the rest come from the mailbox stream
+        entries = MailboxEntry.objects.filter(user=user, message=models.OuterRef('pk'))
+        public = Message.objects.filter(is_private=False).filter(~models.Exists(entries)).exclude(sender=user)
+        public = public.annotate(
+            mailbox_created_at=models.F('created_at'),
+            **{
+                f'mailbox_{field}': models.Value(None, output_field=MailboxEntry._meta.get_field(field))
+                for field in MailboxEntry.STATE_FIELDS
+            }
+        )
+        if group_by_thread:
+            public = MessageService.filter_thread_heads(public, user, entry_filter)
+        public = public.defer('body')
+        
+        return [
+            QuerySetStream(MessageService.filter_listed_messages(mailbox, user, search_query, search_ids)),
+            PublicTimelineStream(
+                MessageService.filter_listed_messages(public, user, search_query, search_ids),
+                use_cache=not (search_query and search_query.strip())
+            ),
+        ]
+    
+    @staticmethod
+    def get_mailbox_messages(user, entry_filter):
+        """
+        Get messages of a user's mailbox entries matching a folder filter
+        
+        One range scan over the user's (user, folder, -created_at) mailbox index.
+        
+        Args:
+            user: User object
+            entry_filter: Dict of MailboxEntry lookups, or a Q over mailbox_entries__
         
-        # Exclude deleted messages
-        messages = messages.exclude(status='deleted')
+        Returns:
+            QuerySet of Message objects annotated with the user's mailbox state
+        """
+        if not isinstance(entry_filter, models.Q):
+            entry_filter = models.Q(**{
+                f'mailbox_entries__{key}': value
+                for key, value in entry_filter.items()
+            })
+        # A single filter() call so every lookup targets the same mailbox entry join
+        messages = Message.objects.filter(models.Q(mailbox_entries__user=user) & entry_filter)
+        return messages.annotate(
+            mailbox_created_at=models.F('mailbox_entries__created_at'),
+            **{
+                f'mailbox_{field}': models.F(f'mailbox_entries__{field}')
+                for field in MailboxEntry.STATE_FIELDS
+            }
+        )
+    
+    @staticmethod
+    def search_message_ids(user, search_query):
+        """
+        Rank the messages a user may see against a search query
+        
+        At most MessageSearchIndex.RESULT_LIMIT matches are kept.
+        
+        Args:
+            user: User object
+            search_query: Search query string
+        
+        Returns:
+            (list of message ids, best match first, Boolean - more messages matched),
+            or (None, False) if the database has no search index
+        """
+        if not MessageSearchIndex.is_supported():
+            return None, False
+        
+        limit = MessageSearchIndex.RESULT_LIMIT
+        message_ids = MessageSearchIndex.search(user, search_query, limit=limit + 1)
+        return message_ids[:limit], len(message_ids) > limit
+    
+    @staticmethod
+    def filter_listed_messages(messages, user, search_query=None, search_ids=None):
+        """
+        Exclude deleted messages, load rendered relations and apply search
+        
+        Args:
+            messages: Message QuerySet annotated with mailbox_created_at
+            user: User object
+            search_query: Optional search query string
+            search_ids: Ranked ids from search_message_ids, if already searched
+        
+        Returns:
+            QuerySet ordered by (-mailbox_created_at, -id), or for indexed
+            searches annotated with search_rank and ordered by (-search_rank, -id)
+        """
+        messages = messages.exclude(status='deleted').select_related(*MessageService.MESSAGE_RELATED)
+        
+        if search_ids is None and search_query and search_query.strip():
+            search_ids, _ = MessageService.search_message_ids(user, search_query)
         
         # Apply search query if provided
-        if search_query and search_query.strip():
+        if search_ids is not None:
+            # Ranked full-text search: the best match gets the highest rank
+            rank = models.Case(
+                *[models.When(id=message_id, then=len(search_ids) - position) for position, message_id in enumerate(search_ids)],
+                default=0,
+                output_field=models.IntegerField()
+            )
+            messages = messages.filter(id__in=search_ids).annotate(search_rank=rank)
+            return messages.order_by('-search_rank', '-id')
+        elif search_query and search_query.strip():
+            # No search index: bodies may be stored compressed, so only their
+            # (plain text) snippet is matched
             search_query = search_query.strip()
             messages = messages.filter(
                 models.Q(subject__icontains=search_query) |
-                models.Q(body__icontains=search_query) |
+                models.Q(snippet__icontains=search_query) |
                 models.Q(sender__email__icontains=search_query) |
                 models.Q(sender__username__icontains=search_query) |
                 models.Q(receiver__email__icontains=search_query) |
                 models.Q(receiver__username__icontains=search_query)
             )
         
-        return messages.order_by('-created_at')
+        return messages.order_by('-mailbox_created_at', '-id')
     
     @staticmethod
     def mark_as_read(message, user):
@@ -138,7 +831,18 @@ class MessageService:
         if message.receiver != user:
             raise ValidationError('فقط گیرنده می‌تواند پیام را به عنوان خوانده شده علامت بزند')
         
-        message.mark_as_read()
+        was_read = message.read_at is not None
+        with transaction.atomic():
+            message.mark_as_read()
+            MessageService.update_mailbox_entries(
+                MailboxEntry.objects.filter(message=message, user=user),
+                is_read=True
+            )
+            MessageService.refresh_conversation_unread(user, message.sender)
+            # Read receipt for the sender, sent once
+            if not was_read:
+                MessageService.bump_mailbox_versions([message.sender_id])
+                MessageEvents.message_updated([(message.sender_id, message.id)], {'status': 'read'})
         return message
     
     @staticmethod
@@ -154,12 +858,12 @@ class MessageService:
             Message object
         """
         try:
-            message = Message.objects.get(id=message_id)
+            message = Message.objects.select_related(*MessageService.MESSAGE_RELATED).get(id=message_id)
             
             if message.is_private:
                 if not user:
                     raise ValidationError('این پیام خصوصی است و نیاز به احراز هویت دارد')
-                if message.sender != user and message.receiver != user:
+                if message.sender_id != user.id and message.receiver_id != user.id:
                     raise ValidationError('شما دسترسی به این پیام ندارید')
             
             return message
@@ -179,12 +883,12 @@ class MessageService:
             Message object
         """
         try:
-            message = Message.objects.get(public_link=public_link)
+            message = Message.objects.select_related(*MessageService.MESSAGE_RELATED).get(public_link=public_link)
             
             if message.is_private:
                 if not user:
                     raise ValidationError('این پیام خصوصی است و نیاز به احراز هویت دارد')
-                if message.sender != user and message.receiver != user:
+                if message.sender_id != user.id and message.receiver_id != user.id:
                     raise ValidationError('شما دسترسی به این پیام ندارید')
             
             return message
@@ -194,24 +898,86 @@ class MessageService:
     @staticmethod
     def is_blocked(blocker, blocked):
         """Check if a user is blocked by another user"""
-        return Block.objects.filter(blocker=blocker, blocked=blocked).exists()
+        return blocked.id in BlockGraph.get(blocker.id)
+    
+    @staticmethod
+    def get_block_map(messages):
+        """
+        Load the receiver -> sender blocks of many messages from the block graph
+        
+        Args:
+            messages: Iterable of Message objects
+        
+        Returns:
+            dict mapping (blocker_id, blocked_id) to the block's is_spam flag
+        """
+        pairs = {(m.receiver_id, m.sender_id) for m in messages if m.receiver_id}
+        graphs = BlockGraph.get_many(blocker for blocker, _ in pairs)
+        return {
+            (blocker, blocked): graphs[blocker][blocked]
+            for blocker, blocked in pairs
+            if blocked in graphs[blocker]
+        }
+    
+    @staticmethod
+    def search_recipients(user, query, limit=10):
+        """
+        Autocomplete recipients by email, username or profile name prefix
+        
+        The user's contacts (most recent conversation first) are ranked
+        before everyone else; both lookups are prefix range scans over the
+        user search index.
+        
+        Args:
+            user: User object (excluded from the results)
+            query: Prefix typed by the user
+            limit: Maximum number of results
+        
+        Returns:
+            List of (User, is_contact) tuples
+        """
+        lookup = UserSearchIndex.prefix_filter(query, prefix='peer__search_terms__term')
+        if not lookup:
+            return []
+        
+        contact_ids = list(
+            Conversation.objects.filter(user=user, **lookup)
+            .exclude(peer=user)
+            .order_by('-last_message_at')
+            .values_list('peer_id', flat=True)
+            .distinct()[:limit]
+        )
+        other_ids = UserSearchIndex.search(query, limit - len(contact_ids), exclude_ids=contact_ids + [user.id])
+        
+        users = User.objects.select_related('profile').in_bulk(contact_ids + other_ids)
+        contacts = set(contact_ids)
+        return [
+            (users[user_id], user_id in contacts)
+            for user_id in contact_ids + other_ids
+            if user_id in users
+        ]
     
     @staticmethod
     def get_user_contacts(user):
-        """Get all contacts for a user (users who have sent or received messages)"""
-        sent_to = User.objects.filter(received_messages__sender=user).distinct()
-        received_from = User.objects.filter(sent_messages__receiver=user).distinct()
-        contacts = (sent_to | received_from).distinct().exclude(id=user.id)
-        return contacts
+        """
+        Get all contacts for a user (users who have sent or received messages)
+        
+        Returns:
+            QuerySet of Conversation objects, most recent first
+        """
+        return Conversation.objects.filter(user=user).select_related(
+            'peer',
+            'peer__profile'
+        ).order_by('-last_message_at')
     
     @staticmethod
     def toggle_star(message, user):
-        """Toggle star status of a message"""
-        if message.sender != user and message.receiver != user:
-            raise ValidationError('شما دسترسی به این پیام ندارید')
-        
-        message.is_starred = not message.is_starred
-        message.save()
+        """Toggle star status of a message in the user's mailbox"""
+        entry = MessageService.get_mailbox_entry(message, user)
+        MessageService.update_mailbox_entries(
+            MailboxEntry.objects.filter(id=entry.id),
+            is_starred=not entry.is_starred
+        )
         return message
     
     @staticmethod
@@ -235,6 +1001,8 @@ class MessageService:
             block.is_spam = is_spam
             block.save()
         
+        MessageService.bump_mailbox_versions([blocker.id])
+        transaction.on_commit(lambda: BlockGraph.invalidate(blocker.id))
         return block
     
     @staticmethod
@@ -250,6 +1018,9 @@ class MessageService:
             block.delete()
         except Block.DoesNotExist:
             raise ValidationError('این کاربر بلاک نشده است')
+        
+        MessageService.bump_mailbox_versions([blocker.id])
+        transaction.on_commit(lambda: BlockGraph.invalidate(blocker.id))
     
     @staticmethod
     def get_blocked_users(user):
@@ -279,11 +1050,14 @@ class MessageService:
             block.is_spam = True
             block.save()
         
-        # Mark all existing messages from sender to receiver as spam
-        Message.objects.filter(
-            sender=sender,
-            receiver=receiver
-        ).update(is_spam=True)
+        MessageService.bump_mailbox_versions([receiver.id])
+        transaction.on_commit(lambda: BlockGraph.invalidate(receiver.id))
+        
+        # Move all existing messages from sender to receiver's spam folder
+        MessageService.update_mailbox_entries(
+            MailboxEntry.objects.filter(user=receiver, role='receiver', message__sender=sender),
+            is_spam=True
+        )
         
         return block
     
@@ -305,48 +1079,116 @@ class MessageService:
             # in case user wants to block them later
             block.is_spam = False
             block.save()
+            MessageService.bump_mailbox_versions([receiver.id])
+            transaction.on_commit(lambda: BlockGraph.invalidate(receiver.id))
         except Block.DoesNotExist:
             # If no block exists, nothing to do
             pass
         
-        # Unmark all existing messages from sender to receiver as spam
-        Message.objects.filter(
-            sender=sender,
-            receiver=receiver
-        ).update(is_spam=False)
+        # Move all existing messages from sender back out of receiver's spam folder
+        MessageService.update_mailbox_entries(
+            MailboxEntry.objects.filter(user=receiver, role='receiver', message__sender=sender),
+            is_spam=False
+        )
         
         return True
     
     @staticmethod
     def is_spam_sender(blocker, blocked):
         """Check if a user is marked as spam by another user"""
-        try:
-            block = Block.objects.get(blocker=blocker, blocked=blocked)
-            return block.is_spam
-        except Block.DoesNotExist:
-            return False
+        return BlockGraph.get(blocker.id).get(blocked.id, False)
     
     @staticmethod
     def archive_message(message, user):
-        """Archive a message"""
-        if message.sender != user and message.receiver != user:
-            raise ValidationError('شما دسترسی به این پیام ندارید')
-        
-        message.status = 'archived'
-        message.save()
+        """Archive a message in the user's mailbox"""
+        entry = MessageService.get_mailbox_entry(message, user)
+        with transaction.atomic():
+            MessageService.update_mailbox_entries(
+                MailboxEntry.objects.filter(id=entry.id),
+                is_archived=True
+            )
+            if entry.role == 'receiver':
+                MessageService.refresh_conversation_unread(user, message.sender)
         return message
     
     @staticmethod
     def unarchive_message(message, user):
-        """Unarchive a message (restore to previous status)"""
-        if message.sender != user and message.receiver != user:
-            raise ValidationError('شما دسترسی به این پیام ندارید')
-        
-        # Restore to read if it was read, otherwise sent
-        if message.read_at:
-            message.status = 'read'
-        else:
-            message.status = 'sent'
-        message.save()
+        """Unarchive a message (restore to its inbox/sent folder)"""
+        entry = MessageService.get_mailbox_entry(message, user)
+        with transaction.atomic():
+            MessageService.update_mailbox_entries(
+                MailboxEntry.objects.filter(id=entry.id),
+                is_archived=False
+            )
+            if entry.role == 'receiver':
+                MessageService.refresh_conversation_unread(user, message.sender)
         return message
-
+    
+    @staticmethod
+    def bulk_update_messages(user, message_ids, action):
+        """
+        Apply one action to many messages of a user's mailbox
+        
+        Access is checked with one query over the user's mailbox entries and
+        the allowed entries are changed with a single update (or delete).
+        
+        Args:
+            user: User object
+            message_ids: List of message ids
+            action: One of BULK_ACTIONS
+        
+        Returns:
+            dict mapping message id to 'ok', 'not_found' or 'forbidden'
+        """
+        if action not in MessageService.BULK_ACTIONS:
+            raise ValidationError('عملیات نامعتبر است')
+        
+        results = {message_id: 'not_found' for message_id in message_ids}
+        allowed = []
+        peer_ids = set()
+        receipts = []
+        rows = MailboxEntry.objects.filter(
+            user=user,
+            message_id__in=results
+        ).exclude(message__status='deleted').values_list('message_id', 'role', 'is_read', 'message__sender_id')
+        for message_id, role, is_read, sender_id in rows:
+            if action in MessageService.RECEIVER_ONLY_ACTIONS and role != 'receiver':
+                results[message_id] = 'forbidden'
+                continue
+            results[message_id] = 'ok'
+            allowed.append(message_id)
+            if role == 'receiver' and sender_id != user.id:
+                peer_ids.add(sender_id)
+                # Senders of messages already read got their receipt the first time
+                if not is_read:
+                    receipts.append((sender_id, message_id))
+        
+        if not allowed:
+            return results
+        
+        entries = MailboxEntry.objects.filter(user=user, message_id__in=allowed)
+        with transaction.atomic():
+            if action == 'delete':
+                # Removes the messages from this user's mailbox only
+                before = MailboxCounter.count_entries(entries)
+                entries.delete()
+                MessageService.apply_counter_deltas(before, {})
+                MessageService.bump_mailbox_versions([user.id])
+                MessageEvents.message_removed(user.id, allowed)
+            else:
+                MessageService.update_mailbox_entries(entries, **MessageService.BULK_ACTIONS[action])
+            
+            if action == 'read' and receipts:
+                now = timezone.now()
+                Message.objects.filter(id__in=[message_id for _, message_id in receipts], read_at__isnull=True).update(
+                    read_at=now,
+                    status='read',
+                    updated_at=now
+                )
+                MessageService.bump_mailbox_versions(sender_id for sender_id, _ in receipts)
+                MessageEvents.message_updated(receipts, {'status': 'read'})
+            
+            if peer_ids and action not in ('star', 'unstar'):
+                MessageService.refresh_conversations_unread(user, peer_ids)
+        
+        return results
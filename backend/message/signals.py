@@ -0,0 +1,49 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Message
+from .search import MessageSearchIndex
+from .timeline import PublicTimeline
+from .attachments import AttachmentStore
+from .services import MessageService
+
+
+@receiver(post_save, sender=Message)
+def index_message(sender, instance, update_fields=None, **kwargs):
+    """Keep the search index in sync when a message is created or edited"""
+    if update_fields and not {'subject', 'body', 'receiver', 'is_private'} & set(update_fields):
+        return
+    MessageSearchIndex.index_message(instance)
+
+
+@receiver(post_delete, sender=Message)
+def unindex_message(sender, instance, **kwargs):
+    """Remove deleted messages from the search index"""
+    MessageSearchIndex.remove_message(instance.id)
+
+
+@receiver(post_save, sender=Message)
+def invalidate_public_timeline(sender, instance, update_fields=None, **kwargs):
+    """Drop the cached public timeline head when a public message changes"""
+    if not instance.is_private or (update_fields and 'is_private' in update_fields):
+        transaction.on_commit(PublicTimeline.invalidate)
+
+
+@receiver(post_delete, sender=Message)
+def invalidate_public_timeline_on_delete(sender, instance, **kwargs):
+    """Drop the cached public timeline head when a public message is deleted"""
+    if not instance.is_private:
+        transaction.on_commit(PublicTimeline.invalidate)
+
+
+@receiver(post_delete, sender=Message)
+def bump_mailbox_versions_on_delete(sender, instance, **kwargs):
+    """Move the participants' mailbox versions when a message is deleted"""
+    MessageService.bump_mailbox_versions([instance.sender_id, instance.receiver_id])
+
+
+@receiver(post_delete, sender=Message)
+def release_attachment_blob(sender, instance, **kwargs):
+    """Drop the deleted message's reference on its attachment blob"""
+    if instance.attachment_blob_id:
+        AttachmentStore.release(instance.attachment_blob_id)
@@ -1,3 +1,1138 @@
-from django.test import TestCase
+import base64
+import email
+import io
+import os
+import random
+import shutil
+import tempfile
+import zipfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from .blocks import BlockGraph
+from .fields import CompressedTextField
+from .models import AttachmentBlob, MailboxCounter, MailboxEntry, Message
+from .search import MessageSearchIndex
+from .services import MessageService
+from .views import MessageEventsView
 
-# Create your tests here.
+User = get_user_model()
+
+
+class MessageQueryBudgetTests(TestCase):
+    """Each message endpoint runs a fixed number of queries, whatever the page size"""
+
+    # Queries per request with a cold cache (block graph and timeline not cached)
+    LIST_QUERIES = {
+        # counter row, mailbox page, public timeline window
+        'inbox': 3,
+        'all': 3,
+        # counter row, mailbox page
+        'received': 2,
+    }
+    # message with sender/receiver/profiles, counter row, block graph, mailbox entry
+    DETAIL_QUERIES = 4
+    # counter row, contacts
+    CONTACTS_QUERIES = 2
+    # counter row
+    COUNTERS_QUERIES = 1
+
+    PAGE_SIZES = (2, 20)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'password')
+        cls.senders = [
+            User.objects.create_user(f'sender{i}', f'sender{i}@example.com', 'password')
+            for i in range(4)
+        ]
+        cls.message_ids = []
+        for i in range(max(cls.PAGE_SIZES) + 5):
+            response = cls.client_for(cls.senders[i % len(cls.senders)]).post('/api/message/send/', {
+                'subject': f'Message {i}',
+                'body': 'Hello',
+                'receiver_email': cls.bob.email,
+            }, format='json')
+            cls.message_ids.append(response.json()['data']['id'])
+        cls.client_for(cls.bob).post('/api/message/block/', {
+            'email': cls.senders[0].email,
+            'is_spam': True,
+        }, format='json')
+        # The counter row is created on first read, not part of a request's budget
+        MessageService.get_mailbox_counters(cls.bob)
+
+    @staticmethod
+    def client_for(user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def setUp(self):
+        self.client = self.client_for(self.bob)
+
+    def get(self, path, params=None, queries=None):
+        """GET path with a cold cache, asserting its number of queries"""
+        cache.clear()
+        with self.assertNumQueries(queries):
+            response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_list_query_count(self):
+        for message_type, queries in self.LIST_QUERIES.items():
+            for page_size in self.PAGE_SIZES:
+                with self.subTest(message_type=message_type, page_size=page_size):
+                    data = self.get('/api/message/list/', {'type': message_type, 'page_size': page_size}, queries)
+                    self.assertEqual(len(data['data']), page_size)
+
+    def test_detail_query_count(self):
+        # A message of a blocked (spam) sender costs the same as any other
+        data = self.get(f'/api/message/{self.message_ids[1]}/', queries=self.DETAIL_QUERIES)
+        self.assertFalse(data['data']['is_sender_blocked'])
+        data = self.get(f'/api/message/{self.message_ids[0]}/', queries=self.DETAIL_QUERIES)
+        self.assertTrue(data['data']['is_sender_blocked'])
+        self.assertTrue(data['data']['is_sender_spam'])
+
+    def test_contacts_query_count(self):
+        data = self.get('/api/message/contacts/', queries=self.CONTACTS_QUERIES)
+        self.assertEqual(data['count'], len(self.senders))
+
+        for i in range(3):
+            contact = User.objects.create_user(f'contact{i}', f'contact{i}@example.com', 'password')
+            self.client.post('/api/message/send/', {
+                'subject': 'Hi',
+                'body': 'Hello',
+                'receiver_email': contact.email,
+            }, format='json')
+        data = self.get('/api/message/contacts/', queries=self.CONTACTS_QUERIES)
+        self.assertEqual(data['count'], len(self.senders) + 3)
+
+    def test_counters_query_count(self):
+        data = self.get('/api/message/counters/', queries=self.COUNTERS_QUERIES)
+        self.assertEqual(data['data']['starred_count'], 0)
+
+        for message_id in self.message_ids[1:4]:
+            self.client.post(f'/api/message/{message_id}/toggle-star/')
+        data = self.get('/api/message/counters/', queries=self.COUNTERS_QUERIES)
+        self.assertEqual(data['data']['starred_count'], 3)
+
+
+class MailboxExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', 'alice@example.com', 'password')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'password')
+        client = APIClient()
+        client.force_authenticate(cls.alice)
+        response = client.post('/api/message/send/', {
+            'subject': 'line1\r\nBcc: evil@example.com\nX-Injected: yes',
+            'body': 'Hello',
+            'receiver_email': cls.bob.email,
+        }, format='json')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.bob)
+
+    def assertSafeMbox(self, content):
+        message = email.message_from_bytes(content.split(b'\n', 1)[1])
+        self.assertEqual(message['Subject'], 'line1 Bcc: evil@example.com X-Injected: yes')
+        self.assertIsNone(message['Bcc'])
+        self.assertIsNone(message['X-Injected'])
+
+    def test_mbox_folds_header_line_breaks(self):
+        response = self.client.get('/api/message/export/', {'export_format': 'mbox'})
+        self.assertEqual(response.status_code, 200)
+        self.assertSafeMbox(b''.join(response.streaming_content))
+
+    def test_zip_folds_header_line_breaks(self):
+        response = self.client.get('/api/message/export/', {'export_format': 'mbox', 'attachments': 'true'})
+        self.assertEqual(response.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as archive:
+            self.assertSafeMbox(archive.read('mailbox-bob.mbox'))
+
+
+class MessageSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', 'alice@example.com', 'password')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'password')
+        client = APIClient()
+        client.force_authenticate(cls.alice)
+        cls.message_ids = []
+        # Oldest first: the subject match is the oldest message but the best one
+        for subject, body in [('Kiwi harvest', 'Fruit'), ('Hello', 'Kiwi inside'), ('Hello', 'Nothing')]:
+            response = client.post('/api/message/send/', {
+                'subject': subject,
+                'body': body,
+                'receiver_email': cls.bob.email,
+            }, format='json')
+            cls.message_ids.append(response.json()['data']['id'])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.bob)
+
+    def search(self, params):
+        response = self.client.get('/api/message/list/', {'type': 'inbox', 'search': 'kiwi', **params})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_results_keep_rank_order_across_pages(self):
+        data = self.search({'page_size': 1})
+        self.assertEqual([m['id'] for m in data['data']], [self.message_ids[0]])
+        self.assertFalse(data['search_truncated'])
+
+        data = self.search({'page_size': 1, 'cursor': data['next']})
+        self.assertEqual([m['id'] for m in data['data']], [self.message_ids[1]])
+        self.assertIsNone(data['next'])
+
+    def test_results_past_limit_are_flagged(self):
+        with mock.patch.object(MessageSearchIndex, 'RESULT_LIMIT', 1):
+            data = self.search({})
+        self.assertEqual([m['id'] for m in data['data']], [self.message_ids[0]])
+        self.assertTrue(data['search_truncated'])
+
+    def test_unindexed_search_matches_compressed_snippets(self):
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        with self.settings(MESSAGE_BODY_COMPRESSION_THRESHOLD=1):
+            response = client.post('/api/message/send/', {
+                'subject': 'Hello',
+                'body': 'A pineapple ' + 'long body ' * 100,
+                'receiver_email': self.bob.email,
+            }, format='json')
+        message_id = response.json()['data']['id']
+
+        with mock.patch.object(MessageSearchIndex, 'is_supported', return_value=False):
+            data = self.client.get('/api/message/list/', {'type': 'inbox', 'search': 'pineapple'}).json()
+        self.assertEqual([m['id'] for m in data['data']], [message_id])
+        self.assertNotIn('search_truncated', data)
+
+    def test_date_cursor_is_rejected(self):
+        data = self.client.get('/api/message/list/', {'type': 'inbox', 'page_size': 1}).json()
+        response = self.client.get('/api/message/list/', {'type': 'inbox', 'search': 'kiwi', 'cursor': data['next']})
+        self.assertEqual(response.status_code, 400)
+
+
+class MessageEventsAuthenticationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', 'alice@example.com', 'password')
+        cls.token = str(AccessToken.for_user(cls.user))
+
+    def test_query_token(self):
+        request = RequestFactory().get('/api/message/events/', {'token': self.token})
+        self.assertEqual(MessageEventsView.authenticate(request), self.user)
+
+    def test_header_token(self):
+        request = RequestFactory().get('/api/message/events/', HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        self.assertEqual(MessageEventsView.authenticate(request), self.user)
+
+    def test_invalid_or_missing_token(self):
+        self.assertIsNone(MessageEventsView.authenticate(RequestFactory().get('/api/message/events/', {'token': 'x'})))
+        self.assertIsNone(MessageEventsView.authenticate(RequestFactory().get('/api/message/events/')))
+
+
+class MessageCursorTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', 'alice@example.com', 'password')
+        bob = User.objects.create_user('bob', 'bob@example.com', 'password')
+        carol = User.objects.create_user('carol', 'carol@example.com', 'password')
+        sends = (
+            [(bob, {'receiver_email': cls.user.email})] * 4 +
+            [(cls.user, {'receiver_email': bob.email})] * 3 +
+            [(carol, {'is_private': False})] * 4
+        )
+        cls.message_ids = []
+        for i, (sender, fields) in enumerate(sends):
+            client = APIClient()
+            client.force_authenticate(sender)
+            response = client.post('/api/message/send/', {
+                'subject': f'Message {i}',
+                'body': 'Hello',
+                **fields,
+            }, format='json')
+            cls.message_ids.append(response.json()['data']['id'])
+        # Inbox, sent and public messages share two created_at values, so pages split ties
+        for i, message_id in enumerate(cls.message_ids):
+            created_at = datetime(2026, 1, 1 + i % 2, tzinfo=dt_timezone.utc)
+            Message.objects.filter(id=message_id).update(created_at=created_at)
+            MailboxEntry.objects.filter(message_id=message_id).update(created_at=created_at)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        cache.clear()
+
+    def get_page(self, params):
+        response = self.client.get('/api/message/list/', {'type': 'all', 'page_size': 2, **params})
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()
+
+    def test_walk_next_and_previous(self):
+        first = self.get_page({})
+        self.assertIsNone(first['previous'])
+        pages = [first]
+        while pages[-1]['next']:
+            pages.append(self.get_page({'cursor': pages[-1]['next']}))
+        forward = [message['id'] for page in pages for message in page['data']]
+        self.assertEqual(sorted(forward), sorted(self.message_ids))
+        self.assertEqual(len(forward), len(set(forward)))
+
+        # Walking back from the last page gives the same pages
+        backward = [pages[-1]]
+        while backward[-1]['previous']:
+            backward.append(self.get_page({'cursor': backward[-1]['previous']}))
+        self.assertEqual(
+            [[message['id'] for message in page['data']] for page in reversed(backward)],
+            [[message['id'] for message in page['data']] for page in pages]
+        )
+
+    def test_naive_cursor_is_rejected(self):
+        cursor = base64.urlsafe_b64encode(b'n|2026-01-01T00:00:00|5').decode('ascii')
+        response = self.client.get('/api/message/list/', {'type': 'inbox', 'cursor': cursor})
+        self.assertEqual(response.status_code, 400)
+
+    def test_aware_cursor_is_accepted(self):
+        cursor = base64.urlsafe_b64encode(b'n|2026-01-01T00:00:00+00:00|5').decode('ascii')
+        response = self.client.get('/api/message/list/', {'type': 'inbox', 'cursor': cursor})
+        self.assertEqual(response.status_code, 200)
+
+
+class MediaRootMixin:
+    """Store the files of a test case in a temporary MEDIA_ROOT"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.media_settings.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+
+class MessageAttachmentTests(MediaRootMixin, TestCase):
+
+    CONTENT = b'0123456789' * 10
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', 'alice@example.com', 'password')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'password')
+        cls.carol = User.objects.create_user('carol', 'carol@example.com', 'password')
+        client = APIClient()
+        client.force_authenticate(cls.alice)
+        response = client.post('/api/message/send/', {
+            'subject': 'Report',
+            'body': 'See attached',
+            'receiver_email': cls.bob.email,
+            'is_private': 'true',
+            'attachment': SimpleUploadedFile('report.txt', cls.CONTENT, content_type='text/plain'),
+        }, format='multipart')
+        cls.url = f"/api/message/{response.json()['data']['id']}/attachment/"
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.bob)
+
+    def test_download(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT)
+        self.assertEqual(response['Content-Length'], str(len(self.CONTENT)))
+        self.assertIn('report.txt', response['Content-Disposition'])
+
+    def test_query_token(self):
+        # The inbox download link cannot send an Authorization header
+        response = APIClient().get(self.url, {'token': str(AccessToken.for_user(self.bob))})
+        self.assertEqual(response.status_code, 200)
+        response = APIClient().get(self.url)
+        self.assertEqual(response.status_code, 403)
+
+    def test_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT[10:20])
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.CONTENT)}')
+
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.CONTENT)}-')
+        self.assertEqual(response.status_code, 416)
+
+    def test_etag(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        # A stale If-Range gets the whole file
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_non_participant(self):
+        self.client.force_authenticate(self.carol)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 403)
+
+    def test_web_server_offload(self):
+        with self.settings(SENDFILE_BACKEND='nginx', SENDFILE_URL='/protected/'):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['X-Accel-Redirect'].startswith('/protected/'))
+        self.assertEqual(response.content, b'')
+
+        with self.settings(SENDFILE_BACKEND='apache'):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['X-Sendfile'].startswith(self.media_root))
+
+
+class AttachmentStoreTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', 'alice@example.com', 'password')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'password')
+
+    def setUp(self):
+        cache.clear()
+        # One MEDIA_ROOT per test, so each test sees only the files it stored
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        media_settings = self.settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def send(self, name, content):
+        response = self.client.post('/api/message/send/', {
+            'subject': 'Files',
+            'body': 'See attached',
+            'receiver_email': self.bob.email,
+            'is_private': 'true',
+            'attachment': SimpleUploadedFile(name, content, content_type='application/octet-stream'),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        return Message.objects.get(id=response.json()['data']['id'])
+
+    def stored_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.media_root)
+            for root, _, names in os.walk(self.media_root) for name in names
+        )
+
+    def test_identical_uploads_share_one_blob(self):
+        first = self.send('report.pdf', b'same bytes')
+        second = self.send('copy.txt', b'same bytes')
+        other = self.send('other.txt', b'other bytes')
+
+        self.assertEqual(first.attachment_blob_id, second.attachment_blob_id)
+        self.assertNotEqual(first.attachment_blob_id, other.attachment_blob_id)
+        self.assertEqual(AttachmentBlob.objects.get(id=first.attachment_blob_id).ref_count, 2)
+        self.assertEqual(len(self.stored_files()), 2)
+        # Name, size and type are kept per message at upload time
+        self.assertEqual(
+            (first.attachment_name, first.attachment_size, first.attachment_mime),
+            ('report.pdf', 10, 'application/pdf')
+        )
+        self.assertEqual((second.attachment_name, second.attachment_mime), ('copy.txt', 'text/plain'))
+
+    def test_ref_count_follows_deletes(self):
+        first = self.send('a.txt', b'shared')
+        second = self.send('b.txt', b'shared')
+        blob = first.attachment_blob
+
+        first.delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 1)
+        second.delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 0)
+
+    def test_collect_deletes_only_unreferenced_blobs(self):
+        kept = self.send('kept.txt', b'kept')
+        orphan = self.send('orphan.txt', b'orphan')
+        young = self.send('young.txt', b'young')
+        orphan_blob, young_blob = orphan.attachment_blob, young.attachment_blob
+        orphan.delete()
+        young.delete()
+        # Only blobs past the grace period are collected
+        AttachmentBlob.objects.exclude(id=young_blob.id).update(created_at=timezone.now() - timedelta(days=1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('collect_attachment_blobs', stdout=io.StringIO())
+
+        self.assertEqual(
+            set(AttachmentBlob.objects.values_list('id', flat=True)),
+            {kept.attachment_blob_id, young_blob.id}
+        )
+        self.assertEqual(self.stored_files(), sorted([kept.attachment_blob.file.name, young_blob.file.name]))
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, orphan_blob.file.name)))
+
+
+class SparseFieldsetTests(TestCase):
+    """?fields= renders exactly the requested fields"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', 'alice@example.com', 'password')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'password')
+        client = APIClient()
+        client.force_authenticate(cls.alice)
+        response = client.post('/api/message/send/', {
+            'subject': 'Hello',
+            'body': '  First line\n\n second   line ' + 'x' * 200,
+            'receiver_email': cls.bob.email,
+        }, format='json')
+        cls.message_id = response.json()['data']['id']
+        client.force_authenticate(cls.bob)
+        client.post(f'/api/message/{cls.message_id}/mark-sender-spam/')
+
+    def setUp(self):
+        # Block graph invalidation runs on commit, which setUpTestData never reaches
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.bob)
+
+    def get_data(self, path, params=None):
+        response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['data']
+
+    def test_list(self):
+        data = self.get_data('/api/message/list/', {'type': 'spam', 'fields': 'id,subject'})
+        self.assertEqual([set(item) for item in data], [{'id', 'subject'}])
+
+    def test_list_renders_snippet_not_body(self):
+        item = self.get_data('/api/message/list/', {'type': 'spam'})[0]
+        self.assertNotIn('body', item)
+        self.assertEqual(item['snippet'], ('First line second line ' + 'x' * 200)[:99] + '…')
+
+    def test_detail(self):
+        data = self.get_data(f'/api/message/{self.message_id}/', {'fields': 'body,is_sender_spam,unknown'})
+        self.assertEqual(set(data), {'body', 'is_sender_spam'})
+        self.assertTrue(data['is_sender_spam'])
+
+    def test_unknown_fields_render_everything(self):
+        data = self.get_data(f'/api/message/{self.message_id}/', {'fields': 'unknown'})
+        self.assertIn('body', data)
+
+    def test_contacts(self):
+        data = self.get_data('/api/message/contacts/', {'fields': 'email,unread_count'})
+        self.assertEqual(data, [{'email': self.alice.email, 'unread_count': 1}])
+
+    def test_counters(self):
+        data = self.get_data('/api/message/counters/', {'fields': 'spam_count'})
+        self.assertEqual(data, {'spam_count': 1})
+
+    def test_blocked_users(self):
+        data = self.get_data('/api/message/blocked/', {'fields': 'email'})
+        self.assertEqual(data, [{'email': self.alice.email}])
+
+        data = self.get_data('/api/message/blocked/', {'fields': 'email,is_spam'})
+        self.assertEqual(data, [{'email': self.alice.email, 'is_spam': True}])
+
+        data = self.get_data('/api/message/blocked/')
+        self.assertEqual(data[0]['id'], self.alice.id)
+        self.assertIsNotNone(data[0]['blocked_at'])
+
+
+class MailboxStateIsolationTests(TestCase):
+    """Star, archive and spam are per-user mailbox state, not columns of the shared message"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', 'alice@example.com', 'password')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'password')
+        cls.message_ids = []
+        for subject in ('Starred', 'Spam'):
+            response = cls.client_for(cls.alice).post('/api/message/send/', {
+                'subject': subject,
+                'body': 'Hello',
+                'receiver_email': cls.bob.email,
+            }, format='json')
+            cls.message_ids.append(response.json()['data']['id'])
+
+    @staticmethod
+    def client_for(user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def setUp(self):
+        cache.clear()
+
+    def get_detail(self, user, message_id):
+        response = self.client_for(user).get(f'/api/message/{message_id}/')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['data']
+
+    def test_receiver_state_does_not_change_sender_view(self):
+        starred_id, spam_id = self.message_ids
+        bob = self.client_for(self.bob)
+        bob.post(f'/api/message/{starred_id}/toggle-star/')
+        bob.post(f'/api/message/{starred_id}/archive/')
+        bob.post(f'/api/message/{spam_id}/mark-sender-spam/')
+
+        data = self.get_detail(self.bob, starred_id)
+        self.assertEqual((data['is_starred'], data['status']), (True, 'archived'))
+        self.assertTrue(self.get_detail(self.bob, spam_id)['is_spam'])
+
+        for message_id in self.message_ids:
+            data = self.get_detail(self.alice, message_id)
+            self.assertEqual((data['folder'], data['is_starred'], data['is_spam']), ('sent', False, False))
+
+        counters = self.client_for(self.alice).get('/api/message/counters/').json()['data']
+        self.assertEqual((counters['starred_count'], counters['spam_count'], counters['archived_count']), (0, 0, 0))
+
+    def test_sender_state_does_not_change_receiver_view(self):
+        starred_id = self.message_ids[0]
+        self.client_for(self.alice).post(f'/api/message/{starred_id}/toggle-star/')
+        self.client_for(self.alice).post(f'/api/message/{starred_id}/archive/')
+
+        self.assertTrue(self.get_detail(self.alice, starred_id)['is_starred'])
+        data = self.get_detail(self.bob, starred_id)
+        self.assertEqual((data['folder'], data['is_starred']), ('inbox', False))
+        ids = [item['id'] for item in self.client_for(self.bob).get('/api/message/list/', {'type': 'inbox'}).json()['data']]
+        self.assertIn(starred_id, ids)
+
+
+class MailboxCounterTests(TestCase):
+    """Incremental counters always match a fresh count of the mailbox entries"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', 'alice@example.com', 'password')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'password')
+        cls.carol = User.objects.create_user('carol', 'carol@example.com', 'password')
+        cls.message_ids = []
+        for sender in (cls.alice, cls.alice, cls.carol, cls.carol, cls.carol):
+            response = cls.client_for(sender).post('/api/message/send/', {
+                'subject': 'Hello',
+                'body': 'Hello',
+                'receiver_email': cls.bob.email,
+            }, format='json')
+            cls.message_ids.append(response.json()['data']['id'])
+
+    @staticmethod
+    def client_for(user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def setUp(self):
+        cache.clear()
+        self.client = self.client_for(self.bob)
+
+    def assertCountersMatch(self, user):
+        data = self.client_for(user).get('/api/message/counters/').json()['data']
+        for name, condition in MailboxCounter.COUNTER_FILTERS.items():
+            self.assertEqual(data[name], MailboxEntry.objects.filter(condition, user=user).count(), name)
+
+    def bulk(self, action, message_ids):
+        response = self.client.post('/api/message/bulk/', {'action': action, 'ids': message_ids}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+
+    def test_counters_and_version_follow_every_write(self):
+        first, second, third, fourth, fifth = self.message_ids
+        actions = [
+            lambda: self.client.post(f'/api/message/{first}/toggle-star/'),
+            lambda: self.client.post(f'/api/message/{second}/mark-read/'),
+            lambda: self.client.post(f'/api/message/{third}/archive/'),
+            lambda: self.client.post(f'/api/message/{fourth}/mark-sender-spam/'),
+            lambda: self.bulk('star', self.message_ids),
+            lambda: self.bulk('read', self.message_ids),
+            lambda: self.bulk('unread', [first, fifth]),
+            lambda: self.bulk('not_spam', [third, fourth]),
+            lambda: self.bulk('archive', [first, second]),
+            lambda: self.bulk('spam', [second, fifth]),
+            lambda: self.bulk('delete', [first, fifth]),
+        ]
+        version = MessageService.get_mailbox_counters(self.bob).version
+        etag = self.client.get('/api/message/list/', {'type': 'mailbox'})['ETag']
+        for i, action in enumerate(actions):
+            with self.subTest(step=i):
+                action()
+                self.assertCountersMatch(self.bob)
+                self.assertCountersMatch(self.alice)
+                self.assertCountersMatch(self.carol)
+
+                new_version = MessageService.get_mailbox_counters(self.bob).version
+                self.assertGreater(new_version, version)
+                version = new_version
+                new_etag = self.client.get('/api/message/list/', {'type': 'mailbox'})['ETag']
+                self.assertNotEqual(new_etag, etag)
+                etag = new_etag
+
+
+class BulkActionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', 'alice@example.com', 'password')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'password')
+        cls.carol = User.objects.create_user('carol', 'carol@example.com', 'password')
+        sends = [(cls.alice, cls.bob), (cls.alice, cls.bob), (cls.bob, cls.alice), (cls.carol, cls.alice)]
+        cls.received, cls.received_later, cls.sent, cls.other = [
+            cls.send(sender, receiver) for sender, receiver in sends
+        ]
+
+    @staticmethod
+    def client_for(user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    @classmethod
+    def send(cls, sender, receiver):
+        response = cls.client_for(sender).post('/api/message/send/', {
+            'subject': 'Hello',
+            'body': 'Hello',
+            'receiver_email': receiver.email,
+        }, format='json')
+        return response.json()['data']['id']
+
+    def setUp(self):
+        cache.clear()
+        self.client = self.client_for(self.bob)
+
+    def bulk(self, action, message_ids):
+        response = self.client.post('/api/message/bulk/', {'action': action, 'ids': message_ids}, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()['data']
+        return {item['id']: item['status'] for item in data['results']}
+
+    def folders(self, user):
+        return dict(MailboxEntry.objects.filter(user=user).values_list('message_id', 'folder'))
+
+    def test_results_per_id(self):
+        results = self.bulk('read', [self.received, self.sent, self.other, 999999])
+        self.assertEqual(results, {
+            self.received: 'ok',
+            # Only the receiver reads a message
+            self.sent: 'forbidden',
+            # Messages of other mailboxes are not revealed
+            self.other: 'not_found',
+            999999: 'not_found',
+        })
+        self.assertEqual(
+            list(MailboxEntry.objects.filter(user=self.bob, role='receiver', is_read=True).values_list('message_id', flat=True)),
+            [self.received]
+        )
+        self.assertFalse(MailboxEntry.objects.get(user=self.alice, message_id=self.other).is_read)
+
+    def test_spam(self):
+        results = self.bulk('spam', [self.received, self.sent, self.other])
+        self.assertEqual(results, {self.received: 'ok', self.sent: 'forbidden', self.other: 'not_found'})
+        self.assertEqual(self.folders(self.bob)[self.received], 'spam')
+        self.assertEqual(self.folders(self.bob)[self.sent], 'sent')
+        self.assertEqual(self.folders(self.alice)[self.received], 'sent')
+
+        self.assertEqual(self.bulk('not_spam', [self.received]), {self.received: 'ok'})
+        self.assertEqual(self.folders(self.bob)[self.received], 'inbox')
+
+    def test_delete(self):
+        results = self.bulk('delete', [self.received, self.sent, self.other])
+        self.assertEqual(results, {self.received: 'ok', self.sent: 'ok', self.other: 'not_found'})
+        self.assertEqual(set(self.folders(self.bob)), {self.received_later})
+        # Removed from this mailbox only
+        self.assertEqual(set(self.folders(self.alice)), {self.received, self.received_later, self.sent, self.other})
+        listed = [item['id'] for item in self.client.get('/api/message/list/', {'type': 'mailbox'}).json()['data']]
+        self.assertEqual(listed, [self.received_later])
+
+        # Deleted ids are not found afterwards
+        self.assertEqual(self.bulk('star', [self.received]), {self.received: 'not_found'})
+
+    def test_read_receipt_is_sent_once(self):
+        with mock.patch('message.services.MessageEvents.message_updated') as message_updated:
+            self.bulk('read', [self.received])
+            version = MessageService.get_mailbox_counters(self.alice).version
+
+            self.bulk('read', [self.received, self.received_later])
+            self.bulk('read', [self.received, self.received_later])
+
+        receipts = [call.args[0] for call in message_updated.call_args_list if call.args[1] == {'status': 'read'}]
+        self.assertEqual(receipts, [[(self.alice.id, self.received)], [(self.alice.id, self.received_later)]])
+        self.assertEqual(MessageService.get_mailbox_counters(self.alice).version, version + 1)
+
+    def test_mark_read_receipt_is_sent_once(self):
+        with mock.patch('message.services.MessageEvents.message_updated') as message_updated:
+            for i in range(2):
+                self.client.post(f'/api/message/{self.received}/mark-read/')
+        receipts = [call.args[0] for call in message_updated.call_args_list if call.args[1] == {'status': 'read'}]
+        self.assertEqual(receipts, [[(self.alice.id, self.received)]])
+
+
+class RecipientPrivacyTests(TestCase):
+    """Bcc addresses are only shown to the sender and to the bcc recipient themselves"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob, cls.carol, cls.dave, cls.erin = [
+            User.objects.create_user(name, f'{name}@example.com', 'password')
+            for name in ('alice', 'bob', 'carol', 'dave', 'erin')
+        ]
+        client = APIClient()
+        client.force_authenticate(cls.alice)
+        client.post('/api/message/send/', {
+            'subject': 'Hello',
+            'body': 'Hello',
+            'to': [cls.bob.email],
+            'cc': [cls.carol.email],
+            'bcc': [cls.dave.email, cls.erin.email],
+        }, format='json')
+        cls.copies = {message.receiver_id: message.id for message in Message.objects.filter(sender=cls.alice)}
+
+    def setUp(self):
+        cache.clear()
+
+    def get_recipients(self, user, message_id):
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get(f'/api/message/{message_id}/')
+        self.assertEqual(response.status_code, 200, response.content)
+        return response.json()['data']['recipients']
+
+    def test_to_and_cc_recipients_never_see_bcc(self):
+        for user in (self.bob, self.carol):
+            with self.subTest(user=user.username):
+                recipients = self.get_recipients(user, self.copies[user.id])
+                self.assertEqual(recipients, {'to': [self.bob.email], 'cc': [self.carol.email], 'bcc': []})
+
+    def test_sender_sees_every_address(self):
+        everyone = {'to': [self.bob.email], 'cc': [self.carol.email], 'bcc': [self.dave.email, self.erin.email]}
+        for message_id in self.copies.values():
+            self.assertEqual(self.get_recipients(self.alice, message_id), everyone)
+
+    def test_bcc_recipient_sees_only_their_own_address(self):
+        for user in (self.dave, self.erin):
+            with self.subTest(user=user.username):
+                recipients = self.get_recipients(user, self.copies[user.id])
+                self.assertEqual(recipients, {'to': [self.bob.email], 'cc': [self.carol.email], 'bcc': [user.email]})
+
+
+class ConditionalGetTests(TestCase):
+    """A 304 turns into a 200 as soon as the listed data changes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', 'alice@example.com', 'password')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'password')
+        cls.carol = User.objects.create_user('carol', 'carol@example.com', 'password')
+        cls.message_id = cls.send(cls.alice, {'receiver_email': cls.bob.email})
+
+    @staticmethod
+    def client_for(user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    @classmethod
+    def send(cls, sender, fields):
+        response = cls.client_for(sender).post('/api/message/send/', {
+            'subject': 'Hello',
+            'body': 'Hello',
+            **fields,
+        }, format='json')
+        return response.json()['data']['id']
+
+    def setUp(self):
+        cache.clear()
+        self.client = self.client_for(self.bob)
+
+    def assertRevalidates(self, path, params, change):
+        """A current ETag gets a 304 until change() runs, then a 200 with a new ETag"""
+        etag = self.client.get(path, params)['ETag']
+        response = self.client.get(path, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        response = self.client.get(path, params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_list_after_new_message(self):
+        self.assertRevalidates(
+            '/api/message/list/', {'type': 'received'},
+            lambda: self.send(self.alice, {'receiver_email': self.bob.email})
+        )
+
+    def test_list_after_star(self):
+        self.assertRevalidates(
+            '/api/message/list/', {'type': 'received'},
+            lambda: self.client.post(f'/api/message/{self.message_id}/toggle-star/')
+        )
+
+    def test_list_after_public_post(self):
+        self.assertRevalidates(
+            '/api/message/list/', {'type': 'inbox'},
+            lambda: self.send(self.carol, {'is_private': False})
+        )
+
+    def test_detail_after_star(self):
+        self.assertRevalidates(
+            f'/api/message/{self.message_id}/', None,
+            lambda: self.client.post(f'/api/message/{self.message_id}/toggle-star/')
+        )
+
+    def test_contacts_after_new_message(self):
+        self.assertRevalidates(
+            '/api/message/contacts/', None,
+            lambda: self.send(self.carol, {'receiver_email': self.bob.email})
+        )
+
+
+class BlockGraphInvalidationTests(TestCase):
+    """The cached block graph of a user is dropped once a block change commits"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', 'alice@example.com', 'password')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'password')
+        client = APIClient()
+        client.force_authenticate(cls.alice)
+        response = client.post('/api/message/send/', {
+            'subject': 'Hello',
+            'body': 'Hello',
+            'receiver_email': cls.bob.email,
+        }, format='json')
+        cls.message_id = response.json()['data']['id']
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.bob)
+
+    def test_block_and_unblock(self):
+        self.assertEqual(BlockGraph.get(self.bob.id), {})
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post('/api/message/block/', {'email': self.alice.email}, format='json')
+        # Still cached until the transaction commits
+        self.assertEqual(BlockGraph.get(self.bob.id), {})
+        for callback in callbacks:
+            callback()
+        self.assertEqual(BlockGraph.get(self.bob.id), {self.alice.id: False})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/message/unblock/', {'email': self.alice.email}, format='json')
+        self.assertEqual(BlockGraph.get(self.bob.id), {})
+
+    def test_action_responses_show_the_current_block(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f'/api/message/{self.message_id}/mark-sender-spam/')
+        data = self.client.post(f'/api/message/{self.message_id}/toggle-star/').json()['data']
+        self.assertEqual((data['is_sender_blocked'], data['is_sender_spam']), (True, True))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/message/unblock/', {'email': self.alice.email}, format='json')
+        data = self.client.post(f'/api/message/{self.message_id}/archive/').json()['data']
+        self.assertEqual((data['is_sender_blocked'], data['is_sender_spam']), (False, False))
+        data = self.client.post(f'/api/message/{self.message_id}/mark-read/').json()['data']
+        self.assertEqual((data['is_sender_blocked'], data['is_sender_spam']), (False, False))
+
+
+class ContactSummaryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', 'alice@example.com', 'password')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'password')
+        cls.carol = User.objects.create_user('carol', 'carol@example.com', 'password')
+
+    @staticmethod
+    def client_for(user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def setUp(self):
+        cache.clear()
+
+    def send(self, sender, receiver, subject):
+        response = self.client_for(sender).post('/api/message/send/', {
+            'subject': subject,
+            'body': f'{subject} body',
+            'receiver_email': receiver.email,
+        }, format='json')
+        return response.json()['data']['id']
+
+    def get_contacts(self):
+        response = self.client_for(self.bob).get('/api/message/contacts/')
+        return {contact['email']: contact for contact in response.json()['data']}
+
+    def test_unread_counts_and_last_message(self):
+        first = self.send(self.alice, self.bob, 'First')
+        second = self.send(self.alice, self.bob, 'Second')
+        self.send(self.carol, self.bob, 'Question')
+        answer = self.send(self.bob, self.carol, 'Answer')
+
+        response = self.client_for(self.bob).get('/api/message/contacts/')
+        self.assertEqual([contact['email'] for contact in response.json()['data']], [self.carol.email, self.alice.email])
+        contacts = self.get_contacts()
+        self.assertEqual(contacts[self.alice.email]['unread_count'], 2)
+        self.assertEqual(
+            {key: contacts[self.alice.email]['last_message'][key] for key in ('id', 'subject', 'body', 'is_sent_by_me')},
+            {'id': second, 'subject': 'Second', 'body': 'Second body', 'is_sent_by_me': False}
+        )
+        # The last message is bob's answer; carol's question is still unread
+        self.assertEqual(contacts[self.carol.email]['unread_count'], 1)
+        self.assertEqual(contacts[self.carol.email]['last_message']['id'], answer)
+        self.assertTrue(contacts[self.carol.email]['last_message']['is_sent_by_me'])
+
+        self.client_for(self.bob).post(f'/api/message/{first}/mark-read/')
+        self.assertEqual(self.get_contacts()[self.alice.email]['unread_count'], 1)
+        self.client_for(self.bob).post(f'/api/message/{second}/archive/')
+        self.assertEqual(self.get_contacts()[self.alice.email]['unread_count'], 0)
+
+
+class RecipientAutocompleteTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        # Block graphs cached by earlier test cases outlive their rolled back rows
+        cache.clear()
+        cls.alice = User.objects.create_user('alice', 'alice@example.com', 'password')
+        cls.sam = User.objects.create_user('sam', 'sam@example.com', 'password')
+        cls.samantha = User.objects.create_user('samantha', 'samantha@example.com', 'password')
+        cls.sammy = User.objects.create_user('sammy', 'sammy@example.com', 'password')
+        cls.osama = User.objects.create_user('osama', 'osama@example.com', 'password')
+        # Contacts, sammy the most recent one
+        for contact in (cls.samantha, cls.osama, cls.sammy):
+            client = APIClient()
+            client.force_authenticate(cls.alice)
+            client.post('/api/message/send/', {
+                'subject': 'Hello',
+                'body': 'Hello',
+                'receiver_email': contact.email,
+            }, format='json')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+
+    def search(self, query, **params):
+        response = self.client.get('/api/message/search-emails/', {'q': query, **params})
+        self.assertEqual(response.status_code, 200, response.content)
+        return [(item['username'], item['is_contact']) for item in response.json()['data']]
+
+    def test_contacts_first_most_recent_first(self):
+        self.assertEqual(self.search('SAM'), [('sammy', True), ('samantha', True), ('sam', False)])
+
+    def test_matches_prefixes_not_substrings(self):
+        # osama is a contact but only contains "sam"
+        self.assertNotIn('osama', [username for username, _ in self.search('sam')])
+        self.assertEqual(self.search('osa'), [('osama', True)])
+        self.assertEqual(self.search('samm'), [('sammy', True)])
+
+    def test_limit(self):
+        self.assertEqual(self.search('sam', limit=2), [('sammy', True), ('samantha', True)])
+        self.assertEqual(len(self.search('s', limit=1000)), 3)
+
+
+class ThreadListTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        # Block graphs cached by earlier test cases outlive their rolled back rows
+        cache.clear()
+        cls.alice = User.objects.create_user('alice', 'alice@example.com', 'password')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'password')
+        cls.first = cls.send(cls.alice, {'subject': 'Plans', 'body': 'Lunch?', 'receiver_email': cls.bob.email})
+        cls.other = cls.send(cls.alice, {'subject': 'Other', 'body': 'Hi', 'receiver_email': cls.bob.email})
+        cls.reply = cls.send(cls.bob, {'body': 'Sure'}, f'/api/message/{cls.first}/reply/')
+        cls.last = cls.send(cls.alice, {'body': 'Noon'}, f'/api/message/{cls.reply}/reply/')
+
+    @classmethod
+    def send(cls, sender, data, path='/api/message/send/'):
+        client = APIClient()
+        client.force_authenticate(sender)
+        return client.post(path, data, format='json').json()['data']['id']
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.bob)
+
+    def get_list(self, params):
+        response = self.client.get('/api/message/list/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [(item['id'], item['thread_count']) for item in response.json()['data']]
+
+    def test_one_head_per_thread(self):
+        self.assertEqual(
+            [message_id for message_id, _ in self.get_list({'type': 'mailbox'})],
+            [self.last, self.reply, self.other, self.first]
+        )
+        self.assertEqual(self.get_list({'type': 'mailbox', 'group': 'thread'}), [(self.last, 3), (self.other, 1)])
+        # Heads are the latest message of the thread within the folder
+        self.assertEqual(self.get_list({'type': 'sent', 'group': 'thread'}), [(self.reply, 3)])
+        self.assertEqual(self.get_list({'type': 'inbox', 'group': 'thread'}), [(self.last, 3), (self.other, 1)])
+
+    def test_thread_view(self):
+        thread_id = Message.objects.get(id=self.first).thread_id
+        response = self.client.get(f'/api/message/thread/{thread_id}/')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual([item['id'] for item in response.json()['data']], [self.first, self.reply, self.last])
+
+
+@override_settings(MESSAGE_BODY_COMPRESSION_THRESHOLD=4096)
+class CompressedTextFieldTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', 'alice@example.com', 'password')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'password')
+
+    def round_trip(self, body):
+        """Save a body and return its stored form, checking it reads back unchanged"""
+        message = Message.objects.create(sender=self.alice, receiver=self.bob, subject='Hi', body=body)
+        self.assertEqual(Message.objects.get(id=message.id).body, body)
+        return Message.objects.filter(id=message.id).values_list('body', flat=True).get()
+
+    def test_short_text_is_stored_as_is(self):
+        self.assertEqual(self.round_trip('Hello'), 'Hello')
+        self.assertEqual(self.round_trip('سلام ' * 100), 'سلام ' * 100)
+
+    def test_long_text_is_compressed(self):
+        stored = self.round_trip('Hello world. ' * 1000)
+        self.assertTrue(stored.startswith(CompressedTextField.PREFIX))
+
+    def test_sizes_are_utf8_bytes(self):
+        # 2500 characters but 5000 bytes: over the threshold
+        stored = self.round_trip('سلام دنیا ' * 250)
+        self.assertTrue(stored.startswith(CompressedTextField.PREFIX))
+
+        # Random letters shrink in bytes, though the encoding has more characters than the text
+        letters = [chr(code) for code in range(0x627, 0x64a)]
+        rng = random.Random(0)
+        body = ''.join(rng.choice(letters) for _ in range(5000))
+        stored = self.round_trip(body)
+        self.assertTrue(stored.startswith(CompressedTextField.PREFIX))
+        self.assertGreater(len(stored), len(body))
+        self.assertLess(len(stored), len(body.encode('utf-8')))
+
+    def test_leading_prefix_is_always_encoded(self):
+        for body in ('\x01', '\x011abc', '\x01' + 'x' * 5000):
+            with self.subTest(body=body[:5]):
+                stored = self.round_trip(body)
+                self.assertNotEqual(stored, body)
+                self.assertTrue(stored.startswith(CompressedTextField.PREFIX + CompressedTextField.ZLIB))
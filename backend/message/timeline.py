@@ -0,0 +1,96 @@
+import time
+from django.core.cache import cache
+from .models import Message
+from .pagination import QuerySetStream
+
+
+class PublicTimeline:
+    """
+    Cached head of the public message timeline
+
+    Public messages are shared by every inbox, so the newest HEAD_SIZE of
+    them are kept in the cache as (created_at, id) pairs and inboxes only
+    read the matching rows by primary key. The cache is dropped whenever a
+    public message is saved or deleted (see signals.py), which also moves
+    the timeline version used by conditional GETs.
+    """
+
+    CACHE_KEY = 'message:public_timeline:head'
+    VERSION_KEY = 'message:public_timeline:version'
+    CACHE_TIMEOUT = 300
+    HEAD_SIZE = 200
+
+    @staticmethod
+    def get_head():
+        """
+        Get the newest public messages
+
+        Returns:
+            List of (created_at, id) tuples, newest first
+        """
+        head = cache.get(PublicTimeline.CACHE_KEY)
+        if head is None:
+            head = list(
+                Message.objects.filter(is_private=False)
+                .exclude(status='deleted')
+                .order_by('-created_at', '-id')
+                .values_list('created_at', 'id')[:PublicTimeline.HEAD_SIZE]
+            )
+            cache.set(PublicTimeline.CACHE_KEY, head, PublicTimeline.CACHE_TIMEOUT)
+        return head
+
+    @staticmethod
+    def get_version():
+        """
+        Get the version of the public timeline
+
+        A lost version is replaced by the current time, so eviction can only
+        cause a full response, never a stale 304.
+
+        Returns:
+            Nanosecond timestamp of the last change
+        """
+        version = cache.get(PublicTimeline.VERSION_KEY)
+        if version is None:
+            cache.add(PublicTimeline.VERSION_KEY, time.time_ns(), None)
+            version = cache.get(PublicTimeline.VERSION_KEY, time.time_ns())
+        return version
+
+    @staticmethod
+    def invalidate():
+        """Drop the cached head and move the timeline version"""
+        cache.delete(PublicTimeline.CACHE_KEY)
+        cache.set(PublicTimeline.VERSION_KEY, time.time_ns(), None)
+
+
+class PublicTimelineStream(QuerySetStream):
+    """
+    Stream of public messages read through the cached timeline head
+
+    Pages of older messages that fall inside the head are loaded by id;
+    anything past the head, newer-page requests and searches read the
+    (is_private, -created_at) index directly.
+    """
+
+    def __init__(self, queryset, use_cache=True):
+        super().__init__(queryset)
+        self.use_cache = use_cache
+
+    def fetch(self, field, boundary, direction, limit):
+        """Fetch up to `limit` rows after boundary, from the cached head when possible"""
+        if not self.use_cache or direction != 'n':
+            return super().fetch(field, boundary, direction, limit)
+
+        head = PublicTimeline.get_head()
+        candidates = [pk for created_at, pk in head if not boundary or (created_at, pk) < boundary]
+        if not candidates:
+            if len(head) < PublicTimeline.HEAD_SIZE:
+                return []
+            return super().fetch(field, boundary, direction, limit)
+
+        rows = self.fetch_from(self.queryset.filter(id__in=candidates), field, None, direction, limit)
+        # The head is an exact prefix of the timeline: a full window, or a head
+        # holding the whole timeline, is the same as the indexed scan's answer
+        if len(rows) >= limit or len(head) < PublicTimeline.HEAD_SIZE:
+            return rows
+        return super().fetch(field, boundary, direction, limit)
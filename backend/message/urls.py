@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import SendMessageView, MessageListView, MessageDetailView, MessagePublicView, MarkAsReadView, ContactListView, ToggleStarView, BlockUserView, UnblockUserView, MarkSenderAsSpamView, ArchiveMessageView, BlockedUsersListView, SearchEmailsView
+from .views import SendMessageView, MessageListView, MessageDetailView, MessagePublicView, MarkAsReadView, ContactListView, ToggleStarView, BlockUserView, UnblockUserView, MarkSenderAsSpamView, ArchiveMessageView, BlockedUsersListView, SearchEmailsView, MailboxCountersView, BulkActionView, MessageExportView, MessageAttachmentView, MessageEventsView, MessageReplyView, MessageThreadView
 
 app_name = 'message'
 
@@ -7,11 +7,18 @@ urlpatterns = [
     path('send/', SendMessageView.as_view(), name='send'),
     path('list/', MessageListView.as_view(), name='list'),
     path('contacts/', ContactListView.as_view(), name='contacts'),
+    path('counters/', MailboxCountersView.as_view(), name='counters'),
+    path('bulk/', BulkActionView.as_view(), name='bulk'),
+    path('export/', MessageExportView.as_view(), name='export'),
+    path('events/', MessageEventsView.as_view(), name='events'),
     path('search-emails/', SearchEmailsView.as_view(), name='search-emails'),
     path('block/', BlockUserView.as_view(), name='block'),
     path('blocked/', BlockedUsersListView.as_view(), name='blocked-list'),
     path('unblock/', UnblockUserView.as_view(), name='unblock'),
     path('<int:message_id>/', MessageDetailView.as_view(), name='detail'),
+    path('<int:message_id>/reply/', MessageReplyView.as_view(), name='reply'),
+    path('thread/<uuid:thread_id>/', MessageThreadView.as_view(), name='thread'),
+    path('<int:message_id>/attachment/', MessageAttachmentView.as_view(), name='attachment'),
     path('<int:message_id>/mark-read/', MarkAsReadView.as_view(), name='mark-read'),
     path('<int:message_id>/toggle-star/', ToggleStarView.as_view(), name='toggle-star'),
     path('<int:message_id>/archive/', ArchiveMessageView.as_view(), name='archive'),
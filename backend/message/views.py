@@ -1,17 +1,75 @@
+import asyncio
+import hashlib
+import os
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from django.core.exceptions import ValidationError
+from django.http import StreamingHttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from django.views import View
+from asgiref.sync import sync_to_async
+from dmail.authentication import QueryTokenJWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, AuthenticationFailed
 from django.db import models
 from django.contrib.auth import get_user_model
-from .serializers import MessageCreateSerializer, MessageListSerializer, MessageDetailSerializer, ContactSerializer, BlockUserSerializer, BlockedUserSerializer
+from .serializers import MessageCreateSerializer, MessageListSerializer, MessageDetailSerializer, ContactSerializer, BlockUserSerializer, BlockedUserSerializer, MailboxCounterSerializer, BulkActionSerializer, MessageReplySerializer, MessageThreadSerializer
 from .services import MessageService
+from .pagination import MessageCursorPagination
+from .export import MailboxExporter
+from .events import MessageEvents
+from dmail.downloads import FileDownload
 
 User = get_user_model()
 
 
+class ConditionalGetMixin:
+    """
+    Answer conditional GETs with 304 before anything is serialized
+    
+    A view calls check_not_modified() with cheap validators of its payload
+    (mailbox version, message updated_at, ...); successful responses then
+    carry the matching ETag / Last-Modified headers.
+    """
+    
+    etag = None
+    last_modified = None
+    
+    def check_not_modified(self, request, validators, last_modified=None):
+        """
+        Args:
+            request: Request object
+            validators: Tuple of values that change whenever the payload does
+            last_modified: datetime of the last change (optional)
+        
+        Returns:
+            304 response if the client's copy is current, else None
+        """
+        key = repr((request.get_full_path(), request.user.id, validators))
+        self.etag = f'W/"{hashlib.sha1(key.encode()).hexdigest()}"'
+        self.last_modified = int(last_modified.timestamp()) if last_modified else None
+        response = get_conditional_response(request, etag=self.etag, last_modified=self.last_modified)
+        if response is not None:
+            return self.add_validators(response)
+        return None
+    
+    def add_validators(self, response):
+        response['ETag'] = self.etag
+        if self.last_modified:
+            response['Last-Modified'] = http_date(self.last_modified)
+        response['Cache-Control'] = 'private, no-cache'
+        patch_vary_headers(response, ('Authorization',))
+        return response
+    
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if self.etag and response.status_code == status.HTTP_200_OK:
+            self.add_validators(response)
+        return response
+
 class SendMessageView(APIView):
     """
     API View for sending a message
@@ -27,12 +85,18 @@ class SendMessageView(APIView):
             subject: string (required),
             body: string (required),
             is_private: boolean (default: true),
-            receiver_email: string (required if is_private=true),
+            receiver_email: string (required if is_private=true and no to/cc/bcc),
+            to, cc, bcc: lists of emails (optional, max 100 recipients in total),
             attachment: file (optional, max 10MB)
         }
+        With to/cc/bcc the response lists the outcome of every recipient
         """
         serializer = MessageCreateSerializer(data=request.data)
         if serializer.is_valid():
+            data = serializer.validated_data
+            if any(data.get(kind) for kind in ('to', 'cc', 'bcc')):
+                return self.send_to_recipients(request, data)
+            
             try:
                 message = MessageService.create_message(
                     sender=request.user,
@@ -57,9 +121,95 @@ class SendMessageView(APIView):
                 }, status=status.HTTP_400_BAD_REQUEST)
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    def send_to_recipients(self, request, data):
+        """Send one message to to/cc/bcc recipients and report per-recipient outcomes"""
+        try:
+            results = MessageService.create_messages(
+                sender=request.user,
+                subject=data['subject'],
+                body=data['body'],
+                recipients={
+                    'to': ([data['receiver_email']] if data.get('receiver_email') else []) + data.get('to', []),
+                    'cc': data.get('cc', []),
+                    'bcc': data.get('bcc', []),
+                },
+                attachment=data.get('attachment')
+            )
+        except ValidationError as e:
+            return Response({
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        sent = sum(1 for result in results if result['status'] == 'sent')
+        if not sent:
+            return Response({
+                'error': 'پیام برای هیچ‌یک از گیرندگان ارسال نشد',
+                'data': results
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            'message': f'پیام برای {sent} گیرنده ارسال شد',
+            'data': results
+        }, status=status.HTTP_201_CREATED)
 
 
-class MessageListView(APIView):
+class MessageEventsView(View):
+    """
+    Server-Sent Events stream of the user's mailbox events
+    GET /api/message/events/
+    
+    Async view: serve the project through ASGI (dmail.asgi:application),
+    under WSGI a worker would be held per open stream.
+    """
+    
+    # Seconds between keep-alive comments on an idle stream
+    HEARTBEAT_INTERVAL = 15
+    
+    # Streams are closed after this many seconds and the browser reconnects;
+    # Django 4.2 does not notice disconnected clients of a streaming response
+    MAX_STREAM_DURATION = 300
+    
+    async def get(self, request):
+        """
+        Stream compact events: message.new, message.updated, message.removed
+        Auth: Bearer token header, or ?token= (EventSource cannot set headers)
+        """
+        user = await sync_to_async(self.authenticate)(request)
+        if user is None:
+            return JsonResponse({
+                'error': 'احراز هویت نامعتبر است'
+            }, status=401)
+        
+        response = StreamingHttpResponse(self.stream(user.id), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+    
+    @staticmethod
+    def authenticate(request):
+        """Resolve the user of a JWT access token (header or ?token=)"""
+        try:
+            result = QueryTokenJWTAuthentication().authenticate(request)
+        except (InvalidToken, AuthenticationFailed):
+            return None
+        return result[0] if result else None
+    
+    async def stream(self, user_id):
+        yield 'retry: 5000\n\n'
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.MAX_STREAM_DURATION
+        events = MessageEvents.get_broker().subscribe(user_id, timeout=self.HEARTBEAT_INTERVAL)
+        try:
+            async for event in events:
+                yield MessageEvents.format_sse(event) if event else ': ping\n\n'
+                if loop.time() >= deadline:
+                    break
+        finally:
+            await events.aclose()
+
+
+class MessageListView(ConditionalGetMixin, APIView):
     """
     API View for listing user messages (inbox/home page)
     GET /api/message/list/
@@ -70,26 +220,64 @@ class MessageListView(APIView):
         """
         Get all messages for authenticated user
         Query params:
-            - type: 'all', 'sent', 'received', 'inbox' (default: 'inbox')
-            - search: Optional search query string
+            - type: 'all', 'mailbox', 'sent', 'received', 'inbox', 'starred', 'spam', 'archived' (default: 'inbox')
+            - search: Optional search query string (results ordered by relevance)
+            - cursor: Opaque cursor from a previous response's next/previous
+            - page_size: Messages per page (default: PAGE_SIZE, max: 100)
+            - with_count: 'true' to include a bounded count (default: false)
+            - group: 'thread' to list each thread once, by its latest message
+        Conditional: If-None-Match / If-Modified-Since answer 304
         """
         message_type = request.query_params.get('type', 'inbox')
         search_query = request.query_params.get('search', None)
         
         try:
-            messages = MessageService.get_user_messages(
+            not_modified = self.check_not_modified(
+                request,
+                *MessageService.get_mailbox_validators(request.user, message_type)
+            )
+            if not_modified is not None:
+                return not_modified
+            
+            search_ids, search_truncated = None, False
+            if search_query and search_query.strip():
+                search_ids, search_truncated = MessageService.search_message_ids(request.user, search_query)
+            
+            streams = MessageService.get_user_message_streams(
                 user=request.user,
                 message_type=message_type,
-                search_query=search_query
+                search_query=search_query,
+                group_by_thread=request.query_params.get('group') == 'thread',
+                search_ids=search_ids
             )
             
-            serializer = MessageListSerializer(messages, many=True, context={'request': request})
+            # Mailbox and public timeline streams are merged one page at a time;
+            # indexed search results keep their rank order
+            if search_ids is not None:
+                paginator = MessageCursorPagination(ordering_field='search_rank', ordering_type=int)
+            else:
+                paginator = MessageCursorPagination(ordering_field='mailbox_created_at')
+            page = paginator.paginate_streams(streams, request)
+            count, count_is_exact = paginator.get_count(streams, request)
+            
+            serializer = MessageListSerializer(page, many=True, context={'request': request})
             
-            return Response({
+            response_data = {
                 'message': 'لیست پیام‌ها با موفقیت دریافت شد',
-                'count': messages.count(),
+                'next': paginator.get_next_cursor(),
+                'previous': paginator.get_previous_cursor(),
                 'data': serializer.data
-            }, status=status.HTTP_200_OK)
+            }
+            
+            if search_ids is not None:
+                # Only the best RESULT_LIMIT matches are listed; the client should narrow the query
+                response_data['search_truncated'] = search_truncated
+            
+            if count is not None:
+                response_data['count'] = count
+                response_data['count_is_exact'] = count_is_exact
+            
+            return Response(response_data, status=status.HTTP_200_OK)
         
         except Exception as e:
             return Response({
@@ -97,7 +285,7 @@ class MessageListView(APIView):
             }, status=status.HTTP_400_BAD_REQUEST)
 
 
-class MessageDetailView(APIView):
+class MessageDetailView(ConditionalGetMixin, APIView):
     """
     API View for viewing a single message
     GET /api/message/<id>/
@@ -109,6 +297,7 @@ class MessageDetailView(APIView):
         Get message details by ID
         Requires: Bearer Token
         Checks: User must be sender or receiver if private
+        Conditional: If-None-Match / If-Modified-Since answer 304
         """
         try:
             message = MessageService.get_message_by_id(
@@ -116,7 +305,19 @@ class MessageDetailView(APIView):
                 user=request.user
             )
             
-            serializer = MessageDetailSerializer(message, context={'request': request})
+            validators, last_modified = MessageService.get_mailbox_validators(request.user)
+            not_modified = self.check_not_modified(
+                request,
+                validators + (message.updated_at,),
+                max(last_modified, message.updated_at)
+            )
+            if not_modified is not None:
+                return not_modified
+            
+            serializer = MessageDetailSerializer(message, context={
+                'request': request,
+                'blocks': MessageService.get_block_map([message]),
+            })
             
             return Response({
                 'message': 'پیام با موفقیت دریافت شد',
@@ -133,6 +334,154 @@ class MessageDetailView(APIView):
             }, status=status.HTTP_400_BAD_REQUEST)
 
 
+class MessageReplyView(APIView):
+    """
+    API View for replying to a message
+    POST /api/message/<id>/reply/
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = [MultiPartParser, FormParser, JSONParser]
+    
+    def post(self, request, message_id):
+        """
+        Reply to a message, in its thread
+        Body: {
+            body: string (required),
+            subject: string (optional, default: 'Re: ' + subject),
+            attachment: file (optional, max 10MB)
+        }
+        The reply is private and goes to the other participant of the message
+        """
+        serializer = MessageReplySerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            message = MessageService.get_message_by_id(
+                message_id=message_id,
+                user=request.user
+            )
+        except ValidationError as e:
+            return Response({
+                'error': str(e)
+            }, status=status.HTTP_403_FORBIDDEN)
+        
+        try:
+            reply = MessageService.reply_to_message(
+                sender=request.user,
+                message=message,
+                body=serializer.validated_data['body'],
+                subject=serializer.validated_data.get('subject'),
+                attachment=serializer.validated_data.get('attachment')
+            )
+        except ValidationError as e:
+            return Response({
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        response_serializer = MessageListSerializer(reply, context={'request': request})
+        
+        return Response({
+            'message': 'پاسخ با موفقیت ارسال شد',
+            'data': response_serializer.data
+        }, status=status.HTTP_201_CREATED)
+
+
+class MessageThreadView(APIView):
+    """
+    API View for a whole conversation thread
+    GET /api/message/thread/<thread_id>/
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request, thread_id):
+        """
+        Get the messages of a thread visible to the user, oldest first,
+        with the thread's participants
+        """
+        messages = MessageService.get_thread_messages(
+            user=request.user,
+            thread_id=thread_id
+        )
+        
+        if not messages:
+            return Response({
+                'error': 'گفتگو یافت نشد'
+            }, status=status.HTTP_404_NOT_FOUND)
+        
+        participants = {}
+        for message in messages:
+            for user in (message.sender, message.receiver):
+                if user is not None and user.id not in participants:
+                    participants[user.id] = {
+                        'email': user.email,
+                        'username': user.username,
+                        'name': user.profile.get_full_name() if hasattr(user, 'profile') else user.username,
+                    }
+        
+        serializer = MessageThreadSerializer(messages, many=True, context={'request': request})
+        
+        return Response({
+            'message': 'گفتگو با موفقیت دریافت شد',
+            'thread_id': thread_id,
+            'participants': list(participants.values()),
+            'count': len(messages),
+            'data': serializer.data
+        }, status=status.HTTP_200_OK)
+
+
+class MessageAttachmentView(APIView):
+    """
+    API View for downloading a message attachment
+    GET /api/message/<id>/attachment/
+    """
+    permission_classes = [AllowAny]
+    # A download link cannot send headers: the inbox passes ?token=
+    authentication_classes = [QueryTokenJWTAuthentication]
+    
+    def get(self, request, message_id):
+        """
+        Download the attachment of a message
+        No authentication required for public messages
+        Authentication required for private messages (must be sender or receiver)
+        Supports Range, If-None-Match / If-Modified-Since and If-Range
+        """
+        try:
+            user = request.user if request.user.is_authenticated else None
+            message = MessageService.get_message_by_id(
+                message_id=message_id,
+                user=user
+            )
+        except ValidationError as e:
+            return Response({
+                'error': str(e)
+            }, status=status.HTTP_403_FORBIDDEN)
+        
+        if not message.attachment:
+            return Response({
+                'error': 'این پیام فایل ضمیمه ندارد'
+            }, status=status.HTTP_404_NOT_FOUND)
+        
+        blob = message.attachment_blob
+        try:
+            size = message.attachment_size or message.attachment.size
+        except OSError:
+            return Response({
+                'error': 'فایل ضمیمه یافت نشد'
+            }, status=status.HTTP_404_NOT_FOUND)
+        
+        download = FileDownload(
+            file=message.attachment,
+            size=size,
+            # Blobs are content-addressed, their hash is a strong validator
+            etag=blob.sha256 if blob else f'{message.id}-{size}',
+            last_modified=blob.created_at if blob else message.created_at,
+            filename=message.attachment_name or os.path.basename(message.attachment.name),
+            content_type=message.attachment_mime or None
+        )
+        return download.response(request)
+
+
 class MessagePublicView(APIView):
     """
     API View for viewing a message via public link
@@ -153,7 +502,10 @@ class MessagePublicView(APIView):
                 user=user
             )
             
-            serializer = MessageDetailSerializer(message, context={'request': request})
+            serializer = MessageDetailSerializer(message, context={
+                'request': request,
+                'blocks': MessageService.get_block_map([message]),
+            })
             
             return Response({
                 'message': 'پیام با موفقیت دریافت شد',
@@ -191,7 +543,10 @@ class MarkAsReadView(APIView):
             
             MessageService.mark_as_read(message, request.user)
             
-            serializer = MessageDetailSerializer(message, context={'request': request})
+            serializer = MessageDetailSerializer(message, context={
+                'request': request,
+                'blocks': MessageService.get_block_map([message]),
+            })
             
             return Response({
                 'message': 'پیام به عنوان خوانده شده علامت زده شد',
@@ -208,7 +563,7 @@ class MarkAsReadView(APIView):
             }, status=status.HTTP_400_BAD_REQUEST)
 
 
-class ContactListView(APIView):
+class ContactListView(ConditionalGetMixin, APIView):
     """
     API View for listing user contacts
     GET /api/message/contacts/
@@ -219,15 +574,51 @@ class ContactListView(APIView):
         """
         Get all contacts for authenticated user
         Contacts are users who have sent or received messages from the user
+        Conditional: If-None-Match / If-Modified-Since answer 304
         """
         try:
+            not_modified = self.check_not_modified(
+                request,
+                *MessageService.get_mailbox_validators(request.user)
+            )
+            if not_modified is not None:
+                return not_modified
+            
             contacts = MessageService.get_user_contacts(user=request.user)
             
             serializer = ContactSerializer(contacts, many=True, context={'request': request, 'user': request.user})
             
             return Response({
                 'message': 'لیست کانتکت‌ها با موفقیت دریافت شد',
-                'count': contacts.count(),
+                'count': len(serializer.data),
+                'data': serializer.data
+            }, status=status.HTTP_200_OK)
+        
+        except Exception as e:
+            return Response({
+                'error': str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+
+class MailboxCountersView(APIView):
+    """
+    API View for mailbox folder counters (badges)
+    GET /api/message/counters/
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request):
+        """
+        Get unread, starred, spam and archived counts for authenticated user
+        Counters are maintained on every write, so this is a single row lookup
+        """
+        try:
+            counters = MessageService.get_mailbox_counters(user=request.user)
+            
+            serializer = MailboxCounterSerializer(counters, context={'request': request})
+            
+            return Response({
+                'message': 'شمارنده‌های صندوق با موفقیت دریافت شد',
                 'data': serializer.data
             }, status=status.HTTP_200_OK)
         
@@ -258,7 +649,10 @@ class ToggleStarView(APIView):
             
             MessageService.toggle_star(message, request.user)
             
-            serializer = MessageDetailSerializer(message, context={'request': request})
+            serializer = MessageDetailSerializer(message, context={
+                'request': request,
+                'blocks': MessageService.get_block_map([message]),
+            })
             
             return Response({
                 'message': 'وضعیت ستاره پیام تغییر کرد',
@@ -275,6 +669,91 @@ class ToggleStarView(APIView):
             }, status=status.HTTP_400_BAD_REQUEST)
 
 
+class BulkActionView(APIView):
+    """
+    API View for applying one action to many messages
+    POST /api/message/bulk/
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def post(self, request):
+        """
+        Apply an action to many messages of the user's mailbox
+        Body: {
+            ids: list of message ids (max 500),
+            action: 'read', 'unread', 'star', 'unstar', 'archive', 'unarchive',
+                    'spam', 'not_spam' or 'delete'
+        }
+        Returns per-id status: 'ok', 'not_found' or 'forbidden'
+        """
+        serializer = BulkActionSerializer(data=request.data)
+        
+        if serializer.is_valid():
+            try:
+                results = MessageService.bulk_update_messages(
+                    user=request.user,
+                    message_ids=serializer.validated_data['ids'],
+                    action=serializer.validated_data['action']
+                )
+                
+                return Response({
+                    'message': 'عملیات گروهی با موفقیت انجام شد',
+                    'data': {
+                        'action': serializer.validated_data['action'],
+                        'updated': sum(1 for result in results.values() if result == 'ok'),
+                        'results': [
+                            {'id': message_id, 'status': result}
+                            for message_id, result in results.items()
+                        ]
+                    }
+                }, status=status.HTTP_200_OK)
+            
+            except ValidationError as e:
+                return Response({
+                    'error': str(e)
+                }, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class MessageExportView(APIView):
+    """
+    API View for exporting the user's mailbox
+    GET /api/message/export/
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request):
+        """
+        Stream the user's messages as a file download
+        Query params:
+            - export_format: 'jsonl' or 'mbox' (default: 'jsonl')
+            - type: Folder to export (default: 'mailbox', every message of the user)
+            - attachments: 'true' to download a zip with the attachments
+        """
+        export_format = request.query_params.get('export_format', 'jsonl')
+        if export_format not in MailboxExporter.FORMATS:
+            return Response({
+                'error': 'فرمت خروجی نامعتبر است'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        exporter = MailboxExporter(
+            user=request.user,
+            export_format=export_format,
+            message_type=request.query_params.get('type', 'mailbox')
+        )
+        
+        if request.query_params.get('attachments', '').lower() in ('1', 'true'):
+            response = StreamingHttpResponse(exporter.stream_zip(), content_type='application/zip')
+            filename = f'{exporter.filename}.zip'
+        else:
+            response = StreamingHttpResponse(exporter.stream(), content_type=f'{exporter.content_type}; charset=utf-8')
+            filename = exporter.filename
+        
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
 class BlockUserView(APIView):
     """
     API View for blocking a user
@@ -361,18 +840,15 @@ class BlockedUsersListView(APIView):
             from .models import Block
             blocks = Block.objects.filter(blocker=request.user).select_related('blocked')
             
-            blocked_users = [block.blocked for block in blocks]
-            block_info = {block.blocked.id: {'is_spam': block.is_spam, 'created_at': block.created_at} for block in blocks}
+            # is_spam and blocked_at are rendered from the user objects, so ?fields= applies to them too
+            blocked_users = []
+            for block in blocks:
+                block.blocked.is_spam = block.is_spam
+                block.blocked.blocked_at = block.created_at
+                blocked_users.append(block.blocked)
             
             serializer = BlockedUserSerializer(blocked_users, many=True, context={'request': request})
             
-            # Add is_spam and blocked_at to each user
-            for item in serializer.data:
-                user_id = item['id']
-                if user_id in block_info:
-                    item['is_spam'] = block_info[user_id]['is_spam']
-                    item['blocked_at'] = block_info[user_id]['created_at']
-            
             return Response({
                 'message': 'لیست کاربران بلاک شده با موفقیت دریافت شد',
                 'count': len(serializer.data),
@@ -441,7 +917,10 @@ class MarkSenderAsSpamView(APIView):
                 user=request.user
             )
             
-            serializer = MessageDetailSerializer(message, context={'request': request})
+            serializer = MessageDetailSerializer(message, context={
+                'request': request,
+                'blocks': MessageService.get_block_map([message]),
+            })
             
             return Response({
                 'message': message_text,
@@ -478,14 +957,17 @@ class ArchiveMessageView(APIView):
                 user=request.user
             )
             
+            # Archive state is per user, read it from the user's mailbox entry
+            is_archived = MessageService.get_mailbox_entry(message, request.user).is_archived
+            
             # Get action from request body (optional)
             action = request.data.get('action', 'toggle')
             
-            if action == 'archive' or (action == 'toggle' and message.status != 'archived'):
+            if action == 'archive' or (action == 'toggle' and not is_archived):
                 # Archive message
                 MessageService.archive_message(message, request.user)
                 message_text = 'پیام به آرشیو منتقل شد'
-            elif action == 'unarchive' or (action == 'toggle' and message.status == 'archived'):
+            elif action == 'unarchive' or (action == 'toggle' and is_archived):
                 # Unarchive message
                 MessageService.unarchive_message(message, request.user)
                 message_text = 'پیام از آرشیو خارج شد'
@@ -498,7 +980,10 @@ class ArchiveMessageView(APIView):
                 user=request.user
             )
             
-            serializer = MessageDetailSerializer(message, context={'request': request})
+            serializer = MessageDetailSerializer(message, context={
+                'request': request,
+                'blocks': MessageService.get_block_map([message]),
+            })
             
             return Response({
                 'message': message_text,
@@ -522,15 +1007,22 @@ class SearchEmailsView(APIView):
     """
     permission_classes = [IsAuthenticated]
     
+    DEFAULT_LIMIT = 10
+    MAX_LIMIT = 20
+    
     def get(self, request):
         """
-        Search for emails by query string
+        Search for emails by email, username or name prefix, contacts first
         Query params:
             - q: search query (required)
-            - limit: max results (default: 10)
+            - limit: max results (default: 10, max: 20)
         """
         query = request.query_params.get('q', '').strip()
-        limit = int(request.query_params.get('limit', 10))
+        try:
+            limit = int(request.query_params.get('limit', self.DEFAULT_LIMIT))
+        except ValueError:
+            limit = self.DEFAULT_LIMIT
+        limit = max(1, min(limit, self.MAX_LIMIT))
         
         if not query:
             return Response({
@@ -539,19 +1031,21 @@ class SearchEmailsView(APIView):
             }, status=status.HTTP_200_OK)
         
         try:
-            # Search in all users (excluding current user)
-            from django.db.models import Q
-            users = User.objects.filter(
-                Q(email__icontains=query) | Q(username__icontains=query)
-            ).exclude(id=request.user.id).exclude(email__isnull=True).exclude(email='')[:limit]
+            matches = MessageService.search_recipients(
+                user=request.user,
+                query=query,
+                limit=limit
+            )
             
             # Serialize results
             results = []
-            for user in users:
+            for user, is_contact in matches:
+                profile = getattr(user, 'profile', None)
                 results.append({
                     'email': user.email,
                     'username': user.username,
-                    'name': getattr(user, 'name', None) or user.username
+                    'name': profile.get_full_name() if profile else user.username,
+                    'is_contact': is_contact
                 })
             
             return Response({
@@ -0,0 +1,241 @@
+import hashlib
+import os
+import shutil
+from datetime import timedelta
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
+from .models import Song, SongBlob, song_blob_path
+
+
+class HashingUploadMixin:
+    """Hash the chunks of an uploaded file as they arrive and expose the digest as file.sha256"""
+
+    def new_file(self, *args, **kwargs):
+        self.digest = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        data = super().receive_data_chunk(raw_data, start)
+        if data is None:
+            # This handler kept the chunk
+            self.digest.update(raw_data)
+        return data
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.digest.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadMixin, TemporaryFileUploadHandler):
+    pass
+
+
+class SongBlobStore:
+    """
+    Content-addressed, deduplicated song storage
+
+    Audio files are hashed (SHA-256) and stored once under
+    music/blobs/ab/cd/<sha256>.<ext>; every Song with the same bytes points
+    its file at that blob. Uploads are hashed while their chunks are
+    received (see upload_handlers), so a re-upload only costs the transfer.
+    SongBlob.ref_count tracks the referencing songs and unreferenced blobs
+    are removed by collect_garbage (see the collect_song_blobs command).
+    """
+
+    # Unreferenced blobs younger than this are kept, an upload may be about to reference them
+    GC_GRACE_PERIOD = timedelta(hours=1)
+
+    @staticmethod
+    def upload_handlers(request):
+        """Upload handlers to install on a request before its files are parsed"""
+        return [HashingMemoryFileUploadHandler(request), HashingTemporaryFileUploadHandler(request)]
+
+    @staticmethod
+    def hash_file(file):
+        """
+        Hash a file, reusing the digest computed during the upload if there is one
+
+        Returns:
+            (sha256 hex digest, size in bytes)
+        """
+        sha256 = getattr(file, 'sha256', None)
+        if sha256:
+            return sha256, file.size
+
+        digest = hashlib.sha256()
+        size = 0
+        if hasattr(file, 'seek'):
+            file.seek(0)
+        chunks = file.chunks() if hasattr(file, 'chunks') else iter(lambda: file.read(64 * 1024), b'')
+        for chunk in chunks:
+            digest.update(chunk)
+            size += len(chunk)
+        if hasattr(file, 'seek'):
+            file.seek(0)
+        return digest.hexdigest(), size
+
+    @staticmethod
+    def hash_path(path):
+        """Hash a file on disk (see hash_file)"""
+        with open(path, 'rb') as source:
+            return SongBlobStore.hash_file(source)
+
+    @staticmethod
+    def reference(sha256):
+        """Take a reference on an existing blob, or return None"""
+        if SongBlob.objects.filter(sha256=sha256).update(ref_count=models.F('ref_count') + 1):
+            return SongBlob.objects.get(sha256=sha256)
+        return None
+
+    @staticmethod
+    def create(sha256, name, size):
+        """Register a stored blob with one reference"""
+        try:
+            with transaction.atomic():
+                return SongBlob.objects.create(sha256=sha256, file=name, size=size, ref_count=1)
+        except IntegrityError:
+            # Stored concurrently by another upload
+            return SongBlobStore.reference(sha256)
+
+    @staticmethod
+    def store(file):
+        """
+        Store an uploaded file (or link an identical stored one) and take a reference on it
+
+        Must run in the transaction that creates the referencing song, so
+        the reference is rolled back with it.
+
+        Returns:
+            SongBlob object
+        """
+        sha256, size = SongBlobStore.hash_file(file)
+        blob = SongBlobStore.reference(sha256)
+        if blob is not None:
+            return blob
+
+        name = song_blob_path(sha256, os.path.splitext(file.name or '')[1].lower())
+        if not default_storage.exists(name):
+            name = default_storage.save(name, file)
+        return SongBlobStore.create(sha256, name, size)
+
+    @staticmethod
+    def store_path(path, sha256, size, link=False):
+        """
+        Store a file on disk whose hash is known (see store)
+
+        Args:
+            path: Source file path
+            sha256: Content hash of the file
+            size: File size in bytes
+            link: Hardlink the file into storage instead of copying it
+        """
+        blob = SongBlobStore.reference(sha256)
+        if blob is not None:
+            return blob
+
+        name = song_blob_path(sha256, os.path.splitext(path)[1].lower())
+        if not default_storage.exists(name):
+            SongBlobStore.place_file(path, name, link)
+        return SongBlobStore.create(sha256, name, size)
+
+    @staticmethod
+    def place_file(path, name, link=False):
+        """Put a file on disk into storage under name"""
+        try:
+            target = default_storage.path(name)
+        except NotImplementedError:
+            # Remote storage: upload through the storage API
+            with open(path, 'rb') as source:
+                default_storage.save(name, source)
+            return
+
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if link:
+            try:
+                os.link(path, target)
+                return
+            except OSError:
+                # Other filesystem: fall back to a copy
+                pass
+        shutil.copyfile(path, target)
+
+    @staticmethod
+    def release(blob_id):
+        """Drop one reference on a blob (the file is removed later by collect_garbage)"""
+        SongBlob.objects.filter(id=blob_id, ref_count__gt=0).update(ref_count=models.F('ref_count') - 1)
+
+    @staticmethod
+    def find_public_song(sha256, exclude_user=None):
+        """
+        Find a public song with the given content
+
+        Returns:
+            Song object or None
+        """
+        songs = Song.objects.filter(blob__sha256=sha256, is_public=True, status=Song.STATUS_READY)
+        if exclude_user is not None:
+            songs = songs.exclude(uploaded_by=exclude_user)
+        return songs.order_by('id').first()
+
+    @staticmethod
+    def adopt(song):
+        """
+        Move a legacy song file (stored per song) into the blob store
+
+        Returns:
+            True if the song now references a blob
+        """
+        if song.blob_id or not song.file:
+            return False
+
+        legacy_name = song.file.name
+        try:
+            source = song.file.open('rb')
+        except (OSError, ValueError):
+            return False
+
+        with source, transaction.atomic():
+            blob = SongBlobStore.store(source)
+            Song.objects.filter(id=song.id).update(file=blob.file.name, blob=blob, file_size=blob.size)
+            if legacy_name != blob.file.name:
+                transaction.on_commit(lambda: default_storage.delete(legacy_name))
+        return True
+
+    @staticmethod
+    def collect_garbage(dry_run=False):
+        """
+        Delete blobs no song references anymore
+
+        Returns:
+            (number of blobs, number of bytes) removed
+        """
+        referenced = Song.objects.filter(blob=models.OuterRef('pk'))
+        candidates = SongBlob.objects.filter(
+            ref_count=0,
+            created_at__lt=timezone.now() - SongBlobStore.GC_GRACE_PERIOD
+        ).exclude(models.Exists(referenced))
+
+        count = 0
+        size = 0
+        for blob_id in candidates.values_list('id', flat=True).iterator():
+            with transaction.atomic():
+                # Re-check under lock: an upload may have linked the blob meanwhile
+                blob = SongBlob.objects.select_for_update().filter(id=blob_id, ref_count=0).first()
+                if blob is None or Song.objects.filter(blob=blob).exists():
+                    continue
+                count += 1
+                size += blob.size
+                if dry_run:
+                    continue
+                name = blob.file.name
+                blob.delete()
+                transaction.on_commit(lambda name=name: default_storage.delete(name))
+        return count, size
@@ -0,0 +1,193 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+import django
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from .blobs import SongBlobStore
+from .models import Song, SongImportFile
+from .services import MusicService
+from .search import SongSearchIndex
+
+
+def read_file(path):
+    """
+    Hash and parse the tags of one audio file (runs in a worker process)
+
+    Returns:
+        (path, sha256, size in bytes, metadata dict, error message or None)
+    """
+    try:
+        sha256, size = SongBlobStore.hash_path(path)
+        return path, sha256, size, MusicService.extract_metadata(path), None
+    except Exception as e:
+        # One unreadable or malformed file must not abort the whole import
+        return path, None, None, None, str(e) or e.__class__.__name__
+
+
+class SongImporter:
+    """
+    Bulk import of a folder of audio files
+
+    Files are enumerated lazily and handled in batches: hashing and tag
+    parsing run in a process pool, new content is hardlinked (or copied)
+    into the song blob store and the Song rows of a batch are inserted
+    with one bulk_create. Files whose content the user already has are
+    skipped, so an interrupted import is resumed by starting it again.
+    Every handled file is recorded as a SongImportFile: on a rerun, files
+    with the same path, size and mtime are skipped before being hashed.
+    """
+
+    DEFAULT_BATCH_SIZE = 200
+
+    def __init__(self, user, folder_path, is_public=False, workers=None, batch_size=None, link=False):
+        """
+        Args:
+            user: User object (uploader)
+            folder_path: Folder to import recursively
+            is_public: Boolean - are songs public
+            workers: Hashing and tag parsing processes (default: CPU count)
+            batch_size: Files per bulk_create
+            link: Hardlink files into storage instead of copying (same filesystem only)
+        """
+        self.user = user
+        self.folder_path = os.path.abspath(folder_path)
+        self.is_public = is_public
+        self.workers = workers
+        self.batch_size = batch_size or self.DEFAULT_BATCH_SIZE
+        self.link = link
+        self.skipped = 0
+
+    def iter_files(self, path=None):
+        """Yield the audio files under the folder, without listing it all first"""
+        with os.scandir(path or self.folder_path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from self.iter_files(entry.path)
+                elif os.path.splitext(entry.name)[1].lower() in MusicService.AUDIO_EXTENSIONS:
+                    yield entry.path
+
+    def filter_imported(self, paths, errors):
+        """
+        Drop the files a previous run already imported and that did not change since
+
+        Returns:
+            dict mapping the remaining paths to their (size, mtime_ns)
+        """
+        stats = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError as e:
+                errors.append(f'{os.path.basename(path)}: {str(e)}')
+                continue
+            stats[path] = (stat.st_size, stat.st_mtime_ns)
+
+        # Only records whose content the user still has: deleted songs are imported again
+        owned = Song.objects.filter(uploaded_by=self.user, blob__sha256=models.OuterRef('sha256'))
+        imported = SongImportFile.objects.filter(
+            models.Exists(owned),
+            user=self.user,
+            path__in=list(stats)
+        ).values_list('path', 'size', 'mtime_ns')
+        for path, size, mtime_ns in imported:
+            if stats.get(path) == (size, mtime_ns):
+                del stats[path]
+                self.skipped += 1
+        return stats
+
+    def record_imported(self, stats, hashes):
+        """Record handled files so the next run skips them before hashing"""
+        max_length = SongImportFile._meta.get_field('path').max_length
+        SongImportFile.objects.bulk_create(
+            [
+                SongImportFile(user=self.user, path=path, size=stats[path][0], mtime_ns=stats[path][1], sha256=sha256)
+                for path, sha256 in hashes.items()
+                if len(path) <= max_length
+            ],
+            update_conflicts=True,
+            unique_fields=['user', 'path'],
+            update_fields=['size', 'mtime_ns', 'sha256', 'imported_at']
+        )
+
+    def import_batch(self, executor, paths, errors):
+        """Hash, parse, store and insert one batch of files"""
+        stats = self.filter_imported(paths, errors)
+        results = []
+        for path, sha256, size, metadata, error in executor.map(read_file, list(stats), chunksize=8):
+            if error:
+                errors.append(f'{os.path.basename(path)}: {error}')
+            else:
+                results.append((path, sha256, size, metadata))
+
+        existing = set(
+            Song.objects.filter(
+                uploaded_by=self.user,
+                blob__sha256__in=[sha256 for path, sha256, size, metadata in results]
+            ).values_list('blob__sha256', flat=True)
+        )
+
+        songs = []
+        handled = {}
+        with transaction.atomic():
+            for path, sha256, size, metadata in results:
+                if sha256 in existing:
+                    self.skipped += 1
+                    handled[path] = sha256
+                    continue
+                # Duplicates inside the folder are imported once
+                existing.add(sha256)
+                try:
+                    blob = SongBlobStore.store_path(path, sha256, size, link=self.link)
+                except OSError as e:
+                    errors.append(f'{os.path.basename(path)}: {str(e)}')
+                    continue
+                handled[path] = sha256
+                title = metadata.get('title') or os.path.splitext(os.path.basename(path))[0]
+                songs.append(Song(
+                    uploaded_by=self.user,
+                    is_public=self.is_public,
+                    file=blob.file.name,
+                    blob=blob,
+                    title=title[:255],
+                    artist=(metadata.get('artist') or '')[:255] or None,
+                    album=(metadata.get('album') or '')[:255] or None,
+                    duration=metadata.get('duration'),
+                    file_size=size,
+                    status=Song.STATUS_READY
+                ))
+            created = Song.objects.bulk_create(songs)
+            # bulk_create sends no post_save, index the batch here
+            SongSearchIndex.index_songs(created)
+            self.record_imported(stats, handled)
+            return created
+
+    def run(self, progress=None):
+        """
+        Import the folder
+
+        Args:
+            progress: Optional callable(done, imported, skipped, errors) called after each batch
+
+        Returns:
+            Number of imported songs, List of errors
+        """
+        if not os.path.isdir(self.folder_path):
+            raise ValidationError('مسیر پوشه معتبر نیست')
+
+        imported = 0
+        errors = []
+        done = 0
+        files = self.iter_files()
+        # Workers may be spawned rather than forked: they set Django up before parsing
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=django.setup) as executor:
+            while True:
+                paths = list(itertools.islice(files, self.batch_size))
+                if not paths:
+                    break
+                # Songs of a batch are indexed by import_batch and not kept: memory stays flat
+                imported += len(self.import_batch(executor, paths, errors))
+                done += len(paths)
+                if progress:
+                    progress(done, imported, self.skipped, len(errors))
+        return imported, errors
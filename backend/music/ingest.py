@@ -0,0 +1,112 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from .models import Song
+from .services import MusicService
+from .search import SongSearchIndex
+
+logger = logging.getLogger(__name__)
+
+
+class SongIngest:
+    """
+    Background metadata extraction of uploaded songs
+
+    Uploads are saved with status 'processing' and returned right away;
+    the file is then parsed by a local thread pool and the extracted
+    title/artist/album/duration are written back with a single UPDATE
+    that also moves the song to 'ready' (or 'failed'). The pool lives in
+    the web process, so songs left 'processing' by a restart are picked
+    up again by the `ingest_pending_songs` command.
+
+    settings.MUSIC_INGEST_WORKERS sets the pool size; 0 runs the
+    extraction inline (management commands, debugging).
+    """
+
+    DEFAULT_WORKERS = 2
+
+    # Fields the uploader may set explicitly, kept over file metadata
+    OVERRIDE_FIELDS = ('title', 'artist', 'album')
+
+    _executor = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get_workers():
+        return getattr(settings, 'MUSIC_INGEST_WORKERS', SongIngest.DEFAULT_WORKERS)
+
+    @staticmethod
+    def get_executor():
+        with SongIngest._lock:
+            if SongIngest._executor is None:
+                SongIngest._executor = ThreadPoolExecutor(
+                    max_workers=SongIngest.get_workers(),
+                    thread_name_prefix='song-ingest'
+                )
+            return SongIngest._executor
+
+    @staticmethod
+    def submit(song_id, overrides=None):
+        """
+        Queue a 'processing' song for metadata extraction
+
+        Args:
+            song_id: Song ID
+            overrides: dict of uploader-provided title/artist/album
+        """
+        if SongIngest.get_workers() == 0:
+            transaction.on_commit(lambda: SongIngest.process(song_id, overrides))
+            return
+        # The worker must see the committed row
+        transaction.on_commit(lambda: SongIngest.get_executor().submit(SongIngest.run, song_id, overrides))
+
+    @staticmethod
+    def run(song_id, overrides=None):
+        """Worker entry point: process with a fresh database connection"""
+        close_old_connections()
+        try:
+            SongIngest.process(song_id, overrides)
+        except Exception:
+            logger.exception('Song ingest failed for song %s', song_id)
+        finally:
+            close_old_connections()
+
+    @staticmethod
+    def process(song_id, overrides=None):
+        """
+        Extract the metadata of a 'processing' song and store it
+
+        Returns:
+            True if the song was updated, False if it was not 'processing'
+        """
+        song = Song.objects.filter(id=song_id, status=Song.STATUS_PROCESSING).only('id', 'file').first()
+        if song is None:
+            return False
+
+        overrides = overrides or {}
+        try:
+            metadata = MusicService.extract_metadata(song.file.path)
+            fields = {
+                'status': Song.STATUS_READY,
+                'processing_error': '',
+                'duration': metadata.get('duration'),
+            }
+            for name in SongIngest.OVERRIDE_FIELDS:
+                value = overrides.get(name) or metadata.get(name)
+                if value:
+                    fields[name] = value[:Song._meta.get_field(name).max_length]
+        except Exception as e:
+            fields = {
+                'status': Song.STATUS_FAILED,
+                'processing_error': str(e)[:Song._meta.get_field('processing_error').max_length],
+            }
+
+        fields['updated_at'] = timezone.now()
+        if not Song.objects.filter(id=song_id, status=Song.STATUS_PROCESSING).update(**fields):
+            return False
+        # update() sends no post_save, index the extracted title/artist/album here
+        SongSearchIndex.index_songs(Song.objects.filter(id=song_id))
+        return True
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from music.blobs import SongBlobStore
+
+
+class Command(BaseCommand):
+    """Delete song blobs that no song references anymore"""
+    help = 'حذف فایل‌های آهنگ بدون ارجاع'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be deleted')
+    
+    def handle(self, *args, **options):
+        count, size = SongBlobStore.collect_garbage(dry_run=options['dry_run'])
+        
+        action = 'would be deleted' if options['dry_run'] else 'deleted'
+        self.stdout.write(self.style.SUCCESS(f'{count} blobs ({size} bytes) {action}'))
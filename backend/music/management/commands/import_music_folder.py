@@ -0,0 +1,48 @@
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from music.importer import SongImporter
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    """Import a music library folder for a user with parallel tag parsing"""
+    help = 'وارد کردن پوشه موزیک یک کاربر به صورت موازی'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('folder', help='Folder to import recursively')
+        parser.add_argument('--email', required=True, help='Email of the user the songs belong to')
+        parser.add_argument('--public', action='store_true', help='Make the imported songs public')
+        parser.add_argument('--workers', type=int, default=None, help='Hashing and tag parsing processes (default: CPU count)')
+        parser.add_argument('--batch-size', type=int, default=SongImporter.DEFAULT_BATCH_SIZE, help='Files per bulk insert')
+        parser.add_argument('--link', action='store_true', help='Hardlink files into storage instead of copying them')
+    
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(email=options['email'])
+        except User.DoesNotExist:
+            raise CommandError('کاربر با این ایمیل یافت نشد')
+        
+        importer = SongImporter(
+            user,
+            options['folder'],
+            is_public=options['public'],
+            workers=options['workers'],
+            batch_size=options['batch_size'],
+            link=options['link']
+        )
+        
+        def progress(done, imported, skipped, errors):
+            self.stdout.write(f'{done} files: {imported} imported, {skipped} already imported, {errors} errors')
+        
+        try:
+            imported, errors = importer.run(progress=progress)
+        except ValidationError as e:
+            raise CommandError(e.messages[0])
+        
+        for error in errors:
+            self.stderr.write(error)
+        self.stdout.write(self.style.SUCCESS(
+            f'{imported} songs imported, {importer.skipped} already imported, {len(errors)} errors'
+        ))
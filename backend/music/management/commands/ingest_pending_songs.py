@@ -0,0 +1,38 @@
+import os
+from django.core.management.base import BaseCommand
+from music.ingest import SongIngest
+from music.models import Song
+
+
+class Command(BaseCommand):
+    """Extract the metadata of songs left 'processing' (e.g. by a restart of the web process)"""
+    help = 'پردازش آهنگ‌هایی که پردازش آن‌ها ناتمام مانده است'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--retry-failed', action='store_true', help='Also retry songs whose processing failed')
+    
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            Song.objects.filter(status=Song.STATUS_FAILED).update(status=Song.STATUS_PROCESSING, processing_error='')
+        
+        songs = Song.objects.filter(status=Song.STATUS_PROCESSING).only('id', 'file', 'title', 'artist', 'album')
+        
+        ready = 0
+        failed = 0
+        for song in songs.order_by('id').iterator():
+            # Values set at upload are the uploader's, except the file name placeholder title
+            # (storage may have added a `_<random>` suffix to the stored name)
+            stored_name = os.path.splitext(os.path.basename(song.file.name))[0]
+            is_placeholder = stored_name == song.title or stored_name.startswith(song.title + '_')
+            overrides = {
+                'title': None if is_placeholder else song.title,
+                'artist': song.artist,
+                'album': song.album,
+            }
+            if SongIngest.process(song.id, overrides):
+                if Song.objects.filter(id=song.id, status=Song.STATUS_READY).exists():
+                    ready += 1
+                else:
+                    failed += 1
+        
+        self.stdout.write(self.style.SUCCESS(f'{ready} songs processed, {failed} failed'))
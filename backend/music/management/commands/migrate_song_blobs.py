@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from music.blobs import SongBlobStore
+from music.models import Song
+
+
+class Command(BaseCommand):
+    """Move song files stored per song into the content-addressed blob store"""
+    help = 'انتقال فایل‌های آهنگ قدیمی به مخزن فایل‌های یکتا'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Songs loaded per database round trip')
+    
+    def handle(self, *args, **options):
+        # Only songs not yet moved are read, so an interrupted run can be resumed
+        songs = Song.objects.filter(blob__isnull=True).exclude(file='').exclude(file__isnull=True)
+        
+        count = 0
+        for song in songs.order_by('id').iterator(chunk_size=options['batch_size']):
+            if SongBlobStore.adopt(song):
+                count += 1
+        
+        self.stdout.write(self.style.SUCCESS(f'{count} songs moved to the blob store'))
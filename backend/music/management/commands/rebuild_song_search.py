@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from music.search import SongSearchIndex
+
+
+class Command(BaseCommand):
+    """Rebuild the song full-text search index from scratch"""
+    help = 'بازسازی ایندکس جستجوی آهنگ‌ها'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Songs loaded per database round trip')
+    
+    def handle(self, *args, **options):
+        if not SongSearchIndex.is_supported():
+            self.stdout.write(self.style.WARNING('Search index is not supported on this database backend'))
+            return
+        
+        with transaction.atomic():
+            count = SongSearchIndex.rebuild(batch_size=options['batch_size'])
+        
+        self.stdout.write(self.style.SUCCESS(f'{count} songs indexed'))
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.7 on 2026-10-17 18:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0002_userplaybackstate_favoritesong'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='song',
+            name='processing_error',
+            field=models.CharField(blank=True, default='', max_length=255, verbose_name='خطای پردازش'),
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='status',
+            field=models.CharField(choices=[('processing', 'در حال پردازش'), ('ready', 'آماده'), ('failed', 'ناموفق')], default='ready', max_length=20, verbose_name='وضعیت پردازش'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.7 on 2026-10-17 18:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+import music.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0003_song_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SongBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True, verbose_name='هش SHA-256')),
+                ('file', models.FileField(max_length=255, upload_to=music.models.song_blob_upload_path, verbose_name='فایل')),
+                ('size', models.BigIntegerField(verbose_name='حجم (بایت)')),
+                ('ref_count', models.PositiveIntegerField(default=0, verbose_name='تعداد ارجاع')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='زمان ایجاد')),
+            ],
+            options={
+                'verbose_name': 'فایل آهنگ',
+                'verbose_name_plural': 'فایل\u200cهای آهنگ',
+                'indexes': [models.Index(fields=['ref_count'], name='music_songb_ref_cou_acef5c_idx')],
+            },
+        ),
+        migrations.AddField(
+            model_name='song',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='songs', to='music.songblob', verbose_name='فایل یکتا'),
+        ),
+    ]
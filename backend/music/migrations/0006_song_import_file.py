@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-17 18:33
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('music', '0005_song_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SongImportFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=1024, verbose_name='مسیر فایل')),
+                ('size', models.BigIntegerField(verbose_name='حجم (بایت)')),
+                ('mtime_ns', models.BigIntegerField(verbose_name='زمان تغییر فایل (نانوثانیه)')),
+                ('sha256', models.CharField(max_length=64, verbose_name='هش SHA-256')),
+                ('imported_at', models.DateTimeField(auto_now=True, verbose_name='زمان وارد کردن')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='song_import_files', to=settings.AUTH_USER_MODEL, verbose_name='کاربر')),
+            ],
+            options={
+                'verbose_name': 'فایل وارد شده',
+                'verbose_name_plural': 'فایل\u200cهای وارد شده',
+                'unique_together': {('user', 'path')},
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated manually
+
+from django.db import migrations
+
+
+def fill_search_index(apps, schema_editor):
+    """Index the songs that existed before the search table"""
+    from music.search import SongSearchIndex
+    SongSearchIndex.rebuild(model=apps.get_model('music', 'Song'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('music', '0006_song_import_file'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_search_index, migrations.RunPython.noop),
+    ]
@@ -11,9 +11,49 @@ def song_file_upload_path(instance, filename):
     return f'music/songs/{instance.id}/{filename}'
 
 
+def song_blob_path(sha256, extension=''):
+    """Sharded storage path of a song blob: music/blobs/ab/cd/<sha256>.<ext>"""
+    return f'music/blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}{extension}'
+
+
+def song_blob_upload_path(instance, filename):
+    """Generate upload path for song blobs from their content hash"""
+    return song_blob_path(instance.sha256, os.path.splitext(filename)[1].lower())
+
+
+class SongBlob(models.Model):
+    """Content-addressed audio file, stored once and shared by every song with the same bytes"""
+    
+    sha256 = models.CharField(max_length=64, unique=True, verbose_name='هش SHA-256')
+    file = models.FileField(upload_to=song_blob_upload_path, max_length=255, verbose_name='فایل')
+    size = models.BigIntegerField(verbose_name='حجم (بایت)')
+    ref_count = models.PositiveIntegerField(default=0, verbose_name='تعداد ارجاع')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='زمان ایجاد')
+    
+    class Meta:
+        verbose_name = 'فایل آهنگ'
+        verbose_name_plural = 'فایل‌های آهنگ'
+        indexes = [
+            models.Index(fields=['ref_count']),
+        ]
+    
+    def __str__(self):
+        return f"{self.sha256} ({self.ref_count})"
+
+
 class Song(models.Model):
     """Song model for storing music files"""
     
+    STATUS_PROCESSING = 'processing'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+    
+    STATUS_CHOICES = [
+        (STATUS_PROCESSING, 'در حال پردازش'),
+        (STATUS_READY, 'آماده'),
+        (STATUS_FAILED, 'ناموفق'),
+    ]
+    
     title = models.CharField(max_length=255, verbose_name='عنوان آهنگ')
     artist = models.CharField(max_length=255, null=True, blank=True, verbose_name='خواننده')
     album = models.CharField(max_length=255, null=True, blank=True, verbose_name='آلبوم')
@@ -22,6 +62,14 @@ class Song(models.Model):
         validators=[FileExtensionValidator(allowed_extensions=['mp3', 'wav', 'flac', 'm4a', 'ogg', 'aac'])],
         verbose_name='فایل موزیک'
     )
+    blob = models.ForeignKey(
+        SongBlob,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='songs',
+        verbose_name='فایل یکتا'
+    )
     uploaded_by = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
@@ -31,6 +79,8 @@ class Song(models.Model):
     is_public = models.BooleanField(default=False, verbose_name='عمومی')
     duration = models.IntegerField(null=True, blank=True, verbose_name='مدت زمان (ثانیه)')
     file_size = models.BigIntegerField(null=True, blank=True, verbose_name='حجم فایل (بایت)')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_READY, verbose_name='وضعیت پردازش')
+    processing_error = models.CharField(max_length=255, blank=True, default='', verbose_name='خطای پردازش')
     created_at = models.DateTimeField(auto_now_add=True, verbose_name='زمان ایجاد')
     updated_at = models.DateTimeField(auto_now=True, verbose_name='زمان به‌روزرسانی')
     
@@ -56,6 +106,30 @@ class Song(models.Model):
         return 0
 
 
+class SongImportFile(models.Model):
+    """File on disk already handled by a folder import, so a rerun skips it without hashing"""
+    
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='song_import_files',
+        verbose_name='کاربر'
+    )
+    path = models.CharField(max_length=1024, verbose_name='مسیر فایل')
+    size = models.BigIntegerField(verbose_name='حجم (بایت)')
+    mtime_ns = models.BigIntegerField(verbose_name='زمان تغییر فایل (نانوثانیه)')
+    sha256 = models.CharField(max_length=64, verbose_name='هش SHA-256')
+    imported_at = models.DateTimeField(auto_now=True, verbose_name='زمان وارد کردن')
+    
+    class Meta:
+        unique_together = ('user', 'path')
+        verbose_name = 'فایل وارد شده'
+        verbose_name_plural = 'فایل‌های وارد شده'
+    
+    def __str__(self):
+        return f"{self.user.username} - {self.path}"
+
+
 class Playlist(models.Model):
     """Playlist model"""
     
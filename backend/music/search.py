@@ -0,0 +1,322 @@
+from django.db import connection
+from message.search import normalize_text, tokenize
+from .models import Song
+
+
+def edit_distance(a, b, limit):
+    """
+    Edit distance between two strings, counting a swap of adjacent letters as one edit
+
+    Returns:
+        int distance, or limit + 1 once it exceeds limit
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i]
+        for j in range(1, len(b) + 1):
+            cost = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                cost = min(cost, before[j - 2] + 1)
+            current.append(cost)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return min(previous[-1], limit + 1)
+
+
+class SongSearchIndex:
+    """
+    Inverted index over song title, artist and album
+
+    SQLite uses an FTS5 virtual table (plus an fts5vocab table of its terms)
+    and PostgreSQL a tsvector table with GIN indexes, both named
+    `song_search` and created in migration 0005. Each row also stores who
+    may find the song (uploader, public) so a search only ranks rows the
+    user can see. Titles weigh more than artists, artists more than albums.
+
+    Every query token matches as a prefix. Tokens that match nothing are
+    treated as typos: SQLite expands them to indexed terms within a small
+    edit distance, PostgreSQL falls back to trigram word similarity when
+    the pg_trgm extension is installed (creating it needs a superuser, so
+    migrations never do; see has_trigram).
+    """
+
+    # Upper bound on ranked matches returned for a single query
+    RESULT_LIMIT = 500
+
+    # Column weights: title, artist, album, visibility
+    SQLITE_WEIGHTS = (10.0, 5.0, 2.0, 0.0)
+
+    # Shorter tokens are only prefix-matched; typo matching them finds mostly noise
+    FUZZY_MIN_LENGTH = 4
+
+    # Most indexed terms a misspelt token is expanded to
+    FUZZY_EXPANSIONS = 8
+
+    # Highest code point: every string starting with a prefix sorts below prefix + TERM_END
+    TERM_END = '\U0010ffff'
+
+    # Whether pg_trgm is installed, checked once per process
+    _trigram = None
+
+    @staticmethod
+    def is_supported(conn=None):
+        """Check if the database backend has a search index"""
+        return (conn or connection).vendor in ('sqlite', 'postgresql')
+
+    @staticmethod
+    def has_trigram(conn=None, refresh=False):
+        """
+        Check if the PostgreSQL pg_trgm extension is installed
+
+        A DBA installs it with `CREATE EXTENSION pg_trgm`; rebuild_song_search
+        then adds the trigram index.
+        """
+        conn = conn or connection
+        if conn.vendor != 'postgresql':
+            return False
+        if SongSearchIndex._trigram is None or refresh:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+                SongSearchIndex._trigram = cursor.fetchone() is not None
+        return SongSearchIndex._trigram
+
+    @staticmethod
+    def create_trigram_index(conn=None):
+        """Create the trigram index of the terms column if pg_trgm is installed"""
+        conn = conn or connection
+        if not SongSearchIndex.has_trigram(conn, refresh=True):
+            return False
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS song_search_terms_idx ON song_search USING GIN (terms gin_trgm_ops)"
+            )
+        return True
+
+    @staticmethod
+    def create_table(schema_editor):
+        """Create the search tables for the current backend (used by migrations)"""
+        vendor = schema_editor.connection.vendor
+        if vendor == 'sqlite':
+            schema_editor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS song_search USING fts5("
+                "title, artist, album, visibility, "
+                "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+            schema_editor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS song_search_vocab USING fts5vocab(song_search, 'row')"
+            )
+        elif vendor == 'postgresql':
+            schema_editor.execute(
+                "CREATE TABLE IF NOT EXISTS song_search ("
+                "song_id bigint PRIMARY KEY REFERENCES music_song(id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+                "uploaded_by_id bigint NOT NULL, "
+                "is_public boolean NOT NULL, "
+                "document tsvector NOT NULL, "
+                "terms text NOT NULL)"
+            )
+            schema_editor.execute(
+                "CREATE INDEX IF NOT EXISTS song_search_document_idx ON song_search USING GIN (document)"
+            )
+            schema_editor.execute(
+                "CREATE INDEX IF NOT EXISTS song_search_uploaded_by_idx ON song_search (uploaded_by_id)"
+            )
+            SongSearchIndex.create_trigram_index(schema_editor.connection)
+
+    @staticmethod
+    def drop_table(schema_editor):
+        """Drop the search tables (used by migrations)"""
+        vendor = schema_editor.connection.vendor
+        if vendor == 'sqlite':
+            schema_editor.execute('DROP TABLE IF EXISTS song_search_vocab')
+        if SongSearchIndex.is_supported(schema_editor.connection):
+            schema_editor.execute('DROP TABLE IF EXISTS song_search')
+
+    @staticmethod
+    def build_document(song):
+        """
+        Build the indexed fields of a song
+
+        Returns:
+            dict with normalized title, artist, album and visibility
+        """
+        return {
+            'title': normalize_text(song.title),
+            'artist': normalize_text(song.artist),
+            'album': normalize_text(song.album),
+            'uploaded_by_id': song.uploaded_by_id,
+            'is_public': song.is_public,
+        }
+
+    @staticmethod
+    def index_song(song):
+        """Add or replace a song in the search index"""
+        SongSearchIndex.index_songs([song])
+
+    @staticmethod
+    def index_songs(songs):
+        """Add or replace many songs in the search index (one batched statement each)"""
+        songs = list(songs)
+        if not SongSearchIndex.is_supported() or not songs:
+            return
+
+        docs = [(song.id, SongSearchIndex.build_document(song)) for song in songs]
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                rows = []
+                for song_id, doc in docs:
+                    visibility = f"u{doc['uploaded_by_id']}" + (' public' if doc['is_public'] else '')
+                    rows.append([song_id, doc['title'], doc['artist'], doc['album'], visibility])
+                cursor.executemany('DELETE FROM song_search WHERE rowid = %s', [[row[0]] for row in rows])
+                cursor.executemany(
+                    'INSERT INTO song_search (rowid, title, artist, album, visibility) '
+                    'VALUES (%s, %s, %s, %s, %s)',
+                    rows
+                )
+            else:
+                cursor.executemany(
+                    "INSERT INTO song_search (song_id, uploaded_by_id, is_public, document, terms) VALUES (%s, %s, %s, "
+                    "setweight(to_tsvector('simple', %s), 'A') || "
+                    "setweight(to_tsvector('simple', %s), 'B') || "
+                    "setweight(to_tsvector('simple', %s), 'C'), %s) "
+                    "ON CONFLICT (song_id) DO UPDATE SET "
+                    "uploaded_by_id = EXCLUDED.uploaded_by_id, is_public = EXCLUDED.is_public, "
+                    "document = EXCLUDED.document, terms = EXCLUDED.terms",
+                    [
+                        [
+                            song_id, doc['uploaded_by_id'], doc['is_public'],
+                            doc['title'], doc['artist'], doc['album'],
+                            ' '.join(part for part in (doc['title'], doc['artist'], doc['album']) if part)
+                        ]
+                        for song_id, doc in docs
+                    ]
+                )
+
+    @staticmethod
+    def remove_song(song_id):
+        """Remove a song from the search index"""
+        if not SongSearchIndex.is_supported():
+            return
+
+        column = 'rowid' if connection.vendor == 'sqlite' else 'song_id'
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM song_search WHERE {column} = %s', [song_id])
+
+    @staticmethod
+    def rebuild(batch_size=1000, model=None):
+        """
+        Rebuild the whole search index from the songs table
+
+        Args:
+            batch_size: Songs indexed per batch
+            model: Song model to read (a migration passes its historical model)
+
+        Returns:
+            Number of indexed songs
+        """
+        if not SongSearchIndex.is_supported():
+            return 0
+
+        # pg_trgm may have been installed since the table was created
+        SongSearchIndex.create_trigram_index()
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM song_search')
+
+        count = 0
+        last_id = 0
+        songs = (model or Song).objects.only('id', 'title', 'artist', 'album', 'uploaded_by_id', 'is_public').order_by('id')
+        while True:
+            batch = list(songs.filter(id__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].id
+            SongSearchIndex.index_songs(batch)
+            count += len(batch)
+        return count
+
+    @staticmethod
+    def expand_token(cursor, token):
+        """
+        FTS5 query of one token: a prefix match, widened to close terms if nothing starts with it
+
+        Returns:
+            FTS5 query string
+        """
+        prefix = f'"{token}"*'
+        cursor.execute(
+            'SELECT 1 FROM song_search_vocab WHERE term >= %s AND term < %s LIMIT 1',
+            [token, token + SongSearchIndex.TERM_END]
+        )
+        if cursor.fetchone() or len(token) < SongSearchIndex.FUZZY_MIN_LENGTH:
+            return prefix
+
+        # Typos rarely hit the first two letters: only terms sharing them are compared
+        max_distance = 1 if len(token) < 8 else 2
+        cursor.execute(
+            'SELECT term FROM song_search_vocab WHERE term >= %s AND term < %s AND length(term) BETWEEN %s AND %s',
+            [token[:2], token[:2] + SongSearchIndex.TERM_END, len(token) - max_distance, len(token) + max_distance]
+        )
+        candidates = sorted(
+            (distance, term) for distance, term in
+            ((edit_distance(token, term, max_distance), term) for (term,) in cursor.fetchall())
+            if distance <= max_distance
+        )
+        terms = [prefix] + [f'"{term}"' for distance, term in candidates[:SongSearchIndex.FUZZY_EXPANSIONS]]
+        return '(' + ' OR '.join(terms) + ')'
+
+    @staticmethod
+    def search(user, query, include_public=True, limit=None):
+        """
+        Search songs visible to a user
+
+        Args:
+            user: User object
+            query: Raw search query string
+            include_public: Boolean - include public songs of other users
+            limit: Max number of results (default: RESULT_LIMIT)
+
+        Returns:
+            List of song ids, best match first
+        """
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        limit = limit or SongSearchIndex.RESULT_LIMIT
+
+        with connection.cursor() as cursor:
+            if connection.vendor == 'sqlite':
+                terms = ' AND '.join(SongSearchIndex.expand_token(cursor, token) for token in tokens)
+                visibility = f'("u{user.id}" OR "public")' if include_public else f'"u{user.id}"'
+                match = f'visibility : {visibility} AND {{title artist album}} : ({terms})'
+                weights = ', '.join(str(w) for w in SongSearchIndex.SQLITE_WEIGHTS)
+                cursor.execute(
+                    f'SELECT rowid FROM song_search WHERE song_search MATCH %s '
+                    f'ORDER BY bm25(song_search, {weights}) LIMIT %s',
+                    [match, limit]
+                )
+                return [row[0] for row in cursor.fetchall()]
+
+            visibility = '(uploaded_by_id = %s OR is_public)' if include_public else 'uploaded_by_id = %s'
+            terms = ' & '.join(f'{token}:*' for token in tokens)
+            cursor.execute(
+                f"SELECT song_id FROM song_search "
+                f"WHERE document @@ to_tsquery('simple', %s) AND {visibility} "
+                f"ORDER BY ts_rank(document, to_tsquery('simple', %s)) DESC LIMIT %s",
+                [terms, user.id, terms, limit]
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+            if ids or not SongSearchIndex.has_trigram():
+                return ids
+
+            # Nothing matched every token: rank by trigram similarity instead (typos)
+            text = ' '.join(tokens)
+            cursor.execute(
+                f"SELECT song_id FROM song_search "
+                f"WHERE %s <%% terms AND {visibility} "
+                f"ORDER BY word_similarity(%s, terms) DESC LIMIT %s",
+                [text, user.id, text, limit]
+            )
+            return [row[0] for row in cursor.fetchall()]
@@ -1,9 +1,11 @@
 from rest_framework import serializers
+from django.urls import reverse
 from .models import Song, Playlist, PlaylistInvitation
 import os
+from dmail.serializers import SparseFieldsetMixin
 
 
-class SongSerializer(serializers.ModelSerializer):
+class SongSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Serializer for Song model"""
     uploaded_by_username = serializers.CharField(source='uploaded_by.username', read_only=True)
     uploaded_by_email = serializers.EmailField(source='uploaded_by.email', read_only=True)
@@ -30,17 +32,18 @@ class SongSerializer(serializers.ModelSerializer):
             'duration',
             'file_size',
             'file_size_mb',
+            'status',
             'created_at',
             'updated_at',
         )
-        read_only_fields = ('id', 'uploaded_by', 'created_at', 'updated_at', 'file_size', 'duration')
+        read_only_fields = ('id', 'uploaded_by', 'created_at', 'updated_at', 'file_size', 'duration', 'status')
     
     def get_file_url(self, obj):
-        """Get file URL"""
+        """Get the authenticated stream URL of the file (see SongStreamView)"""
         if obj.file:
             request = self.context.get('request')
             if request:
-                return request.build_absolute_uri(obj.file.url)
+                return request.build_absolute_uri(reverse('music:song-stream', args=[obj.id]))
         return None
     
     def get_file_size_mb(self, obj):
@@ -67,6 +70,23 @@ class SongSerializer(serializers.ModelSerializer):
         return False
 
 
+class SongIngestStatusSerializer(serializers.ModelSerializer):
+    """Serializer for the processing state of an uploaded song"""
+    
+    class Meta:
+        model = Song
+        fields = (
+            'id',
+            'status',
+            'processing_error',
+            'title',
+            'artist',
+            'album',
+            'duration',
+            'updated_at',
+        )
+
+
 class SongCreateSerializer(serializers.ModelSerializer):
     """Serializer for creating a song"""
     file = serializers.FileField(required=True)
@@ -94,7 +114,7 @@ class SongCreateSerializer(serializers.ModelSerializer):
         return value
 
 
-class PlaylistSongSerializer(serializers.ModelSerializer):
+class PlaylistSongSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Serializer for songs in playlist with added_by info"""
     added_by_username = serializers.SerializerMethodField()
     added_by_email = serializers.SerializerMethodField()
@@ -128,11 +148,11 @@ class PlaylistSongSerializer(serializers.ModelSerializer):
         return getattr(obj, '_added_by_email', obj.uploaded_by.email)
     
     def get_file_url(self, obj):
-        """Get file URL"""
+        """Get the authenticated stream URL of the file (see SongStreamView)"""
         if obj.file:
             request = self.context.get('request')
             if request:
-                return request.build_absolute_uri(obj.file.url)
+                return request.build_absolute_uri(reverse('music:song-stream', args=[obj.id]))
         return None
     
     def get_file_size_mb(self, obj):
@@ -140,7 +160,7 @@ class PlaylistSongSerializer(serializers.ModelSerializer):
         return obj.get_file_size_mb()
 
 
-class PlaylistSerializer(serializers.ModelSerializer):
+class PlaylistSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Serializer for Playlist model"""
     owner_username = serializers.CharField(source='owner.username', read_only=True)
     owner_email = serializers.EmailField(source='owner.email', read_only=True)
@@ -192,7 +212,7 @@ class PlaylistSerializer(serializers.ModelSerializer):
         ]
 
 
-class PlaylistDetailSerializer(serializers.ModelSerializer):
+class PlaylistDetailSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Serializer for detailed playlist view with songs"""
     owner_username = serializers.CharField(source='owner.username', read_only=True)
     owner_email = serializers.EmailField(source='owner.email', read_only=True)
@@ -256,7 +276,7 @@ class PlaylistCreateSerializer(serializers.ModelSerializer):
         fields = ('name',)
 
 
-class PlaylistInvitationSerializer(serializers.ModelSerializer):
+class PlaylistInvitationSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     """Serializer for PlaylistInvitation"""
     playlist_name = serializers.CharField(source='playlist.name', read_only=True)
     inviter_username = serializers.CharField(source='inviter.username', read_only=True)
@@ -1,12 +1,14 @@
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.db import models, transaction
 from django.db.models import Q
 import os
 from mutagen import File as MutagenFile
 from mutagen.id3 import ID3NoHeaderError
 from .models import Song, Playlist, PlaylistInvitation
+from .blobs import SongBlobStore
+from .search import SongSearchIndex
 
 User = get_user_model()
 
@@ -74,6 +76,10 @@ class MusicService:
         """
         Upload a single song file
         
+        The song is returned in 'processing' state; its metadata is
+        extracted in the background (see SongIngest). Files already stored
+        are linked instead of copied and come back 'ready'.
+        
         Args:
             user: User object (uploader)
             file: File object
@@ -85,42 +91,152 @@ class MusicService:
         Returns:
             Song object
         """
+        from .ingest import SongIngest
+        
         # Validate file extension
         file_ext = os.path.splitext(file.name)[1].lower()
         if file_ext not in MusicService.AUDIO_EXTENSIONS:
             raise ValidationError(f'فرمت فایل پشتیبانی نمی‌شود. فرمت‌های مجاز: {", ".join(MusicService.AUDIO_EXTENSIONS)}')
         
-        # Save file temporarily to extract metadata
-        temp_path = None
         try:
-            # Create song object first to get ID for file path
+            with transaction.atomic():
+                # Identical bytes are stored once (see SongBlobStore)
+                blob = SongBlobStore.store(file)
+                
+                # File name as title until the metadata is extracted
+                song = Song(
+                    uploaded_by=user,
+                    is_public=is_public,
+                    file=blob.file.name,
+                    blob=blob,
+                    title=title or os.path.splitext(os.path.basename(file.name))[0],
+                    artist=artist,
+                    album=album,
+                    file_size=blob.size,
+                    status=Song.STATUS_PROCESSING
+                )
+                
+                # A re-upload takes the metadata already extracted from the same bytes
+                source = Song.objects.filter(blob=blob, status=Song.STATUS_READY).order_by('id').first()
+                if source is not None:
+                    MusicService.copy_metadata(source, song, title=title, artist=artist, album=album)
+                
+                song.save()
+        except Exception as e:
+            raise ValidationError(f'خطا در آپلود فایل: {str(e)}')
+        
+        if song.status == Song.STATUS_READY:
+            return song
+        
+        SongIngest.submit(song.id, overrides={'title': title, 'artist': artist, 'album': album})
+        return song
+    
+    @staticmethod
+    def copy_metadata(source, song, title=None, artist=None, album=None):
+        """
+        Copy the metadata of a ready song to a song with the same file
+        
+        Args:
+            source: Song object the metadata is taken from
+            song: Song object to fill (not saved)
+            title: Optional title override
+            artist: Optional artist override
+            album: Optional album override
+        """
+        song.title = title or source.title
+        song.artist = artist or source.artist
+        song.album = album or source.album
+        song.duration = source.duration
+        song.status = Song.STATUS_READY
+    
+    @staticmethod
+    def lookup_song_by_hash(user, sha256):
+        """
+        Find a song with the given content the user could link instead of uploading
+        
+        Args:
+            user: User object
+            sha256: SHA-256 hex digest of the audio file
+            
+        Returns:
+            (Song object or None, Boolean - song belongs to the user)
+        """
+        sha256 = (sha256 or '').strip().lower()
+        if len(sha256) != 64:
+            raise ValidationError('هش فایل نامعتبر است')
+        
+        own = Song.objects.filter(uploaded_by=user, blob__sha256=sha256).order_by('id').first()
+        if own is not None:
+            return own, True
+        return SongBlobStore.find_public_song(sha256, exclude_user=user), False
+    
+    @staticmethod
+    def link_song(song_id, user, is_public=False):
+        """
+        Add a song to the user's library by linking to the stored file of another song
+        
+        Only the user's own songs and ready public songs can be linked (as
+        with SongBlobStore.find_public_song); private songs shared through a
+        playlist stay playable but cannot be copied.
+        
+        Args:
+            song_id: ID of the user's own song or of a public song
+            user: User object (new uploader)
+            is_public: Boolean - is the new song public
+            
+        Returns:
+            (Song object, Boolean - created)
+        
+        Raises:
+            Song.DoesNotExist: no such song
+            ValidationError: the song may not be linked
+        """
+        source = Song.objects.get(id=song_id)
+        if source.uploaded_by_id == user.id:
+            return source, False
+        
+        if not source.is_public or source.status != Song.STATUS_READY:
+            raise ValidationError('شما دسترسی به این آهنگ ندارید')
+        
+        if not source.blob_id and not SongBlobStore.adopt(source):
+            raise ValidationError('فایل این آهنگ یافت نشد')
+        source.refresh_from_db()
+        
+        existing = Song.objects.filter(uploaded_by=user, blob_id=source.blob_id).first()
+        if existing is not None:
+            return existing, False
+        
+        with transaction.atomic():
+            blob = SongBlobStore.reference(source.blob.sha256)
             song = Song(
                 uploaded_by=user,
                 is_public=is_public,
-                file=file
+                file=blob.file.name,
+                blob=blob,
+                file_size=blob.size
             )
+            MusicService.copy_metadata(source, song)
             song.save()
+        return song, True
+    
+    @staticmethod
+    def get_ingest_status(user, song_ids=None):
+        """
+        Get the processing state of the user's uploads
+        
+        Args:
+            user: User object (uploader)
+            song_ids: Optional list of song IDs; default all songs still processing
             
-            # Extract metadata from file
-            if song.file:
-                temp_path = song.file.path
-                metadata = MusicService.extract_metadata(temp_path)
-                
-                # Use provided values or metadata from file
-                song.title = title or metadata.get('title') or os.path.splitext(file.name)[0]
-                song.artist = artist or metadata.get('artist')
-                song.album = album or metadata.get('album')
-                song.duration = metadata.get('duration')
-                song.file_size = song.file.size if song.file else None
-                
-                song.save()
-            
-            return song
-            
-        except Exception as e:
-            if song and song.pk:
-                song.delete()
-            raise ValidationError(f'خطا در آپلود فایل: {str(e)}')
+        Returns:
+            QuerySet of Song objects
+        """
+        songs = Song.objects.filter(uploaded_by=user)
+        if song_ids is None:
+            songs = songs.filter(status=Song.STATUS_PROCESSING)
+        else:
+            songs = songs.filter(id__in=song_ids)
+        return songs.order_by('-created_at')
     
     @staticmethod
     def upload_multiple_songs(user, files, is_public=False):
@@ -155,7 +271,7 @@ class MusicService:
         return uploaded_songs, errors
     
     @staticmethod
-    def upload_folder_songs(user, folder_path, is_public=False):
+    def upload_folder_songs(user, folder_path, is_public=False, parallel=False, progress=None):
         """
         Upload all songs from a folder
         
@@ -163,13 +279,19 @@ class MusicService:
             user: User object (uploader)
             folder_path: Path to folder containing audio files
             is_public: Boolean - are songs public
+            parallel: Boolean - bulk import with a process pool (see SongImporter)
+            progress: Optional progress callback of the parallel import
             
         Returns:
-            List of Song objects, List of errors
+            List of Song objects (the number of imported songs when parallel), List of errors
         """
         if not os.path.isdir(folder_path):
             raise ValidationError('مسیر پوشه معتبر نیست')
         
+        if parallel:
+            from .importer import SongImporter
+            return SongImporter(user, folder_path, is_public=is_public).run(progress=progress)
+        
         uploaded_songs = []
         errors = []
         
@@ -218,18 +340,48 @@ class MusicService:
         
         return songs.order_by('-created_at')
     
+    @staticmethod
+    def get_playable_song(song_id, user):
+        """
+        Get a song the user may play
+        
+        Args:
+            song_id: Song ID
+            user: User object
+            
+        Returns:
+            Song object (own, public, or in a playlist the user belongs to)
+            
+        Raises:
+            Song.DoesNotExist: no such song
+            ValidationError: the user may not play the song
+        """
+        song = Song.objects.get(id=song_id)
+        
+        if song.uploaded_by_id == user.id or song.is_public:
+            return song
+        
+        # Private songs stay playable for members of playlists they were added to
+        if song.playlists.filter(Q(owner=user) | Q(members=user)).exists():
+            return song
+        
+        raise ValidationError('شما دسترسی به این آهنگ ندارید')
+    
     @staticmethod
     def search_songs(user, query, include_public=True):
         """
         Search songs by title, artist, or album
         
+        Uses the full-text index (prefix and typo tolerant, ranked by
+        field) where the database supports it, icontains otherwise.
+        
         Args:
             user: User object
             query: Search query string
             include_public: Boolean - include public songs in search
             
         Returns:
-            QuerySet of Song objects
+            QuerySet of Song objects, best match first
         """
         if not query or not query.strip():
             return Song.objects.none()
@@ -244,6 +396,14 @@ class MusicService:
         else:
             songs = Song.objects.filter(uploaded_by=user)
         
+        if SongSearchIndex.is_supported():
+            # Ranked full-text search over the index, bounded to the best RESULT_LIMIT matches
+            song_ids = SongSearchIndex.search(user, search_query, include_public=include_public)
+            if not song_ids:
+                return Song.objects.none()
+            rank = models.Case(*[models.When(id=song_id, then=position) for position, song_id in enumerate(song_ids)])
+            return songs.filter(id__in=song_ids).order_by(rank)
+        
         # Apply search filters
         songs = songs.filter(
             Q(title__icontains=search_query) |
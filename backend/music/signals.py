@@ -0,0 +1,26 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Song
+from .blobs import SongBlobStore
+from .search import SongSearchIndex
+
+
+@receiver(post_save, sender=Song)
+def index_song(sender, instance, update_fields=None, **kwargs):
+    """Keep the search index in sync when a song is created or edited"""
+    if update_fields and not {'title', 'artist', 'album', 'is_public', 'uploaded_by'} & set(update_fields):
+        return
+    SongSearchIndex.index_song(instance)
+
+
+@receiver(post_delete, sender=Song)
+def unindex_song(sender, instance, **kwargs):
+    """Remove deleted songs from the search index"""
+    SongSearchIndex.remove_song(instance.id)
+
+
+@receiver(post_delete, sender=Song)
+def release_song_blob(sender, instance, **kwargs):
+    """Drop the deleted song's reference on its blob"""
+    if instance.blob_id:
+        SongBlobStore.release(instance.blob_id)
@@ -1,3 +1,421 @@
-from django.test import TestCase
+import importlib
+import io
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock, skipUnless
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from .blobs import SongBlobStore
+from .importer import SongImporter
+from .models import Playlist, Song, SongBlob
+from .search import SongSearchIndex
+from .services import MusicService
 
-# Create your tests here.
+User = get_user_model()
+
+
+class MediaRootMixin:
+    """Store the files of a test case in a temporary MEDIA_ROOT"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_settings = override_settings(MEDIA_ROOT=cls.media_root, MUSIC_INGEST_WORKERS=0)
+        cls.media_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.media_settings.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+
+def create_song(user, content, is_public):
+    """Create a song stored in the blob store"""
+    with transaction.atomic():
+        blob = SongBlobStore.store(SimpleUploadedFile('song.mp3', content))
+        return Song.objects.create(
+            uploaded_by=user,
+            is_public=is_public,
+            title='Song',
+            file=blob.file.name,
+            blob=blob,
+            file_size=blob.size
+        )
+
+
+class LinkSongTests(MediaRootMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', 'alice@example.com', 'password')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'password')
+        cls.public_song = create_song(cls.alice, b'public audio', is_public=True)
+        cls.private_song = create_song(cls.alice, b'private audio', is_public=False)
+        cls.own_song = create_song(cls.bob, b'own audio', is_public=False)
+        playlist = Playlist.objects.create(name='Shared', owner=cls.alice)
+        playlist.members.add(cls.bob)
+        playlist.songs.add(cls.private_song)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.bob)
+
+    def test_link_public_song(self):
+        response = self.client.post(f'/api/music/songs/{self.public_song.id}/link/', {}, format='json')
+        self.assertEqual(response.status_code, 201)
+        song = Song.objects.get(id=response.json()['data']['id'])
+        self.assertEqual(song.uploaded_by, self.bob)
+        self.assertEqual(song.blob_id, self.public_song.blob_id)
+
+    def test_private_song_shared_by_playlist_is_not_linked(self):
+        # Playable through the playlist...
+        self.assertEqual(MusicService.get_playable_song(self.private_song.id, self.bob), self.private_song)
+        # ...but not copied into the user's library
+        response = self.client.post(f'/api/music/songs/{self.private_song.id}/link/', {}, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(list(Song.objects.filter(uploaded_by=self.bob)), [self.own_song])
+
+    def test_link_own_song_returns_it(self):
+        response = self.client.post(f'/api/music/songs/{self.own_song.id}/link/', {}, format='json')
+        self.assertEqual(response.json()['data']['id'], self.own_song.id)
+        self.assertEqual(Song.objects.filter(uploaded_by=self.bob).count(), 1)
+
+    def lookup(self, song):
+        response = self.client.get('/api/music/songs/lookup/', {'sha256': song.blob.sha256})
+        self.assertEqual(response.status_code, 200, response.content)
+        data = response.json()
+        return data['data']['id'] if data['data'] else None, data['is_own']
+
+    def test_lookup_finds_own_or_public_songs_only(self):
+        self.assertEqual(self.lookup(self.own_song), (self.own_song.id, True))
+        self.assertEqual(self.lookup(self.public_song), (self.public_song.id, False))
+        # Shared through a playlist, but private
+        self.assertEqual(self.lookup(self.private_song), (None, False))
+
+        response = self.client.get('/api/music/songs/lookup/', {'sha256': 'not a hash'})
+        self.assertEqual(response.status_code, 400)
+
+
+class SongBlobTests(MediaRootMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', 'alice@example.com', 'password')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'password')
+
+    def test_identical_files_share_one_blob(self):
+        first = create_song(self.alice, b'same audio', is_public=False)
+        second = create_song(self.bob, b'same audio', is_public=False)
+        other = create_song(self.bob, b'other audio', is_public=False)
+
+        self.assertEqual(first.blob_id, second.blob_id)
+        self.assertNotEqual(first.blob_id, other.blob_id)
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertEqual(SongBlob.objects.get(id=first.blob_id).ref_count, 2)
+
+    def test_ref_count_follows_deletes(self):
+        first = create_song(self.alice, b'shared audio', is_public=False)
+        second = create_song(self.bob, b'shared audio', is_public=False)
+        blob = first.blob
+
+        first.delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 1)
+        second.delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 0)
+
+    def test_collect_deletes_only_unreferenced_blobs(self):
+        kept = create_song(self.alice, b'kept audio', is_public=False)
+        orphan = create_song(self.alice, b'orphan audio', is_public=False)
+        young = create_song(self.alice, b'young audio', is_public=False)
+        kept_blob, orphan_blob, young_blob = kept.blob, orphan.blob, young.blob
+        orphan.delete()
+        young.delete()
+        # Only blobs past the grace period are collected
+        SongBlob.objects.exclude(id=young_blob.id).update(created_at=timezone.now() - timedelta(days=1))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('collect_song_blobs', stdout=io.StringIO())
+
+        self.assertEqual(set(SongBlob.objects.values_list('id', flat=True)), {kept_blob.id, young_blob.id})
+        for blob, exists in ((kept_blob, True), (orphan_blob, False), (young_blob, True)):
+            self.assertEqual(os.path.exists(os.path.join(self.media_root, blob.file.name)), exists)
+
+
+@skipUnless(SongSearchIndex.is_supported(), 'no search index for this database')
+class SongSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', 'alice@example.com', 'password')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'password')
+        cls.by_album = cls.create_song(cls.alice, 'Evening', album='Sunrise')
+        cls.by_artist = cls.create_song(cls.alice, 'Morning', artist='Sunrise')
+        cls.by_title = cls.create_song(cls.alice, 'Sunrise')
+        cls.private = cls.create_song(cls.bob, 'Sunrise Private')
+
+    @staticmethod
+    def create_song(user, title, artist=None, album=None, is_public=False):
+        return Song.objects.create(
+            uploaded_by=user,
+            title=title,
+            artist=artist,
+            album=album,
+            is_public=is_public,
+            file='songs/song.mp3'
+        )
+
+    def search(self, query, user=None):
+        return list(MusicService.search_songs(user or self.alice, query).values_list('id', flat=True))
+
+    def test_title_outranks_artist_and_album(self):
+        self.assertEqual(self.search('sunrise'), [self.by_title.id, self.by_artist.id, self.by_album.id])
+
+    def test_prefix(self):
+        self.assertEqual(self.search('sunr'), [self.by_title.id, self.by_artist.id, self.by_album.id])
+        self.assertEqual(self.search('even'), [self.by_album.id])
+
+    def test_typo(self):
+        if connection.vendor == 'postgresql' and not SongSearchIndex.has_trigram():
+            self.skipTest('typo matching needs pg_trgm')
+        self.assertEqual(self.search('sunrsie')[0], self.by_title.id)
+        self.assertEqual(self.search('mornign'), [self.by_artist.id])
+        # Short tokens are only prefix-matched
+        self.assertEqual(self.search('sux'), [])
+
+    def test_index_follows_create_public_status_and_delete(self):
+        self.assertNotIn(self.private.id, self.search('private'))
+
+        client = APIClient()
+        client.force_authenticate(self.bob)
+        response = client.post('/api/music/songs/update-public-status/', {
+            'song_ids': [self.private.id],
+            'is_public': True,
+        }, format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.search('private'), [self.private.id])
+
+        song = self.create_song(self.alice, 'Nocturne')
+        self.assertEqual(self.search('noct'), [song.id])
+        song.delete()
+        self.assertEqual(self.search('noct'), [])
+
+    def test_backfill_migration(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM song_search')
+        self.assertEqual(self.search('sunrise'), [])
+
+        migration = importlib.import_module('music.migrations.0007_fill_song_search')
+        migration.fill_search_index(apps, None)
+        self.assertEqual(self.search('sunrise'), [self.by_title.id, self.by_artist.id, self.by_album.id])
+
+
+class SongStreamTests(MediaRootMixin, TestCase):
+
+    CONTENT = b'0123456789' * 10
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user('alice', 'alice@example.com', 'password')
+        cls.bob = User.objects.create_user('bob', 'bob@example.com', 'password')
+        cls.public_song = create_song(cls.alice, cls.CONTENT, is_public=True)
+        cls.private_song = create_song(cls.alice, b'private audio', is_public=False)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.bob)
+        self.url = f'/api/music/songs/{self.public_song.id}/stream/'
+
+    def test_full_file(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Type'], 'audio/mpeg')
+
+    def test_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT[10:20])
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.CONTENT)}')
+
+        # Open-ended and suffix ranges, as sent by players when seeking
+        response = self.client.get(self.url, HTTP_RANGE='bytes=90-')
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT[90:])
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT[-5:])
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.CONTENT)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.CONTENT)}')
+
+    def test_private_song_of_another_user(self):
+        response = self.client.get(f'/api/music/songs/{self.private_song.id}/stream/')
+        self.assertEqual(response.status_code, 403)
+
+    def test_query_token(self):
+        client = APIClient()
+        response = client.get(self.url, {'token': str(AccessToken.for_user(self.bob))}, HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(client.get(self.url).status_code, 401)
+
+
+class SongIngestTests(MediaRootMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', 'alice@example.com', 'password')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, content, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/music/upload/', {
+                'file': SimpleUploadedFile('track.mp3', content),
+                'title': 'Track',
+                **fields,
+            }, format='multipart')
+        self.assertEqual(response.status_code, 201, response.content)
+        # The upload is answered before the metadata is extracted
+        self.assertEqual(response.json()['data']['status'], Song.STATUS_PROCESSING)
+        return response.json()['data']['id']
+
+    def get_status(self, song_id):
+        response = self.client.get('/api/music/songs/ingest-status/', {'ids': str(song_id)})
+        return response.json()['data'][0]
+
+    def test_processing_to_ready(self):
+        metadata = {'title': 'Tag Title', 'artist': 'Tag Artist', 'album': 'Tag Album', 'duration': 180}
+        with mock.patch.object(MusicService, 'extract_metadata', return_value=metadata):
+            song_id = self.upload(b'ready audio', album='Uploader Album')
+        status = self.get_status(song_id)
+        # Values sent with the upload are kept over the file's tags
+        self.assertEqual(
+            {key: status[key] for key in ('status', 'title', 'artist', 'album', 'duration')},
+            {'status': Song.STATUS_READY, 'title': 'Track', 'artist': 'Tag Artist', 'album': 'Uploader Album', 'duration': 180}
+        )
+        self.assertEqual(MusicService.search_songs(self.user, 'tag artist').get().id, song_id)
+
+    def test_processing_to_failed(self):
+        with mock.patch.object(MusicService, 'extract_metadata', side_effect=ValueError('not audio')):
+            song_id = self.upload(b'broken audio')
+        status = self.get_status(song_id)
+        self.assertEqual((status['status'], status['processing_error']), (Song.STATUS_FAILED, 'not audio'))
+
+    def test_ingest_pending_songs_picks_up_leftovers(self):
+        # Left 'processing' when the web process stopped before the pool ran them
+        with mock.patch('music.ingest.SongIngest.submit'):
+            first = self.upload(b'first audio')
+            second = self.upload(b'second audio', artist='Kept Artist')
+        self.assertEqual(
+            {song['id'] for song in self.client.get('/api/music/songs/ingest-status/').json()['data']},
+            {first, second}
+        )
+
+        metadata = {'artist': 'Tag Artist', 'duration': 60}
+        with mock.patch.object(MusicService, 'extract_metadata', return_value=metadata):
+            out = io.StringIO()
+            call_command('ingest_pending_songs', stdout=out)
+        self.assertIn('2 songs processed, 0 failed', out.getvalue())
+        self.assertEqual(
+            list(Song.objects.order_by('id').values_list('status', 'artist', 'duration')),
+            [(Song.STATUS_READY, 'Tag Artist', 60), (Song.STATUS_READY, 'Kept Artist', 60)]
+        )
+        self.assertEqual(self.client.get('/api/music/songs/ingest-status/').json()['data'], [])
+
+
+class RecordingExecutor:
+    """Runs executor.map inline and records the paths it was given"""
+
+    def __init__(self):
+        self.paths = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def map(self, func, paths, chunksize=1):
+        self.paths += paths
+        return map(func, paths)
+
+
+class SongImporterTests(MediaRootMixin, TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', 'alice@example.com', 'password')
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.folder, ignore_errors=True)
+        self.paths = []
+        for i in range(3):
+            self.paths.append(self.write_file(f'song{i}.mp3', f'audio {i}'.encode()))
+
+    def write_file(self, name, content):
+        path = os.path.join(self.folder, name)
+        with open(path, 'wb') as file:
+            file.write(content)
+        return path
+
+    def import_files(self, paths):
+        importer = SongImporter(self.user, self.folder)
+        executor = RecordingExecutor()
+        errors = []
+        created = importer.import_batch(executor, paths, errors)
+        return importer, executor, created, errors
+
+    def test_rerun_skips_unchanged_files_before_hashing(self):
+        importer, executor, created, errors = self.import_files(self.paths)
+        self.assertEqual((len(created), importer.skipped, errors), (3, 0, []))
+
+        # A file whose mtime changed is hashed again (its content is still known)
+        os.utime(self.paths[0], ns=(0, 0))
+        importer, executor, created, errors = self.import_files(self.paths)
+        self.assertEqual(executor.paths, [self.paths[0]])
+        self.assertEqual((len(created), importer.skipped), (0, 3))
+
+        # Deleted songs are imported again
+        Song.objects.filter(title='song1').delete()
+        importer, executor, created, errors = self.import_files(self.paths)
+        self.assertEqual(executor.paths, [self.paths[1]])
+        self.assertEqual([song.title for song in created], ['song1'])
+
+    def test_broken_file_is_reported_and_import_continues(self):
+        def extract_metadata(path):
+            if path == self.paths[1]:
+                raise KeyError('broken tag')
+            return {}
+
+        with mock.patch.object(MusicService, 'extract_metadata', side_effect=extract_metadata):
+            importer, executor, created, errors = self.import_files(self.paths)
+        self.assertEqual(len(created), 2)
+        self.assertEqual(errors, ["song1.mp3: 'broken tag'"])
+
+    def test_run_counts_batches_without_keeping_them(self):
+        progress = []
+        with mock.patch('music.importer.ProcessPoolExecutor', return_value=RecordingExecutor()):
+            importer = SongImporter(self.user, self.folder, batch_size=2)
+            imported, errors = importer.run(progress=lambda *counts: progress.append(counts))
+        self.assertEqual((imported, errors), (3, []))
+        self.assertEqual(progress, [(2, 2, 0, 0), (3, 3, 0, 0)])
+        # Each batch was indexed as it was inserted
+        if SongSearchIndex.is_supported():
+            self.assertEqual(MusicService.search_songs(self.user, 'song2').get().title, 'song2')
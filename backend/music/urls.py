@@ -5,7 +5,8 @@ from .views import (
     AddSongToPlaylistView, RemoveSongFromPlaylistView,
     InviteToPlaylistView, InvitationsListView, RespondToInvitationView,
     UpdateSongsPublicStatusView, ToggleFavoriteSongView, FavoriteSongsListView,
-    SavePlaybackStateView, GetPlaybackStateView
+    SavePlaybackStateView, GetPlaybackStateView, SongStreamView, SongIngestStatusView,
+    SongLookupView, LinkSongView
 )
 
 app_name = 'music'
@@ -15,6 +16,10 @@ urlpatterns = [
     path('upload/', UploadSongView.as_view(), name='upload'),
     path('upload-multiple/', UploadMultipleSongsView.as_view(), name='upload-multiple'),
     path('songs/', SongListView.as_view(), name='songs'),
+    path('songs/ingest-status/', SongIngestStatusView.as_view(), name='song-ingest-status'),
+    path('songs/lookup/', SongLookupView.as_view(), name='song-lookup'),
+    path('songs/<int:song_id>/link/', LinkSongView.as_view(), name='link-song'),
+    path('songs/<int:song_id>/stream/', SongStreamView.as_view(), name='song-stream'),
     path('songs/<int:song_id>/toggle-favorite/', ToggleFavoriteSongView.as_view(), name='toggle-favorite'),
     path('songs/update-public-status/', UpdateSongsPublicStatusView.as_view(), name='update-songs-public-status'),
     path('favorites/', FavoriteSongsListView.as_view(), name='favorites'),
@@ -1,3 +1,4 @@
+import os
 from rest_framework import status
 from rest_framework.views import APIView
 from rest_framework.response import Response
@@ -5,12 +6,16 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.parsers import MultiPartParser, FormParser, JSONParser
 from django.core.exceptions import ValidationError
 from django.db.models import Q
+from dmail.authentication import QueryTokenJWTAuthentication
+from dmail.downloads import FileDownload
 from .serializers import (
-    SongSerializer, SongCreateSerializer,
+    SongSerializer, SongCreateSerializer, SongIngestStatusSerializer,
     PlaylistSerializer, PlaylistDetailSerializer, PlaylistCreateSerializer,
     PlaylistInvitationSerializer, PlaylistInvitationCreateSerializer
 )
 from .services import MusicService
+from .blobs import SongBlobStore
+from .search import SongSearchIndex
 from .models import Song, Playlist, PlaylistInvitation, UserPlaybackState
 
 
@@ -33,6 +38,8 @@ class UploadSongView(APIView):
             is_public: boolean (default: false)
         }
         """
+        # Hash the file while it is received (must happen before request.data is read)
+        request.upload_handlers = SongBlobStore.upload_handlers(request)
         serializer = SongCreateSerializer(data=request.data)
         if serializer.is_valid():
             try:
@@ -48,7 +55,7 @@ class UploadSongView(APIView):
                 response_serializer = SongSerializer(song, context={'request': request})
                 
                 return Response({
-                    'message': 'آهنگ با موفقیت آپلود شد',
+                    'message': 'آهنگ با موفقیت آپلود شد و در حال پردازش است',
                     'data': response_serializer.data
                 }, status=status.HTTP_201_CREATED)
             
@@ -76,6 +83,7 @@ class UploadMultipleSongsView(APIView):
             is_public: boolean (default: false)
         }
         """
+        request.upload_handlers = SongBlobStore.upload_handlers(request)
         files = request.FILES.getlist('files')
         if not files:
             return Response({
@@ -157,6 +165,104 @@ class SongListView(APIView):
             }, status=status.HTTP_400_BAD_REQUEST)
 
 
+class SongLookupView(APIView):
+    """
+    API View for finding an already stored copy of a file before uploading it
+    GET /api/music/songs/lookup/?sha256=<hex digest>
+    """
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request):
+        """
+        Find the user's own song, or else a public song, with the same audio bytes
+        If found, POST /api/music/songs/<id>/link/ adds it without uploading the file
+        """
+        try:
+            song, is_own = MusicService.lookup_song_by_hash(
+                user=request.user,
+                sha256=request.query_params.get('sha256')
+            )
+        except ValidationError as e:
+            return Response({
+                'error': e.messages[0]
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            'message': 'این فایل قبلاً ذخیره شده است' if song else 'فایلی با این محتوا یافت نشد',
+            'is_own': is_own,
+            'data': SongSerializer(song, context={'request': request}).data if song else None
+        }, status=status.HTTP_200_OK)
+
+
+class LinkSongView(APIView):
+    """
+    API View for adding a stored song to the user's library without uploading it again
+    POST /api/music/songs/<id>/link/
+    """
+    permission_classes = [IsAuthenticated]
+    parser_classes = [JSONParser, FormParser]
+    
+    def post(self, request, song_id):
+        """
+        Create a song of the user sharing the file (and metadata) of song_id
+        Body: {
+            is_public: boolean (default: false)
+        }
+        """
+        is_public = str(request.data.get('is_public', 'false')).lower() == 'true'
+        try:
+            song, created = MusicService.link_song(song_id=song_id, user=request.user, is_public=is_public)
+        except Song.DoesNotExist:
+            return Response({
+                'error': 'آهنگ یافت نشد'
+            }, status=status.HTTP_404_NOT_FOUND)
+        except ValidationError as e:
+            return Response({
+                'error': e.messages[0]
+            }, status=status.HTTP_403_FORBIDDEN)
+        
+        serializer = SongSerializer(song, context={'request': request})
+        return Response({
+            'message': 'آهنگ به کتابخانه شما اضافه شد' if created else 'این آهنگ در کتابخانه شما وجود دارد',
+            'data': serializer.data
+        }, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+
+class SongIngestStatusView(APIView):
+    """
+    API View for polling the processing state of uploaded songs
+    GET /api/music/songs/ingest-status/
+    """
+    permission_classes = [IsAuthenticated]
+    
+    # Most songs that can be polled at once
+    MAX_IDS = 100
+    
+    def get(self, request):
+        """
+        Get the processing state of the user's uploads
+        Query params:
+            - ids: Optional comma separated song IDs (default: songs still processing)
+        """
+        ids = request.query_params.get('ids')
+        song_ids = None
+        if ids:
+            try:
+                song_ids = [int(song_id) for song_id in ids.split(',') if song_id.strip()][:self.MAX_IDS]
+            except ValueError:
+                return Response({
+                    'error': 'شناسه آهنگ‌ها نامعتبر است'
+                }, status=status.HTTP_400_BAD_REQUEST)
+        
+        songs = MusicService.get_ingest_status(user=request.user, song_ids=song_ids)
+        serializer = SongIngestStatusSerializer(songs, many=True)
+        
+        return Response({
+            'message': 'وضعیت پردازش آهنگ‌ها با موفقیت دریافت شد',
+            'data': serializer.data
+        }, status=status.HTTP_200_OK)
+
+
 class PlaylistListView(APIView):
     """
     API View for listing user playlists
@@ -582,6 +688,7 @@ class UpdateSongsPublicStatusView(APIView):
             
             # Update all songs
             updated_count = songs.update(is_public=bool(is_public))
+            SongSearchIndex.index_songs(songs)
             
             return Response({
                 'message': f'{updated_count} آهنگ با موفقیت به‌روزرسانی شد',
@@ -595,6 +702,67 @@ class UpdateSongsPublicStatusView(APIView):
             }, status=status.HTTP_400_BAD_REQUEST)
 
 
+class SongStreamView(APIView):
+    """
+    API View for streaming a song file to the player
+    GET /api/music/songs/<id>/stream/
+    """
+    permission_classes = [IsAuthenticated]
+    # <audio src> cannot send headers: the player passes ?token=
+    authentication_classes = [QueryTokenJWTAuthentication]
+    
+    CONTENT_TYPES = {
+        '.mp3': 'audio/mpeg',
+        '.wav': 'audio/wav',
+        '.flac': 'audio/flac',
+        '.m4a': 'audio/mp4',
+        '.ogg': 'audio/ogg',
+        '.aac': 'audio/aac',
+    }
+    
+    # A song's file never changes in place, revalidation is only needed after a day
+    CACHE_CONTROL = 'private, max-age=86400'
+    
+    def get(self, request, song_id):
+        """
+        Stream a song the user may play (own, public or shared through a playlist)
+        Supports Range (206 for seeking), If-None-Match / If-Modified-Since and If-Range
+        Offloaded to the web server when SENDFILE_BACKEND is set
+        """
+        try:
+            song = MusicService.get_playable_song(song_id=song_id, user=request.user)
+        except Song.DoesNotExist:
+            return Response({
+                'error': 'آهنگ یافت نشد'
+            }, status=status.HTTP_404_NOT_FOUND)
+        except ValidationError as e:
+            return Response({
+                'error': e.messages[0]
+            }, status=status.HTTP_403_FORBIDDEN)
+        
+        try:
+            size = song.file_size or song.file.size
+        except (OSError, ValueError):
+            return Response({
+                'error': 'فایل آهنگ یافت نشد'
+            }, status=status.HTTP_404_NOT_FOUND)
+        
+        extension = os.path.splitext(song.file.name)[1].lower()
+        download = FileDownload(
+            file=song.file,
+            size=size,
+            # Blobs are content-addressed, their hash is a strong validator
+            etag=song.blob.sha256 if song.blob_id else f'song-{song.id}-{size}-{int(song.created_at.timestamp())}',
+            last_modified=song.created_at,
+            # Stored names are content hashes, the title is what a saved copy should be called
+            filename=f'{song.title}{extension}',
+            content_type=self.CONTENT_TYPES.get(extension),
+            as_attachment=False,
+            cache_control=self.CACHE_CONTROL
+        )
+        return download.response(request)
+
+
 class ToggleFavoriteSongView(APIView):
     """
     API View for toggling favorite status of a song
@@ -5,6 +5,10 @@ let currentType = 'inbox';
 let currentMessageId = null;
 let searchTimeout = null;
 let currentSearchQuery = '';
+let eventSource = null;
+let nextCursor = null;
+let listedSearchQuery = '';
+let loadingMore = false;
 
 document.addEventListener('DOMContentLoaded', function() {
     hideLoading();
@@ -12,8 +16,55 @@ document.addEventListener('DOMContentLoaded', function() {
     setupEventListeners();
     updateArchiveButton();
     loadMessages('inbox');
+    subscribeToEvents();
 });
 
+// Live mailbox updates (Server-Sent Events); EventSource cannot send headers, so the token goes in the query
+function subscribeToEvents() {
+    const token = localStorage.getItem('access_token');
+    if (!token || !window.EventSource) {
+        return;
+    }
+
+    eventSource = new EventSource(`${API_BASE_URL}/events/?token=${encodeURIComponent(token)}`);
+
+    eventSource.addEventListener('message.new', function() {
+        if (['inbox', 'all'].includes(currentType) && !currentSearchQuery) {
+            loadMessages(currentType).catch(err => console.error('Error reloading messages:', err));
+        }
+    });
+
+    eventSource.addEventListener('message.updated', function(e) {
+        const event = JSON.parse(e.data);
+        const changes = event.changes || {};
+        // Moves between folders change the list itself
+        if ('is_archived' in changes || 'is_spam' in changes) {
+            loadMessages(currentType, currentSearchQuery).catch(err => console.error('Error reloading messages:', err));
+            return;
+        }
+        currentMessages.forEach(msg => {
+            if (!event.ids.includes(msg.id)) {
+                return;
+            }
+            if ('is_starred' in changes) {
+                msg.is_starred = changes.is_starred;
+            }
+            if (changes.is_read === true || changes.status === 'read') {
+                msg.read_at = msg.read_at || new Date().toISOString();
+            } else if (changes.is_read === false) {
+                msg.read_at = null;
+            }
+        });
+        displayMessages(currentMessages);
+    });
+
+    eventSource.addEventListener('message.removed', function(e) {
+        const event = JSON.parse(e.data);
+        currentMessages = currentMessages.filter(msg => !event.ids.includes(msg.id));
+        displayMessages(currentMessages);
+    });
+}
+
 function checkAuth() {
     const token = localStorage.getItem('access_token');
     if (!token) {
@@ -46,6 +97,13 @@ function setupEventListeners() {
         loadMessages(currentType);
     });
 
+    // Infinite scroll: the next page is loaded when the list is scrolled near its end
+    document.getElementById('messagesList').addEventListener('scroll', function() {
+        if (this.scrollTop + this.clientHeight >= this.scrollHeight - 200) {
+            loadMoreMessages();
+        }
+    });
+
     document.getElementById('composeBtn').addEventListener('click', function() {
         openComposeModal();
     });
@@ -92,6 +150,8 @@ function setupEventListeners() {
 
 async function loadMessages(type = 'inbox', searchQuery = '') {
     currentType = type;
+    listedSearchQuery = searchQuery ? searchQuery.trim() : '';
+    nextCursor = null;
     const token = localStorage.getItem('access_token');
     
     if (!token) {
@@ -109,7 +169,7 @@ async function loadMessages(type = 'inbox', searchQuery = '') {
     `;
 
     try {
-        let url = `${API_BASE_URL}/list/?type=${type}`;
+        let url = `${API_BASE_URL}/list/?type=${type}&with_count=true`;
         if (searchQuery && searchQuery.trim()) {
             url += `&search=${encodeURIComponent(searchQuery.trim())}`;
         }
@@ -133,6 +193,7 @@ async function loadMessages(type = 'inbox', searchQuery = '') {
 
         if (response.ok && data.data) {
             currentMessages = data.data;
+            nextCursor = data.next;
             displayMessages(data.data);
             updateMessagesCount(data.count || data.data.length);
             updateInboxBadge(data.data.filter(msg => !msg.read_at && msg.receiver_email).length);
@@ -146,6 +207,60 @@ async function loadMessages(type = 'inbox', searchQuery = '') {
     }
 }
 
+// Older pages are fetched with the `next` cursor of the last page and appended to the list
+async function loadMoreMessages() {
+    const token = localStorage.getItem('access_token');
+    if (!nextCursor || loadingMore || !token) {
+        return;
+    }
+    loadingMore = true;
+    const type = currentType;
+    const searchQuery = listedSearchQuery;
+    const cursor = nextCursor;
+
+    try {
+        let url = `${API_BASE_URL}/list/?type=${type}&cursor=${encodeURIComponent(cursor)}`;
+        if (searchQuery) {
+            url += `&search=${encodeURIComponent(searchQuery)}`;
+        }
+
+        const response = await fetch(url, {
+            method: 'GET',
+            headers: {
+                'Authorization': `Bearer ${token}`,
+                'Content-Type': 'application/json',
+            }
+        });
+
+        if (response.status === 401) {
+            localStorage.removeItem('access_token');
+            localStorage.removeItem('refresh_token');
+            window.location.href = '/';
+            return;
+        }
+
+        const data = await response.json();
+
+        // The folder or search changed while the page was loading
+        if (type !== currentType || searchQuery !== listedSearchQuery || cursor !== nextCursor) {
+            return;
+        }
+
+        if (response.ok && data.data) {
+            const loadedIds = new Set(currentMessages.map(msg => msg.id));
+            currentMessages = currentMessages.concat(data.data.filter(msg => !loadedIds.has(msg.id)));
+            nextCursor = data.next;
+            displayMessages(currentMessages);
+        } else {
+            showError('خطا در دریافت پیام‌ها');
+        }
+    } catch (error) {
+        console.error('Error:', error);
+    } finally {
+        loadingMore = false;
+    }
+}
+
 function performSearch(query) {
     if (query && query.trim()) {
         loadMessages(currentType, query);
@@ -170,6 +285,14 @@ function displayMessages(messages) {
     }
 
     messagesList.innerHTML = messages.map(message => createMessageHTML(message)).join('');
+    if (nextCursor) {
+        messagesList.insertAdjacentHTML('beforeend', `
+            <div class="load-more">
+                <button class="load-more-btn" id="loadMoreBtn">پیام‌های قدیمی‌تر</button>
+            </div>
+        `);
+        document.getElementById('loadMoreBtn').addEventListener('click', loadMoreMessages);
+    }
     
     const messageItems = document.querySelectorAll('.message-item');
     messageItems.forEach((item, index) => {
@@ -185,7 +308,7 @@ function displayMessages(messages) {
 function createMessageHTML(message) {
     const isUnread = message.status !== 'read' && message.receiver_email;
     const senderName = message.sender_name || message.sender_username || message.sender_email;
-    const preview = message.body ? (message.body.length > 100 ? message.body.substring(0, 100) + '...' : message.body) : '';
+    const preview = message.snippet || '';
     const time = formatTime(message.created_at);
     
     let badges = '';
@@ -297,6 +420,9 @@ function escapeHtml(text) {
 }
 
 function logout() {
+    if (eventSource) {
+        eventSource.close();
+    }
     localStorage.removeItem('access_token');
     localStorage.removeItem('refresh_token');
     localStorage.removeItem('remember_me');
@@ -753,6 +879,11 @@ function displayMessageDetailInModal(message) {
     // بر اساس درخواست شما، بخش نمایش گیرنده را به‌طور کامل حذف کردیم
     const receiverInfo = '';
     
+    // A download link cannot send the Authorization header, so the URL carries the token
+    const token = localStorage.getItem('access_token');
+    const attachmentUrl = message.attachment_url && token
+        ? `${message.attachment_url}?token=${encodeURIComponent(token)}`
+        : message.attachment_url;
     const attachmentSection = message.has_attachment && message.attachment_url
         ? `
             <div style="margin-top: 20px; padding: 15px; background: rgba(42, 42, 62, 0.4); border-radius: 10px; display: flex; align-items: center; gap: 15px;">
@@ -761,7 +892,7 @@ function displayMessageDetailInModal(message) {
                     <div style="font-weight: 600; color: var(--arcane-white);">${escapeHtml(message.attachment_name || 'فایل ضمیمه')}</div>
                     <div style="font-size: 0.9em; color: rgba(255, 255, 255, 0.7);">حجم: ${message.attachment_size || 0} مگابایت</div>
                 </div>
-                <a href="${message.attachment_url}" style="padding: 8px 15px; background: var(--arcane-purple); border: none; border-radius: 8px; color: var(--arcane-white); cursor: pointer; text-decoration: none; display: inline-block;" download>دانلود</a>
+                <a href="${attachmentUrl}" style="padding: 8px 15px; background: var(--arcane-purple); border: none; border-radius: 8px; color: var(--arcane-white); cursor: pointer; text-decoration: none; display: inline-block;" download>دانلود</a>
             </div>
         `
         : '';
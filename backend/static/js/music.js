@@ -525,6 +525,7 @@ async function uploadFiles(files) {
                 document.getElementById('singleFileInput').value = '';
                 loadSongs();
             }, 2000);
+            waitForIngest(data.data.map(song => song.id));
         } else {
             progressText.textContent = `❌ خطا: ${data.error || 'خطا در آپلود'}`;
         }
@@ -533,6 +534,28 @@ async function uploadFiles(files) {
     }
 }
 
+// Uploaded songs are processed in the background: reload the list once their metadata is ready
+async function waitForIngest(songIds, attempts = 30) {
+    if (!songIds.length || attempts <= 0) return;
+    await new Promise(resolve => setTimeout(resolve, 2000));
+    
+    try {
+        const response = await fetch(`${API_BASE_URL}/songs/ingest-status/?ids=${songIds.join(',')}`, {
+            headers: getAuthHeaders()
+        });
+        const data = await response.json();
+        if (!response.ok) return;
+        
+        const pending = data.data.filter(song => song.status === 'processing').map(song => song.id);
+        if (pending.length < songIds.length) {
+            loadSongs();
+        }
+        waitForIngest(pending, attempts - 1);
+    } catch (error) {
+        console.error('Error checking upload status:', error);
+    }
+}
+
 // Playlist Management
 function openCreatePlaylistModal() {
     document.getElementById('createPlaylistModal').style.display = 'flex';
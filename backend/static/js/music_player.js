@@ -28,6 +28,12 @@ function playSongFromPlaylist(songId, index) {
     playSong(song);
 }
 
+// <audio> cannot send the Authorization header, so the stream URL carries the token
+function getStreamUrl(song) {
+    const token = localStorage.getItem('access_token');
+    return `${song.file_url}?token=${encodeURIComponent(token)}`;
+}
+
 function playSong(song, startPosition = null) {
     if (!audioPlayer) return;
     
@@ -39,7 +45,7 @@ function playSong(song, startPosition = null) {
     document.getElementById('musicPlayer').style.display = 'flex';
     
     // Load and play
-    audioPlayer.src = song.file_url;
+    audioPlayer.src = getStreamUrl(song);
     audioPlayer.load();
     
     // Set start position if provided
@@ -424,7 +430,7 @@ async function loadPlaybackState() {
                 document.getElementById('currentSongArtist').textContent = song.artist || 'خواننده نامشخص';
                 document.getElementById('musicPlayer').style.display = 'flex';
                 
-                audioPlayer.src = song.file_url;
+                audioPlayer.src = getStreamUrl(song);
                 audioPlayer.load();
                 
                 // Set position after metadata loads